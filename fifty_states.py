@@ -1,15 +1,16 @@
 """
 This example downloads ASCS and CVAP shapefiles of all United States plus DC
 and Puerto Rico. 
+
+Progress is kept in a journal, so running this again after a crash picks
+up where it left off. See tools/batch.py.
 """
 
 import us
-from tqdm import tqdm
-from tools.census_adder import make_race_cvap_shp
+from tools.batch import run_batch
 
 allstates = us.states.STATES + [us.states.DC, us.states.PR]
 
 allstates = allstates[:5]
 
-for state in tqdm(allstates):
-    make_race_cvap_shp(state.abbr, download_allowed=True)
\ No newline at end of file
+run_batch([state.abbr for state in allstates], download_allowed=True)
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools import crosswalk
+from tools.crosswalk import make_crosswalk, crosswalk_counts
+from tools.geoid import attach_geoid_keys
+from tools.schema import conform_to_schema
+
+
+def relationships():
+    """
+    Pieces of 2010 blocks within 2020 blocks of one tract: block group 1
+    by land, block group 2 of water alone and block group 3 of neither.
+    """
+    pieces = [
+        # 2010 block, 2020 block, land, water
+        ("1001", "1000", 30, 0),
+        ("1001", "2000", 10, 0),
+        ("1002", "2001", 60, 0),
+        ("2000", "2000", 0, 5),
+        ("3000", "3000", 0, 0),
+        ("3001", "1000", 0, 0),
+    ]
+    return pd.DataFrame({
+        "STATE_2010": "15", "COUNTY_2010": "001", "TRACT_2010": "020100",
+        "BLK_2010": [piece[0] for piece in pieces],
+        "STATE_2020": "15", "COUNTY_2020": "001", "TRACT_2020": "020100",
+        "BLK_2020": [piece[1] for piece in pieces],
+        "AREALAND_INT": [str(piece[2]) for piece in pieces],
+        "AREAWATER_INT": [str(piece[3]) for piece in pieces],
+    })
+
+def block_weights():
+    return pd.DataFrame({"BLOCKID10": ["150010201001001", "150010201001002"],
+                         "POP10": [0, 9]})
+
+@pytest.mark.parametrize("weights", [None, block_weights()])
+@pytest.mark.parametrize("target_level", ["block_group", "block"])
+def test_columns_add_up_to_one(target_level, weights):
+    matrix = make_crosswalk(relationships(), target_level, weights)["matrix"]
+    assert matrix.sum(axis=0) == pytest.approx(np.ones(3))
+
+def test_block_groups_split_by_land_then_water_then_equally():
+    cw = make_crosswalk(relationships(), "block")
+    assert cw["source_keys"].tolist() == [150010201001, 150010201002,
+                                          150010201003]
+    assert cw["target_keys"].tolist() == [150010201001000, 150010201002000,
+                                          150010201002001, 150010201003000]
+    assert cw["matrix"].toarray() == pytest.approx(np.array([
+        [0.3, 0.0, 0.5],
+        [0.1, 1.0, 0.0],
+        [0.6, 0.0, 0.0],
+        [0.0, 0.0, 0.5],
+    ]))
+
+def test_block_weights_take_precedence_over_land():
+    cw = make_crosswalk(relationships(), "block", block_weights())
+    assert cw["matrix"].toarray()[:, 0] == pytest.approx([0, 0, 1, 0])
+
+def test_renamed_counties_meet_their_2019_keys():
+    renamed = relationships().assign(STATE_2010="46", COUNTY_2010="113",
+                                     STATE_2020="46", COUNTY_2020="102")
+    cw = make_crosswalk(renamed)
+    assert cw["source_keys"].tolist()[0] == 461020201001
+
+def test_counts_keep_state_totals(monkeypatch):
+    monkeypatch.setattr(crosswalk, "get_crosswalk",
+                        lambda *args: make_crosswalk(relationships(),
+                                                     args[1]))
+    bgs = conform_to_schema(attach_geoid_keys(pd.DataFrame({
+        "GEOID": ["150010201001", "150010201002", "150010201003"],
+        "TOTPOP": [100, 7, 12],
+        "CVAP": [40, 3, 6],
+    })))
+    for target_level in ("block_group", "block"):
+        converted = crosswalk_counts(bgs, "HI", target_level)
+        assert converted["TOTPOP"].sum() == pytest.approx(119)
+        assert converted["CVAP"].sum() == pytest.approx(49)
@@ -0,0 +1,64 @@
+import os
+
+from tools.csv_index import build_csv_index, get_csv_index, \
+                            read_indexed_rows, index_filename
+
+
+HEADER = "geoname,geoid,cvap_est\n"
+ROWS = [
+    '"Block Group 1, Tract 201, Autauga County",15000US010010201001,10\n',
+    '"Block Group 2, Tract 201, Autauga County",15000US010010201002,20\n',
+    '"Block Group 1, Tract 101, Baldwin County",15000US010030101001,30\n',
+    '"Block Group 1, Tract 201, Hawaii County",15000US150010201001,40\n',
+    '"Block Group 1, Tract 101, Aleutians East",15000US020130001001,50\n',
+    '"Block Group 2, Tract 101, Baldwin County",15000US010030101002,60\n',
+]
+
+def write_csv(tmp_path):
+    csv_path = tmp_path / "BlockGr.csv"
+    csv_path.write_text(HEADER + "".join(ROWS))
+    return str(csv_path)
+
+def row_range(first: int, last: int) -> list:
+    """
+    Byte range of ROWS[first] through ROWS[last], counted by hand.
+    """
+    start = len(HEADER) + sum(len(row) for row in ROWS[:first])
+    return [start, start + sum(len(row) for row in ROWS[first:last + 1])]
+
+def test_ranges_match_rows_counted_by_hand(tmp_path):
+    csv_index = build_csv_index(write_csv(tmp_path), "15000US")
+    assert csv_index["header"] == [0, len(HEADER)]
+    assert csv_index["states"] == {
+        "01": [row_range(0, 2), row_range(5, 5)],
+        "15": [row_range(3, 3)],
+        "02": [row_range(4, 4)],
+    }
+    assert csv_index["counties"]["01001"] == [row_range(0, 1)]
+    assert csv_index["counties"]["01003"] == [row_range(2, 2),
+                                              row_range(5, 5)]
+
+def test_indexed_rows_are_the_state_rows(tmp_path):
+    csv_path = write_csv(tmp_path)
+    rows = read_indexed_rows(csv_path, "geoid", "15000US", "01")
+    assert rows["cvap_est"].tolist() == [10, 20, 30, 60]
+    assert rows.columns.tolist() == ["geoname", "geoid", "cvap_est"]
+
+def test_indexed_rows_of_a_county(tmp_path):
+    csv_path = write_csv(tmp_path)
+    rows = read_indexed_rows(csv_path, "geoid", "15000US", "01",
+                             ["geoid", "cvap_est"], ["01003"])
+    assert rows["geoid"].tolist() == ["15000US010030101001",
+                                      "15000US010030101002"]
+
+def test_index_is_saved_and_rebuilt_once_the_csv_changes(tmp_path):
+    csv_path = write_csv(tmp_path)
+    first = get_csv_index(csv_path, "15000US")
+    assert get_csv_index(csv_path, "15000US") == first
+    with open(csv_path, "a") as csv_file:
+        csv_file.write('"Block Group 1",15000US150030001001,70\n')
+    rebuilt = get_csv_index(csv_path, "15000US")
+    assert rebuilt["size"] != first["size"]
+    assert "15003" in rebuilt["counties"]
+    assert os.path.isfile(index_filename(csv_path))
+    assert not [path for path in tmp_path.iterdir() if ".tmp" in path.name]
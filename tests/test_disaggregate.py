@@ -0,0 +1,62 @@
+import warnings
+
+import pandas as pd
+import pytest
+
+from tools.disaggregate import disaggregate_to_blocks
+from tools.geoid import attach_geoid_keys
+from tools.schema import conform_to_schema
+
+
+def race_cvap_bgs():
+    return conform_to_schema(attach_geoid_keys(pd.DataFrame({
+        "GEOID": ["150010201001", "150010201002", "150010201003"],
+        "TOTPOP": [10, 7, 5],
+        "CVAP": [3, 2, None],
+    })))
+
+def block_weights():
+    return pd.DataFrame({
+        "BLOCKID10": ["150010201001000", "150010201001001",
+                      "150010201001002", "150010201002000",
+                      "150010201002001", "150010201002002",
+                      "150010201003000", "150010201003001"],
+        "POP10": [1, 1, 1, 0, 0, 0, 2, 6],
+    })
+
+def block_group_sums(blocks, col):
+    return blocks[col].groupby(blocks["GEOID_KEY"] // 1000).sum(min_count=1)
+
+def test_integer_counts_add_up_to_each_block_group():
+    blocks = disaggregate_to_blocks(race_cvap_bgs(), block_weights(),
+                                    integer=True)
+    assert str(blocks["TOTPOP"].dtype) == "UInt32"
+    assert block_group_sums(blocks, "TOTPOP").tolist() == [10, 7, 5]
+    assert block_group_sums(blocks, "CVAP").tolist()[:2] == [3, 2]
+
+def test_remainders_go_to_the_lowest_geoid_of_a_tie():
+    blocks = disaggregate_to_blocks(race_cvap_bgs(), block_weights(),
+                                    integer=True)
+    assert blocks["TOTPOP"].tolist()[:3] == [4, 3, 3]
+
+def test_weightless_block_group_is_split_equally():
+    blocks = disaggregate_to_blocks(race_cvap_bgs(), block_weights())
+    assert blocks["TOTPOP"].tolist()[3:6] == pytest.approx([7 / 3] * 3)
+    report = blocks.attrs["disaggregation_report"]
+    assert report["weightless_block_groups"]["geoids"] == ["150010201002"]
+
+def test_missing_counts_stay_missing():
+    blocks = disaggregate_to_blocks(race_cvap_bgs(), block_weights(),
+                                    integer=True)
+    assert blocks["CVAP"].iloc[6:].isna().all()
+
+def test_unmatched_blocks_and_block_groups_are_reported():
+    weights = block_weights()
+    weights.loc[len(weights)] = ["159990000000000", 4]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        blocks = disaggregate_to_blocks(race_cvap_bgs().iloc[1:],
+                                        weights)
+    report = blocks.attrs["disaggregation_report"]
+    assert report["blocks_without_block_group"]["count"] == 4
+    assert pd.isna(blocks["TOTPOP"].iloc[0])
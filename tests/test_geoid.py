@@ -0,0 +1,66 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tools.geoid import attach_geoid_keys, geoid_keys_to_strings, \
+                        parse_geoid_keys, sorted_merge
+
+
+def test_keys_skip_the_prefix():
+    geoids = pd.Series(["15000US150070403011", "15000US010010201001"])
+    keys = parse_geoid_keys(geoids, prefix_length=7)
+    assert keys.tolist() == [150070403011, 10010201001]
+
+def test_keys_turn_back_into_padded_strings():
+    keys = np.array([150070403011, 10010201001])
+    assert geoid_keys_to_strings(keys).tolist() == ["150070403011",
+                                                    "010010201001"]
+
+@pytest.mark.parametrize("geoid", ["15007040301", "1500704030111",
+                                   "15007040301x"])
+def test_geoids_of_other_lengths_or_not_digits_raise(geoid):
+    with pytest.raises(ValueError):
+        parse_geoid_keys(pd.Series(["150070403011", geoid]))
+
+def test_attached_keys_sort_the_frame():
+    frame = pd.DataFrame({"geoid": ["15000US150070403011",
+                                    "15000US010010201001"],
+                          "TOTPOP": [5, 7]})
+    frame = attach_geoid_keys(frame, "geoid", prefix_length=7)
+    assert frame["GEOID"].tolist() == ["010010201001", "150070403011"]
+    assert frame["TOTPOP"].tolist() == [7, 5]
+
+def keyed(geoids, **columns):
+    return attach_geoid_keys(pd.DataFrame({"GEOID": geoids, **columns}))
+
+def test_left_merge_keeps_base_and_reports_unmatched():
+    tiger = keyed(["150010201001", "150010201002", "150030101001"])
+    cvap = keyed(["150010201001", "150030101001", "159999999999"],
+                 CVAP=[1, 2, 3])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        merged = sorted_merge(tiger, [cvap], how="left",
+                              names=["tiger", "cvap"])
+    assert merged["CVAP"].tolist()[0::2] == [1, 2]
+    assert pd.isna(merged["CVAP"].iloc[1])
+    report = merged.attrs["join_report"]
+    assert report["tiger"]["geoids"] == ["150010201002"]
+    assert report["cvap"]["geoids"] == ["159999999999"]
+
+def test_inner_merge_keeps_keys_found_in_every_frame():
+    tiger = keyed(["150010201001", "150010201002", "150030101001"])
+    cvap = keyed(["150010201001", "150030101001"], CVAP=[1, 2])
+    race = keyed(["150010201002", "150030101001"], TOTPOP=[8, 9])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        merged = sorted_merge(tiger, [cvap, race])
+    assert merged["GEOID_KEY"].tolist() == [150030101001]
+    assert merged[["CVAP", "TOTPOP"]].values.tolist() == [[2, 9]]
+
+def test_unsorted_keys_raise():
+    tiger = keyed(["150010201001", "150030101001"])
+    unsorted = tiger.iloc[::-1]
+    with pytest.raises(ValueError):
+        sorted_merge(tiger, [unsorted])
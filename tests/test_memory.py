@@ -0,0 +1,22 @@
+import time
+
+from tools.memory import run_within_budget
+
+
+def test_jobs_are_started_only_once_they_fit():
+    events = []
+    jobs = [(name, 80, time.sleep, (0.2,)) for name in ("CA", "TX")]
+    for name, result, error in run_within_budget(
+            jobs, budget_mb=100, max_workers=2,
+            on_start=lambda name: events.append(("start", name))):
+        assert error is None
+        events.append(("finish", name))
+    assert events == [("start", "CA"), ("finish", "CA"),
+                      ("start", "TX"), ("finish", "TX")]
+
+def test_jobs_that_fit_together_start_together():
+    started = []
+    jobs = [(name, 40, time.sleep, (0.1,)) for name in ("HI", "RI")]
+    finished = [name for name, _, _ in run_within_budget(
+        jobs, budget_mb=100, max_workers=2, on_start=started.append)]
+    assert started == ["HI", "RI"] and sorted(finished) == ["HI", "RI"]
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from tools import settings as SET
+from tools.scheduler import make_state_tasks, run_tasks
+
+
+def fail():
+    raise ValueError("no CVAP")
+
+def slow_tiger():
+    time.sleep(0.2)
+    return "tiger"
+
+def state_tasks():
+    return [
+        {"name": "HI:cvap", "pool": "cpu", "func": fail},
+        {"name": "HI:tiger", "pool": "disk", "func": slow_tiger},
+        {"name": "HI:merge", "pool": "cpu", "func": lambda *inputs: inputs,
+         "inputs": ["HI:tiger", "HI:cvap"]},
+        {"name": "HI:write", "pool": "disk", "func": lambda merged: "HI.shp",
+         "inputs": ["HI:merge"]},
+        {"name": "RI:write", "pool": "disk", "func": lambda: "RI.shp"},
+    ]
+
+def test_slower_input_of_failed_task_is_not_returned():
+    results, errors = run_tasks(state_tasks(), {"cpu": 2, "disk": 2})
+    assert results == {"RI:write": "RI.shp"}
+    assert set(errors) == {"HI:cvap", "HI:merge", "HI:write"}
+
+def test_kept_input_of_failed_task_is_returned():
+    tasks = state_tasks()
+    tasks[1]["keep"] = True
+    results, errors = run_tasks(tasks, {"cpu": 2, "disk": 2})
+    assert results == {"HI:tiger": "tiger", "RI:write": "RI.shp"}
+
+def test_results_of_used_tasks_are_let_go():
+    tasks = [
+        {"name": "a", "func": lambda: 1},
+        {"name": "b", "func": lambda a: a + 1, "inputs": ["a"]},
+    ]
+    results, errors = run_tasks(tasks, {"cpu": 1})
+    assert results == {"b": 2} and not errors
+
+def test_cycles_raise():
+    tasks = [
+        {"name": "a", "func": lambda b: b, "inputs": ["b"]},
+        {"name": "b", "func": lambda a: a, "inputs": ["a"]},
+    ]
+    with pytest.raises(ValueError):
+        run_tasks(tasks, {"cpu": 1})
+
+@pytest.mark.parametrize("plugin, pool", [("CensusAPI", "network"),
+                                          ("NHGIS", "cpu"),
+                                          ("SummaryFile", "disk")])
+def test_race_task_runs_in_the_pool_of_its_plugin(monkeypatch, plugin, pool):
+    monkeypatch.setattr(SET, "ACS_PLUGIN", plugin)
+    pools = {task["name"]: task["pool"] for task in make_state_tasks("HI")}
+    assert pools["HI:race"] == pool
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+from tools.schema import COUNT_DTYPE, conform_to_schema, to_output_dtypes, \
+                         validate_schema
+
+
+def raw_bgs():
+    return pd.DataFrame({
+        "GEOID": ["150010201001", "150010201002"],
+        "GEOID_KEY": [150010201001, 150010201002],
+        "TOTPOP": [12.0, float("nan")],
+        "HISP": ["3", "-666666666"],
+        "CVAP": [4, 5],
+        "NAME": ["a", "b"],
+    })
+
+def test_counts_conform_with_missing_kept_as_na():
+    bgs = conform_to_schema(raw_bgs())
+    validate_schema(bgs, "test")
+    assert str(bgs["GEOID"].dtype) == "category"
+    assert (bgs[["TOTPOP", "HISP", "CVAP"]].dtypes == COUNT_DTYPE).all()
+    assert bgs["HISP"].tolist()[0] == 3 and pd.isna(bgs["HISP"].iloc[1])
+    assert bgs["NAME"].tolist() == ["a", "b"]
+
+def test_round_trip_keeps_values_in_plain_dtypes():
+    bgs = to_output_dtypes(conform_to_schema(raw_bgs()))
+    assert "GEOID_KEY" not in bgs.columns
+    assert bgs["GEOID"].tolist() == ["150010201001", "150010201002"]
+    assert str(bgs["CVAP"].dtype) == "int64"
+    assert str(bgs["TOTPOP"].dtype) == "float64"
+    assert bgs["TOTPOP"].iloc[0] == 12 and pd.isna(bgs["TOTPOP"].iloc[1])
+
+def test_float_columns_are_float_without_missing_values():
+    bgs = to_output_dtypes(conform_to_schema(raw_bgs()), ["CVAP"])
+    assert str(bgs["CVAP"].dtype) == "float64"
+
+def test_wrong_dtypes_raise():
+    with pytest.raises(ValueError, match="TOTPOP"):
+        validate_schema(raw_bgs().astype({"GEOID": "category"}), "test")
+
+def test_unsorted_keys_raise():
+    bgs = conform_to_schema(raw_bgs()).iloc[::-1]
+    with pytest.raises(ValueError, match="sorted"):
+        validate_schema(bgs, "test")
+
+def test_geoids_of_another_level_raise():
+    bgs = conform_to_schema(raw_bgs())
+    with pytest.raises(ValueError, match="11 characters"):
+        validate_schema(bgs, "tract", 11)
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from tools.geoid import attach_geoid_keys
+from tools.schema import conform_to_schema
+from tools.validate import RACE_PARTS, validate_race_cvap
+
+
+def race_cvap_bgs(**changes):
+    """
+    Two block groups passing every check, with changes to the first.
+    """
+    bgs = pd.DataFrame({
+        "GEOID": ["150010201001", "150010201002"],
+        "TOTPOP": [16, 8], "CPOP": [10, 6], "CVAP": [8, 4],
+        "HCVAP": [2, 1], "WCVAP": [6, 3],
+        **{col: [2, 1] for col in RACE_PARTS},
+    })
+    for col, value in changes.items():
+        bgs[col] = bgs[col].astype(object)
+        bgs.loc[0, col] = value
+    return conform_to_schema(attach_geoid_keys(bgs))
+
+def test_clean_block_groups_pass_strictly():
+    report = validate_race_cvap(race_cvap_bgs(), "HI", strict=True)
+    assert report["passed"] and report["rows"] == 2
+
+@pytest.mark.parametrize("changes, check", [
+    ({"TOTPOP": 17}, "race_sum_is_totpop"),
+    ({"CVAP": 11}, "cvap_at_most_cpop"),
+    ({"HCVAP": 9}, "cvap_groups_at_most_cvap"),
+    ({"CVAP": None}, "tiger_without_cvap"),
+])
+def test_failed_checks_raise_when_strict(changes, check):
+    bgs = race_cvap_bgs(**changes)
+    report = validate_race_cvap(bgs, "HI", strict=False)
+    assert not report["passed"]
+    assert report["checks"][check] == {"failed": 1,
+                                       "geoids": ["150010201001"]}
+    with pytest.raises(ValueError, match=check):
+        validate_race_cvap(bgs, "HI", strict=True)
+
+def test_unmatched_geoids_of_the_join_raise_when_strict():
+    bgs = race_cvap_bgs()
+    bgs.attrs["join_report"] = {"cvap": {"count": 1,
+                                         "geoids": ["150019999999"]}}
+    with pytest.raises(ValueError, match="unmatched_cvap"):
+        validate_race_cvap(bgs, "HI", strict=True)
@@ -1,6 +1,24 @@
 from tools import settings
+from tools import schema
+from tools import geoid
+from tools import selection
+from tools import validate
+from tools import csv_index
+from tools import ingest
 from tools import nhgis
 from tools import census2019
+from tools import acs_summary_file
 from tools import tiger
+from tools import simplify
+from tools import rollup
+from tools import point_lookup
+from tools import disaggregate
+from tools import topology
+from tools import graph
 from tools import cvap2019
-from tools import census_adder
\ No newline at end of file
+from tools import census_adder
+from tools import memory
+from tools import batch
+from tools import scheduler
+from tools import service
+from tools import shards
\ No newline at end of file
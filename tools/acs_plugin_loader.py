@@ -13,29 +13,45 @@ get_race_origin_bgs = acs_plugin_loader.load_plugin(ACS_PLUGIN)
 """
 import importlib
 
-def set_race_origin_bgs(plugin_name: str):
-    race_origin_function = ""
-    if plugin_name is "NHGIS":
-        try:
-            mymodule = importlib.import_module("nhgis")
-        except:
-            try:
-                mymodule = importlib.import_module("tools.nhgis")
-            except:
-                print("No NHGIS module!")
-                raise
-        race_origin_function = mymodule.get_nhgis_race_bgs
-    elif plugin_name is "CensusAPI":
+# Module, getter and dictionary of source to MGGG names of each plugin,
+# with the name used when its module is missing
+PLUGINS = {
+    "NHGIS": ("nhgis", "get_nhgis_race_bgs", "NHGIS_RACE_NAMES",
+              "NHGIS"),
+    "CensusAPI": ("census2019", "get_censusapi_race_bgs", "CENSUS_NAMES",
+                  "Census2019 API"),
+    "SummaryFile": ("acs_summary_file", "get_summary_file_race_bgs",
+                    "SUMMARY_FILE_RACE_NAMES", "ACS Summary File"),
+}
+
+def import_plugin(plugin_name: str):
+    """
+    Imports the module of a plugin, in project or editor namespace.
+    """
+    if plugin_name not in PLUGINS:
+        raise NameError("NoModuleSet")
+    module_name, _, _, label = PLUGINS[plugin_name]
+    try:
+        mymodule = importlib.import_module(module_name)
+    except:
         try:
-            mymodule = importlib.import_module("census2019")
+            mymodule = importlib.import_module(f"tools.{module_name}")
         except:
-            try:
-                mymodule = importlib.import_module("tools.census2019")
-            except:
-                print("No Census2019 API module!")
-                raise
-        race_origin_function = mymodule.get_censusapi_race_bgs
-    else:
-        raise NameError("NoModuleSet")
+            print(f"No {label} module!")
+            raise
+    return mymodule
+
+def set_race_origin_bgs(plugin_name: str):
+    mymodule = import_plugin(plugin_name)
+    race_origin_function = getattr(mymodule, PLUGINS[plugin_name][1])
+
+    return race_origin_function
 
-    return race_origin_function
\ No newline at end of file
+def get_race_origin_columns(plugin_name: str) -> list:
+    """
+    Returns the MGGG columns the race data of a plugin can hold, e.g.
+    ["TOTPOP", "NH_WHITE", ...], to check what callers ask for.
+    """
+    mymodule = import_plugin(plugin_name)
+    names = getattr(mymodule, PLUGINS[plugin_name][2])
+    return list(dict.fromkeys(names.values()))
@@ -0,0 +1,325 @@
+"""
+This module takes ACS tables from the bulk ACS 5-Year Summary File and
+returns pandas DataFrames of block groups, following MGGG naming
+conventions for Race and Origin.
+
+This is a third way to collect ACS data, after NHGIS and the Census
+API. The table-based Summary File holds one table for every geography
+in the nation in a single file, so a bulk run needs neither thousands
+of API calls nor an NHGIS account.
+
+Finally, in the settings, we can set ACS_PLUGIN = "SummaryFile" to use
+get_summary_file_race_bgs as the engine for get_race_origin_bgs.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, get_summary_file_race_bgs returns B03002 Race and Origin data
+    of the block groups of a state, following MGGG naming standards.
+
+    hi_race_bgs = get_summary_file_race_bgs("HI")
+
+    Second, get_summary_file_table_bgs returns any other table of the
+    Summary File the same way, with columns named as we like.
+
+    hi_income_bgs = get_summary_file_table_bgs(
+        "HI", "B19013", {"B19013_E001": "MEDINC"})
+
+Notes
+-----
+Summary File tables must be downloaded manually, one .dat file per
+table, from
+
+https://www2.census.gov/programs-surveys/acs/summary_file/
+
+and stored in LOCAL_SUMMARY_FILE_FOLDER, e.g.
+
+data/ACS5YSummaryFile/acsdt5y2019-b03002.dat
+
+Each file is pipe-delimited, with a long GEO_ID, e.g.
+"1500000US150010201001", followed by an estimate and a margin of error
+for each line of the table, e.g. B03002_E001 and B03002_M001. Only the
+estimates are kept.
+
+SUMMARY_FILE_PREFIX must name the same year as the TIGER files in
+settings, 2019 by default, as GEOIDs of other years name other block
+groups. Reading a table raises ValueError otherwise. The Census first
+published table-based files for 2017-2021 estimates, on 2020 block
+groups, so earlier years must first be laid out the same way. A later
+Summary File may only be read with crosswalked=True, by a caller that
+matches it against counts converted to 2020 block groups through
+tools.crosswalk.
+
+The first call for a table reads the whole national file once, in
+chunks under MEMORY_CEILING_MB, and caches the block groups of every
+state as its own parquet file, e.g.
+
+data/ACS5YSummaryFile/cache/b03002/STATEFP=15.parquet
+
+Every later call, for any state, reads only its own cached file.
+"""
+import os
+import re
+import shutil
+import threading
+from collections import defaultdict
+
+import pandas as pd
+import us
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from schema import conform_to_schema, project_names
+except: from tools.schema import conform_to_schema, project_names
+
+try: from geoid import attach_geoid_keys
+except: from tools.geoid import attach_geoid_keys
+
+try: from ingest import iter_state_chunks
+except: from tools.ingest import iter_state_chunks
+
+try: from selection import selector_prefixes, select_prefixes, \
+                            resolve_selector
+except: from tools.selection import selector_prefixes, select_prefixes, \
+                                   resolve_selector
+
+
+# A dictionary that converts Summary File codes to MGGG-standard names
+SUMMARY_FILE_TABLE = "B03002"
+SUMMARY_FILE_RACE_NAMES = {
+    "B03002_E001": "TOTPOP",
+    "B03002_E003": "NH_WHITE",
+    "B03002_E004": "NH_BLACK",
+    "B03002_E005": "NH_AMIN",
+    "B03002_E006": "NH_ASIAN",
+    "B03002_E007": "NH_NHPI",
+    "B03002_E008": "NH_OTHER",
+    "B03002_E009": "NH_2MORE",
+    "B03002_E012": "HISP"
+}
+
+# Block group GEO_IDs carry a summary level prefix, e.g.
+# "1500000US150010201001"
+SUMMARY_FILE_GEOID_PREFIX = "1500000US"
+
+def check_summary_file(table: str) -> str:
+    """
+    Checks if the Summary File of a table exists in the location
+    specified by the settings. If none found, an exception is raised.
+
+    Parameters
+    ----------
+    table: str
+        ACS table, e.g. "B03002".
+
+    Returns
+    -------
+    str
+        Filepath of the table's Summary File.
+
+    Raises
+    ------
+    ValueError
+        If no file exists at the Summary File filepath.
+
+    """
+    filename = SET.LOCAL_SUMMARY_FILE_FOLDER + \
+               f"{SET.SUMMARY_FILE_PREFIX}{table.lower()}.dat"
+    if not os.path.isfile(filename):
+        # NB: you need to get this file manually
+        raise ValueError(f"No Summary File found at {filename}. " + \
+                         "Please fetch ACS Summary File tables manually.")
+    return filename
+
+def check_summary_file_vintage():
+    """
+    Checks that the Summary File named by SUMMARY_FILE_PREFIX is of the
+    same year as the TIGER block groups named by TIGER_PREFIX, or else
+    raises an exception, as GEOIDs of other years name other block
+    groups.
+
+    Raises
+    ------
+    ValueError
+        If the years differ, or either cannot be read from its prefix.
+
+    """
+    summary_year = re.fullmatch(r"acsdt5y(\d{4})-",
+                                SET.SUMMARY_FILE_PREFIX)
+    tiger_year = re.fullmatch(r"tl_(\d{4})_", SET.TIGER_PREFIX)
+    if summary_year is None or tiger_year is None:
+        raise ValueError("Cannot read the years of SUMMARY_FILE_PREFIX " + \
+                         f"{SET.SUMMARY_FILE_PREFIX!r} and TIGER_PREFIX " + \
+                         f"{SET.TIGER_PREFIX!r}.")
+    if summary_year.group(1) != tiger_year.group(1):
+        raise ValueError(f"Summary File of {summary_year.group(1)} does " + \
+                         "not match TIGER block groups of " + \
+                         f"{tiger_year.group(1)}. Set SUMMARY_FILE_PREFIX " + \
+                         "to the TIGER year, or pass crosswalked=True to " + \
+                         "match them against counts converted with " + \
+                         "tools.crosswalk.")
+
+def build_summary_file_cache(table: str, \
+                             memory_ceiling_mb: int = None) -> str:
+    """
+    Reads the national Summary File of a table once and caches the
+    block group estimates of every state as its own parquet file.
+
+    Parameters
+    ----------
+    table: str
+        ACS table, e.g. "B03002".
+    memory_ceiling_mb: int
+        Memory in megabytes any one chunk may take. Defaults to
+        MEMORY_CEILING_MB in settings.
+
+    Returns
+    -------
+    str
+        Cache folder of the table, e.g.
+        "./data/ACS5YSummaryFile/cache/b03002"
+
+    """
+    filename = check_summary_file(table)
+    cache_folder = os.path.join(SET.SUMMARY_FILE_CACHE, table.lower())
+
+    # Estimates only, leaving out margins of error
+    header = pd.read_csv(filename, sep="|", nrows=0).columns
+    estimates = [col for col in header if col.startswith(f"{table}_E")]
+
+    # Keep only block groups, split by State FIPS
+    state_chunks = defaultdict(list)
+    chunks = iter_state_chunks(filename, "GEO_ID", SUMMARY_FILE_GEOID_PREFIX,
+                               ["GEO_ID"] + estimates, memory_ceiling_mb,
+                               sep="|")
+    for chunk in chunks:
+        geoids = chunk["GEO_ID"].str[len(SUMMARY_FILE_GEOID_PREFIX):]
+        chunk = chunk[estimates].assign(GEOID=geoids)
+        for state_fips, state_chunk in chunk.groupby(geoids.str[:2]):
+            state_chunks[state_fips].append(state_chunk)
+
+    # Write whole then move into place, as other runs may be reading
+    tmp_folder = f"{cache_folder}.tmp{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(tmp_folder)
+    for state_fips, chunk_list in state_chunks.items():
+        pd.concat(chunk_list, ignore_index=True)[["GEOID"] + estimates] \
+            .to_parquet(os.path.join(tmp_folder,
+                                     f"STATEFP={state_fips}.parquet"),
+                        index=False)
+    shutil.rmtree(cache_folder, ignore_errors=True)
+    try:
+        os.replace(tmp_folder, cache_folder)
+    except OSError:
+        # Another run moved its cache of the table into place first
+        shutil.rmtree(tmp_folder)
+    return cache_folder
+
+def get_summary_file_table_bgs(state_abbr: str, table: str, \
+                               names: dict = None, \
+                               memory_ceiling_mb: int = None, \
+                               crosswalked: bool = False):
+    """
+    Returns a pandas DataFrame of Summary File estimates of one table
+    for the block groups of the given state, building the cache of the
+    table first if needed.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    table: str
+        ACS table, e.g. "B03002".
+    names: dict
+        Summary File columns to keep, e.g. "B03002_E001", each with its
+        new name, and only these are read from the cache. Defaults to
+        every estimate, under its own name.
+    memory_ceiling_mb: int
+        Memory in megabytes any one chunk may take while building the
+        cache. Defaults to MEMORY_CEILING_MB in settings.
+    crosswalked: bool
+        Flag that the caller matches estimates of another year than the
+        TIGER files against block groups of that year itself, e.g.
+        counts converted through tools.crosswalk. Defaults to False,
+        raising on a mismatch.
+
+    Returns
+    -------
+    pandas.DataFrame
+        GEOID, GEOID_KEY and estimates of the state's block groups,
+        sorted by GEOID_KEY.
+
+    Raises
+    ------
+    ValueError
+        If the Summary File has no block groups of the state, or is of
+        another year than the TIGER files and crosswalked is False.
+
+    """
+    if not crosswalked:
+        check_summary_file_vintage()
+    state = us.states.lookup(state_abbr)
+    cache_folder = os.path.join(SET.SUMMARY_FILE_CACHE, table.lower())
+    if not os.path.isdir(cache_folder):
+        build_summary_file_cache(table, memory_ceiling_mb)
+
+    state_file = os.path.join(cache_folder, f"STATEFP={state.fips}.parquet")
+    if not os.path.isfile(state_file):
+        raise ValueError(f"No block groups of {state.abbr} found in " + \
+                         f"Summary File table {table}.")
+    columns = ["GEOID"] + list(names) if names is not None else None
+    state_bgs = pd.read_parquet(state_file, columns=columns)
+    if names is not None:
+        state_bgs = state_bgs.rename(columns=names)
+    return attach_geoid_keys(state_bgs, "GEOID")
+
+def get_summary_file_race_bgs(state_abbr: str, \
+                              memory_ceiling_mb: int = None, \
+                              selector: dict = None, \
+                              columns: list = None, \
+                              crosswalked: bool = False):
+    """
+    This returns a pandas DataFrame of ACS Summary File Race and Origin
+    data, table B03002, for the block groups of the given state in
+    columns following MGGG naming standards.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    memory_ceiling_mb: int
+        Memory in megabytes any one chunk may take while building the
+        cache. Defaults to MEMORY_CEILING_MB in settings.
+    selector: dict
+        GEOID prefixes, counties, bbox or mask of the block groups to
+        keep. Default of whole state. See selection.py.
+    columns: list of str
+        MGGG columns to return, e.g. ["TOTPOP", "HISP"], reading only
+        their estimates from the cache. Columns of CVAP data are
+        ignored. Defaults to every column in SUMMARY_FILE_RACE_NAMES.
+    crosswalked: bool
+        Flag that the caller matches estimates of another year than the
+        TIGER files against block groups of that year itself, e.g.
+        counts converted through tools.crosswalk. Defaults to False,
+        raising on a mismatch.
+
+    Returns
+    -------
+    pandas.dataFrame
+        dataFrame of state BGs Race and Origin data following MGGG
+        naming standards.
+
+    """
+    state_bgs = get_summary_file_table_bgs(state_abbr, SUMMARY_FILE_TABLE,
+                                           project_names(
+                                               SUMMARY_FILE_RACE_NAMES,
+                                               columns),
+                                           memory_ceiling_mb,
+                                           crosswalked)
+    # The cache holds one small file per state, so it is sliced once read
+    state_bgs = select_prefixes(state_bgs, selector_prefixes(
+        resolve_selector(state_abbr, selector),
+        us.states.lookup(state_abbr).fips))
+    return conform_to_schema(state_bgs)
@@ -0,0 +1,307 @@
+"""
+Building every state takes hours, and one network blip or one state too
+large for memory used to mean starting over from Alabama. This module
+runs states in a batch that records its progress in a journal file and
+picks up from that journal when run again.
+
+Examples
+--------
+This module has one function meant to be used on its own.
+
+    run_batch builds the shapefile of each state in turn, by default
+    every state plus DC and Puerto Rico, skipping states the journal
+    already lists as done.
+
+    journal = run_batch(download_allowed=True)
+
+    Run the very same line again after a crash and only the states not
+    yet done are built. To retry just the states that failed,
+
+    journal = run_batch(only_failed=True, download_allowed=True)
+
+Notes
+-----
+The journal is a JSON file, by default BATCH_JOURNAL in settings, with
+an entry for each state such as
+
+    "HI": {
+        "status": "done",
+        "attempts": 1,
+        "started": "2021-06-01T12:00:00",
+        "finished": "2021-06-01T12:00:42",
+        "seconds": 42.1,
+        "error": null,
+        "output": "./data/cvap_acs_output/HI_cvap_acs"
+    }
+
+Each state is pending, running, done or failed. A state still marked
+running was cut short by a crash and is simply run again. The journal
+is rewritten whole and moved into place after every change, so it is
+never left half written.
+
+Each state's shapefile is written to a hidden temporary folder and only
+moved into place once complete, so a half-written shapefile is never
+mistaken for a finished one.
+
+Given a memory budget, states are built in parallel worker processes,
+each started once its estimated peak memory fits, largest first. Their
+entries then also hold the features the estimate was made from, the
+estimate and the measured peak, in megabytes, which calibrate the
+estimates of the next run. See memory.py.
+"""
+import os
+import json
+import time
+import shutil
+import traceback
+from datetime import datetime
+from functools import partial
+
+import us
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from census_adder import make_race_cvap_shp
+except: from tools.census_adder import make_race_cvap_shp
+
+try: import memory
+except: import tools.memory as memory
+
+
+def load_journal(journal_file: str) -> dict:
+    """
+    Returns the journal of a batch run, or an empty one if none exists.
+    """
+    if not os.path.isfile(journal_file):
+        return {"states": {}}
+    with open(journal_file) as journal_json:
+        return json.load(journal_json)
+
+def save_journal(journal: dict, journal_file: str):
+    """
+    Writes the journal whole, then moves it into place.
+    """
+    journal_folder = os.path.dirname(journal_file)
+    if journal_folder and not os.path.isdir(journal_folder):
+        os.makedirs(journal_folder)
+    with open(journal_file + ".tmp", "w") as journal_json:
+        json.dump(journal, journal_json, indent=2)
+    os.replace(journal_file + ".tmp", journal_file)
+
+def build_state_shp(state_abbr: str, output_folder: str = "", \
+                    by_county: bool = False, \
+                    download_allowed: bool = False) -> str:
+    """
+    Builds the shapefile of a state in a temporary folder and moves the
+    folder into place once complete, replacing any earlier build.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    output_folder: str
+        Folder holding the folder of every state. Defaults to
+        DEFAULT_OUPUT_FOLDER in settings.
+    by_county : bool
+        Flag as to whether to merge Block Groups one county at a time.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+
+    Returns
+    -------
+    str
+        Folder of the state's shapefile, e.g.
+        "./data/cvap_acs_output/HI_cvap_acs"
+
+    """
+    output_folder = output_folder if output_folder \
+                    else SET.DEFAULT_OUPUT_FOLDER
+    state_name = f"{state_abbr}_{SET.DEFAULT_OUTPUT}"
+    tmp_folder = os.path.join(output_folder, f".tmp_{state_name}")
+    final_folder = os.path.join(output_folder, state_name)
+    if os.path.isdir(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.makedirs(tmp_folder)
+
+    make_race_cvap_shp(state_abbr, os.path.join(tmp_folder,
+                                                f"{state_name}.shp"),
+                       download_allowed, by_county)
+
+    if os.path.isdir(final_folder):
+        shutil.rmtree(final_folder)
+    os.replace(tmp_folder, final_folder)
+    return final_folder
+
+def mark_running(journal: dict, journal_file: str, state_abbr: str):
+    """
+    Records in the journal that a state has started another attempt.
+    """
+    entry = journal["states"][state_abbr]
+    entry.update(status="running", attempts=entry["attempts"] + 1,
+                 started=datetime.now().isoformat(timespec="seconds"),
+                 finished=None, seconds=None, error=None, traceback=None,
+                 peak_mb=None)
+    save_journal(journal, journal_file)
+
+def build_state_measured(state_abbr: str, output_folder: str = "", \
+                         by_county: bool = False, \
+                         download_allowed: bool = False) -> dict:
+    """
+    Builds the shapefile of a state as build_state_shp does, in a worker
+    process of its own, and measures it.
+
+    Returns
+    -------
+    dict
+        Journal fields of the state: output, error, traceback, started,
+        seconds and the peak memory of the worker in megabytes.
+
+    """
+    result = {"output": None, "error": None, "traceback": None,
+              "started": datetime.now().isoformat(timespec="seconds")}
+    start = time.perf_counter()
+    try:
+        result["output"] = build_state_shp(state_abbr, output_folder,
+                                           by_county, download_allowed)
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+        result["traceback"] = traceback.format_exc()
+    result["seconds"] = round(time.perf_counter() - start, 1)
+    result["peak_mb"] = round(memory.peak_rss_mb(), 1)
+    return result
+
+def build_within_budget(journal: dict, journal_file: str, to_build: list, \
+                        memory_budget_mb: float, output_folder: str = "", \
+                        by_county: bool = False, \
+                        download_allowed: bool = False):
+    """
+    Builds states in parallel worker processes, each started once its
+    estimated peak memory fits within the budget, largest first, and
+    records each in the journal as it finishes.
+    """
+    entries = journal["states"]
+    model = memory.fit_memory_model(journal)
+    jobs = []
+    for state_abbr in to_build:
+        entry = entries[state_abbr]
+        try:
+            entry["features"] = memory.state_features(state_abbr,
+                                                      download_allowed)
+            entry["estimate_mb"] = round(memory.estimate_peak_mb(
+                entry["features"], model), 1)
+        except Exception as error:
+            # Unknown size, e.g. TIGER not yet downloaded, so run it alone
+            print(f"Unable to estimate memory of {state_abbr}: {error}")
+            entry["features"] = None
+            entry["estimate_mb"] = memory_budget_mb
+        # Marked running only once started, as states wait their turn
+        entry["status"] = "pending"
+        jobs.append((state_abbr, entry["estimate_mb"], build_state_measured,
+                     (state_abbr, output_folder, by_county,
+                      download_allowed)))
+    save_journal(journal, journal_file)
+
+    jobs.sort(key=lambda job: -job[1])
+    print(f"Building {len(jobs)} states within {memory_budget_mb:.0f} MB...")
+    for state_abbr, result, error in memory.run_within_budget(
+            jobs, memory_budget_mb,
+            on_start=partial(mark_running, journal, journal_file)):
+        entry = entries[state_abbr]
+        if error is not None:
+            result = {"error": f"{type(error).__name__}: {error}",
+                      "traceback": "".join(traceback.format_exception(error))}
+        entry.update(result)
+        entry["status"] = "failed" if entry["error"] else "done"
+        entry["finished"] = datetime.now().isoformat(timespec="seconds")
+        if entry["error"]:
+            print(f"{state_abbr} failed with {entry['error']}")
+        save_journal(journal, journal_file)
+
+def run_batch(state_abbrs: list = None, journal_file: str = "", \
+              only_failed: bool = False, output_folder: str = "", \
+              by_county: bool = False, download_allowed: bool = False, \
+              memory_budget_mb: float = None) -> dict:
+    """
+    Builds the shapefile of each state, recording the status, timing
+    and any error of each in a journal, and resuming from that journal.
+
+    A state that fails is recorded and the batch moves on to the next.
+
+    Parameters
+    ----------
+    state_abbrs: list of str
+        Two-letter state abbreviations of target states. Defaults to
+        the states already in the journal or, for a new journal, every
+        state plus DC and Puerto Rico.
+    journal_file: str
+        Filename of the journal. Defaults to BATCH_JOURNAL in settings.
+    only_failed: bool
+        Flag as to whether to retry only the states that failed before.
+    output_folder: str
+        Folder holding the folder of every state. Defaults to
+        DEFAULT_OUPUT_FOLDER in settings.
+    by_county : bool
+        Flag as to whether to merge Block Groups one county at a time.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+    memory_budget_mb: float
+        Memory in megabytes states built in parallel may take together.
+        Defaults to None, building one state at a time in this process.
+
+    Returns
+    -------
+    dict
+        The journal, with an entry for every state.
+
+    """
+    journal_file = journal_file if journal_file else SET.BATCH_JOURNAL
+    journal = load_journal(journal_file)
+    entries = journal["states"]
+
+    if state_abbrs is None:
+        state_abbrs = list(entries) if entries else \
+            [state.abbr for state in us.states.STATES +
+                                     [us.states.DC, us.states.PR]]
+    for state_abbr in state_abbrs:
+        entries.setdefault(state_abbr, {"status": "pending", "attempts": 0})
+    save_journal(journal, journal_file)
+
+    # Done only counts if its output is still there
+    to_build = [abbr for abbr in state_abbrs
+                if not (only_failed and entries[abbr]["status"] != "failed")
+                and not (entries[abbr]["status"] == "done"
+                         and os.path.isdir(entries[abbr]["output"]))]
+    if memory_budget_mb:
+        build_within_budget(journal, journal_file, to_build, memory_budget_mb,
+                            output_folder, by_county, download_allowed)
+        to_build = []
+
+    for state_abbr in to_build:
+        entry = entries[state_abbr]
+        mark_running(journal, journal_file, state_abbr)
+        print(f"Building {state_abbr}, attempt {entry['attempts']}...")
+
+        start = time.perf_counter()
+        try:
+            entry["output"] = build_state_shp(state_abbr, output_folder,
+                                              by_county, download_allowed)
+            entry["status"] = "done"
+        except Exception as error:
+            entry["status"] = "failed"
+            entry["error"] = f"{type(error).__name__}: {error}"
+            entry["traceback"] = traceback.format_exc()
+            print(f"{state_abbr} failed with {entry['error']}")
+        entry["finished"] = datetime.now().isoformat(timespec="seconds")
+        entry["seconds"] = round(time.perf_counter() - start, 1)
+        save_journal(journal, journal_file)
+
+    done = [abbr for abbr in state_abbrs
+            if entries[abbr]["status"] == "done"]
+    failed = [abbr for abbr in state_abbrs
+              if entries[abbr]["status"] == "failed"]
+    print(f"{len(done)} of {len(state_abbrs)} " +
+          f"states done. Failed: {', '.join(failed) if failed else 'none'}")
+    return journal
@@ -70,6 +70,17 @@ import requests
 try: import settings as SET
 except: import tools.settings as SET
 
+try: from schema import conform_to_schema, project_names
+except: from tools.schema import conform_to_schema, project_names
+
+try: from geoid import attach_geoid_keys
+except: from tools.geoid import attach_geoid_keys
+
+try: from selection import selector_prefixes, select_prefixes, \
+                            resolve_selector
+except: from tools.selection import selector_prefixes, select_prefixes, \
+                                   resolve_selector
+
 # Full Column name e.g. B03002_001E
 CENSUS_TABLE = "B03002"
 CENSUS_COLUMNS = {
@@ -88,6 +99,9 @@ CENSUS_COLUMNS = {
 CENSUS_NAMES = { (CENSUS_TABLE+"_"+col):CENSUS_COLUMNS[col] \
                      for col in CENSUS_COLUMNS}
 
+# API GEOIDs carry a summary level prefix, e.g. "1500000US010010201001"
+CENSUS_GEOID_PREFIX = "1500000US"
+
 # Is there no Census folder? Get one.
 if not os.path.isdir(SET.LOCAL_CENSUS_FOLDER):
     os.makedirs(SET.LOCAL_CENSUS_FOLDER)
@@ -145,7 +159,8 @@ def check_censusapi_data(state_abbr: str):
         filename = ""
     return filename
 
-def get_censusapi_race_bgs(state_abbr: str, save_allowed = True):
+def get_censusapi_race_bgs(state_abbr: str, save_allowed = True, \
+                           selector: dict = None, columns: list = None):
     """
     This returns a pandas DataFrame of ACS 2019 Race and Origin for the
     given state in columns following MGGG naming standards source
@@ -169,6 +184,16 @@ def get_censusapi_race_bgs(state_abbr: str, save_allowed = True):
         Flag as to whether to save Census data for later use. If save is
         not enabled, then data from the Census API won't be saved to
         file. 
+    selector: dict
+        GEOID prefixes, counties, bbox or mask of the block groups to
+        return. Default of whole state. Without saved data, only the
+        counties selected are asked of the API, and not saved. See
+        selection.py.
+    columns: list of str
+        MGGG columns to return, e.g. ["TOTPOP", "HISP"]. Without saved
+        data, only their Census columns are asked of the API, in fewer
+        column chunks and calls, and not saved. Columns of CVAP data
+        are ignored. Defaults to every column in CENSUS_COLUMNS.
 
     Returns
     -------
@@ -179,65 +204,87 @@ def get_censusapi_race_bgs(state_abbr: str, save_allowed = True):
     """
     state = us.states.lookup(state_abbr)
     filename = check_censusapi_data(state_abbr)
+    census_names = project_names(CENSUS_NAMES, columns)
+    prefixes = selector_prefixes(resolve_selector(state_abbr, selector),
+                                 state.fips)
+    # The API takes a list of counties, but nothing finer
+    counties = "*"
+    if prefixes is not None and all(len(prefix) >= 5 for prefix in prefixes):
+        counties = ",".join(sorted({prefix[2:5] for prefix in prefixes}))
     if filename:
         # Load state data saved previously, prevent from rewriting redundantly
-        state_data = pd.read_csv(filename, index_col=0)
-
-        # Assure Datatypes
-        state_data = state_data.astypes(str)
-        col_dtypes = {col:int for col in CENSUS_COLUMNS.values()}
-        state_data = state_data.astypes(col_dtypes)
+        # GEOIDs are read as strings to keep their leading zeros.
+        state_data = pd.read_csv(filename, dtype={"GEOID": str},
+                                 usecols=["GEOID"] +
+                                         list(census_names.values()))
+        state_data = attach_geoid_keys(state_data, "GEOID")
+        save_allowed = False
+    elif counties == "":
+        # Nothing of the state is selected
+        state_data = pd.DataFrame({"GEOID": pd.Series(dtype=str)})
+        state_data = attach_geoid_keys(state_data, "GEOID")
+        for col in census_names.values():
+            state_data[col] = pd.Series(dtype=int)
         save_allowed = False
     else: 
+        # A part of the state, or of its columns, is not worth saving
+        if counties != "*" or len(census_names) < len(CENSUS_NAMES):
+            save_allowed = False
         # We must download data from Census directly. 
         # First, we make batches of columns such that we only feed so
-        # many columns to the api at a time.
-        chunks = make_column_chunks(list(CENSUS_NAMES.keys()))
+        # many columns to the api at a time. With no columns, one call
+        # still lists the GEOIDs.
+        chunks = make_column_chunks(list(census_names.keys())) or [[]]
         state_data = pd.DataFrame()
         for chunk in chunks:
             # Get JSON response of chunk
-            column_string = "GEO_ID," + ",".join(chunk)
+            column_string = ",".join(["GEO_ID"] + chunk)
             url = (
                 SET.CENSUS2019_API_URL +
                 f"?get={column_string}" +
                 f"&for=block%20group:*" + 
-                f"&in=state:{state.fips}%20county:*"
+                f"&in=state:{state.fips}%20county:{counties}"
             )
             resp = requests.get(url)
             header, *rows = resp.json()
 
             # Rename and Assure Datatypes
             dtypes = {}
-            columns = []
+            header_names = []
             for json_col in header:
                 if json_col in CENSUS_NAMES.keys():
-                    columns.append(CENSUS_NAMES[json_col])
+                    header_names.append(CENSUS_NAMES[json_col])
                     dtypes[CENSUS_NAMES[json_col]] = int
                 else:
-                    columns.append(json_col)
+                    header_names.append(json_col)
                     dtypes[json_col] = str 
             # Merge 
-            chunk_data =(pd.DataFrame.from_records(rows, columns=columns)
+            chunk_data =(pd.DataFrame.from_records(rows, columns=header_names)
                             .astype(dtypes))
             if state_data.empty: 
                 state_data = chunk_data
             else:
                 state_data = pd.merge(state_data, chunk_data, on=["GEO_ID"])
 
-        # Shorten GEO_ID and rename GEOID, ensure as string
-        state_data["GEO_ID"] = (state_data["GEO_ID"].apply(lambda x: x[9:]))
-        state_data = state_data.rename(columns={"GEO_ID":"GEOID"})
-        state_data = state_data.astype({'GEOID': str})
+        # Shorten GEO_ID into GEOID and GEOID_KEY, sorted by key
+        state_data = attach_geoid_keys(state_data, "GEO_ID",
+                                       len(CENSUS_GEOID_PREFIX))
 
         # Remove state, county, track and block group columns
-        # We want to keep GEOID 
+        # We want to keep GEOID and GEOID_KEY
         remove_cols = list(
                         set(state_data.columns)-set(CENSUS_COLUMNS.values()))
         remove_cols.remove('GEOID')
+        remove_cols.remove('GEOID_KEY')
         state_data = state_data.drop(columns=remove_cols)
 
+    # Assure Datatypes
+    state_data = conform_to_schema(state_data)
+
     if save_allowed:
-        state_data.to_csv((SET.LOCAL_CENSUS_FOLDER + 
+        # Keys are parsed again from GEOID when read back
+        state_data.drop(columns="GEOID_KEY").to_csv(
+            (SET.LOCAL_CENSUS_FOLDER +
                             f"{state_abbr}{SET.LOCAL_CENSUS_SUFFIX}.csv"))
 
-    return state_data
\ No newline at end of file
+    return select_prefixes(state_data, prefixes)
\ No newline at end of file
@@ -75,37 +75,98 @@ inner-joined on short GEOID.
     race_origin_bgs = get_race_origin_bgs("HI")
     race_cvap_bgs = race_cvap_merge(race_origin_bgs, cvap_bgs)
 
-We have no mauping abilities and overwriting of files as of yet. We can
-generate new state shapefiles of block groups based on 2019 TIGER files
-with preloaded data from the 2019 5Y 2019 ACS and CVAP.
+We can generate new state shapefiles of block groups based on 2019
+TIGER files with preloaded data from the 2019 5Y 2019 ACS and CVAP, or
+prorate their counts by area onto an extant shapefile of other units.
+
+    precincts = gpd.read_file("tests/PA_final.shp")
+    pa_precincts = prorate_race_cvap_gdf(precincts,
+                                         make_race_cvap_gdf("PA"))
+
+Jobs that need only the table, and perhaps land and water area for
+density, can skip geometry altogether.
+
+    hi_race_cvap_df = make_race_cvap_df("HI")
+    hi_tract_df = make_race_cvap_df("HI", summary_level="tract",
+                                    tiger_columns=[])
+
+Jobs that need only a few counts name them, and each source reads only
+the columns they're made of. A source none of them come from isn't read
+at all.
+
+    hi_cvap_gdf = make_race_cvap_gdf("HI",
+                                     columns=["TOTPOP", "CVAP", "HCVAP"])
+
+For batches of states, use the CLI in cli.py.
 
 """
 
 import os
+import json
+import shutil
+import threading
 import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-# import geopandas as gpd
+import geopandas as gpd
 import us
 # import subprocess
 # import polars as pl
+import numpy as np
 import pandas as pd
+import shapely
 
 # To make work in project or editor namespace
 try: import settings as SET
 except: import tools.settings as SET
 
-try: from cvap2019 import get_cvap_bgs
-except: from tools.cvap2019 import get_cvap_bgs
+try: from cvap2019 import get_cvap_bgs, CVAP_COLUMNS
+except: from tools.cvap2019 import get_cvap_bgs, CVAP_COLUMNS
+
+try: from tiger import get_tiger_bgs, get_tiger_attributes
+except: from tools.tiger import get_tiger_bgs, get_tiger_attributes
+
+try: from topology import write_topojson
+except: from tools.topology import write_topojson
+
+try: from graph import write_graph_json
+except: from tools.graph import write_graph_json
 
-try: from tiger import get_tiger_bgs
-except: from tools.tiger import get_tiger_bgs
+try: from validate import validate_race_cvap, combine_reports, write_report
+except: from tools.validate import validate_race_cvap, combine_reports, \
+                                   write_report
+
+try: from rollup import rollup_race_cvap_gdf, aggregate_counts, \
+                        SUMMARY_LEVELS
+except: from tools.rollup import rollup_race_cvap_gdf, aggregate_counts, \
+                               SUMMARY_LEVELS
+
+try: from selection import is_spatial
+except: from tools.selection import is_spatial
+
+try: from simplify import get_simplified_tiers
+except: from tools.simplify import get_simplified_tiers
+
+try: from schema import validate_schema, to_output_dtypes, \
+                        check_columns, COUNT_COLUMNS
+except: from tools.schema import validate_schema, to_output_dtypes, \
+                                 check_columns, COUNT_COLUMNS
+
+try: from geoid import sorted_merge, state_key_range, slice_key_range
+except: from tools.geoid import sorted_merge, state_key_range, \
+                                slice_key_range
 
 # Import your favorite ACS algorithm here
-try: from acs_plugin_loader import set_race_origin_bgs
-except: from tools.acs_plugin_loader import set_race_origin_bgs
+try: from acs_plugin_loader import set_race_origin_bgs, \
+                                  get_race_origin_columns
+except: from tools.acs_plugin_loader import set_race_origin_bgs, \
+                                         get_race_origin_columns
 
 get_race_origin_bgs = set_race_origin_bgs(SET.ACS_PLUGIN)
 
+# Every column that CVAP and race data can be asked for
+RACE_CVAP_COLUMNS = CVAP_COLUMNS + get_race_origin_columns(SET.ACS_PLUGIN)
+
 
 """
 try: from nhgis import get_nhgis_race_bgs as get_race_origin_bgs
@@ -125,8 +186,11 @@ def race_cvap_merge(race_data, cvap_data):
 
     We can take two pandas dataframes with mggg-standardized columns of
     ACS Race/Origin and CVAP data and generate a new DataFrame. The pair
-    are inner-joined on short GEOID. With credit to @InnovativeInventor
-    and @jenni-niels.
+    are inner-joined on GEOID_KEY, both already sorted by key. GEOIDs
+    found on only one side are listed in the "join_report" of the
+    result's attrs. Either side may be None, when none of its columns
+    were asked for, leaving the other as it is. With credit to
+    @InnovativeInventor and @jenni-niels.
 
     Parameters
     ----------
@@ -152,21 +216,15 @@ def race_cvap_merge(race_data, cvap_data):
 
     """
 
-    # Merge together cvap blockgroups and race data together using GEOID
-    race_cvap_data = pd.merge(
-        left=cvap_data,
-        right=race_data,
-        left_on="GEOID",
-        right_on="GEOID"
-    )
+    # Both sides must arrive following the MGGG schema
+    sides = read_sides(cvap_data, race_data)
 
-    # Ensure numeric columns
-    numeric_cols = list(
-        set(race_cvap_data.columns)
-        .intersection(set(SET.NAME_CONVENTION.keys()))
-    )
-    race_cvap_data[numeric_cols] = race_cvap_data[numeric_cols].apply(
-        pd.to_numeric, errors="coerce"
+    # Merge together cvap blockgroups and race data together using keys
+    race_cvap_data = sorted_merge(
+        sides[0][1],
+        [data for name, data in sides[1:]],
+        how="inner",
+        names=[name for name, data in sides]
     )
 
     # Remove extraneous index column if necessary
@@ -177,7 +235,64 @@ def race_cvap_merge(race_data, cvap_data):
 
     return race_cvap_data
 
-def make_race_cvap_gdf(state_abbr: str, download_allowed: bool = False):
+def split_columns(columns: list = None) -> tuple:
+    """
+    Splits MGGG columns asked for between CVAP and race data.
+
+    Parameters
+    ----------
+    columns: list of str
+        MGGG-named count columns, e.g. ["TOTPOP", "CVAP", "HCVAP"], or
+        None for all of them.
+
+    Returns
+    -------
+    tuple
+        Columns of CVAP data and of race data, each None for all of
+        them or a list, empty if the source needn't be read.
+
+    Raises
+    ------
+    ValueError
+        If columns are empty or not in RACE_CVAP_COLUMNS.
+
+    """
+    check_columns(columns, RACE_CVAP_COLUMNS)
+    if columns is None:
+        return None, None
+    return ([col for col in columns if col in CVAP_COLUMNS],
+            [col for col in columns if col not in CVAP_COLUMNS])
+
+def read_sources(state_abbr: str, selector: dict = None, \
+                 columns: list = None) -> tuple:
+    """
+    Returns CVAP and race data of a state, each None if none of its
+    columns were asked for, so that it isn't read at all.
+    """
+    cvap_columns, race_columns = split_columns(columns)
+    cvap_bgs = None if cvap_columns == [] else \
+               get_cvap_bgs(state_abbr, selector=selector,
+                            columns=cvap_columns)
+    race_origin_bgs = None if race_columns == [] else \
+                      get_race_origin_bgs(state_abbr, selector=selector,
+                                          columns=race_columns)
+    return cvap_bgs, race_origin_bgs
+
+def read_sides(cvap_bgs, race_origin_bgs) -> list:
+    """
+    Returns the name and data of CVAP and race data that were read,
+    checking that each follows the MGGG schema.
+    """
+    sides = [(name, data) for name, data in
+             (("cvap", cvap_bgs), ("race", race_origin_bgs))
+             if data is not None]
+    for name, data in sides:
+        validate_schema(data, name)
+    return sides
+
+def make_race_cvap_gdf(state_abbr: str, download_allowed: bool = False,
+                       summary_level: str = "block_group",
+                       selector: dict = None, columns: list = None):
     """
     Returns geoDataFrame of Block Groups in target State with CVAP and
     ACS Race information formatted to mggg-standards
@@ -191,17 +306,39 @@ def make_race_cvap_gdf(state_abbr: str, download_allowed: bool = False):
         Flag as to whether to download missing data or raise error.
         Set to avoid downloading by default.
 
+    summary_level : str
+        "block_group", "tract" or "county". Block groups are rolled up
+        into tracts or counties, adding up counts and dissolving
+        geometry, which is cached. With a selector, a tract or county
+        holds only its selected block groups, in counts and geometry
+        alike. See rollup.py.
+
+    selector : dict
+        GEOID prefixes, counties, bbox or mask of the Block Groups to
+        merge, read alone from every source. Default of whole state.
+        See selection.py.
+
+    columns : list of str
+        MGGG columns to merge, e.g. ["TOTPOP", "CVAP", "HCVAP"], read
+        alone from every source. A source none of them come from isn't
+        read at all. Defaults to every column of every source.
+
     Returns
     -------
     geopandas.geoDataFrame
-        GeoDataFrame of Block Groups in target State with CVAP and ACS
-        Race information formatted to mggg-standards
+        GeoDataFrame of Block Groups, or Tracts or Counties, in target
+        State with CVAP and ACS Race information formatted to
+        mggg-standards
 
     Raises
     ------
     ValueError
-        State abbreviation must be valid.
+        State abbreviation, summary level and columns must be valid.
     """
+    if summary_level not in SUMMARY_LEVELS:
+        raise ValueError(f"Summary level must be one of " + \
+                         f"{list(SUMMARY_LEVELS)}, not {summary_level}.")
+    check_columns(columns, RACE_CVAP_COLUMNS)
     geo_race_cvap_bgs = ""
     try:
         state = us.states.lookup(state_abbr)
@@ -213,22 +350,231 @@ def make_race_cvap_gdf(state_abbr: str, download_allowed: bool = False):
         if not os.path.isdir(f"../{SET.LOCAL_DATA_FOLDER}"):
             os.makedirs(f"../{SET.LOCAL_DATA_FOLDER}")
 
+        # These follwing variables are geopandas.DataFrames
+        tiger_bgs = get_tiger_bgs(state_abbr, download_allowed,
+                                  selector=selector)
+
+        # Csv's have no geometry, so a bbox or mask becomes the GEOIDs
+        # of the block groups read within it
+        if is_spatial(selector):
+            selector = {"geoids": tiger_bgs["GEOID"].astype(str).tolist()}
+
         # These variables are simple pandas.DataFrames
-        cvap_bgs = get_cvap_bgs(state_abbr)
-        race_origin_bgs = get_race_origin_bgs(state_abbr)
+        cvap_bgs, race_origin_bgs = read_sources(state_abbr, selector,
+                                                 columns)
+
+        geo_race_cvap_bgs = merge_race_cvap_gdf(tiger_bgs, cvap_bgs,
+                                                race_origin_bgs)
+
+        if summary_level != "block_group":
+            geo_race_cvap_bgs = rollup_race_cvap_gdf(
+                geo_race_cvap_bgs, state_abbr, summary_level,
+                download_allowed=download_allowed,
+                selected=selector is not None)
+            validate_schema(geo_race_cvap_bgs, summary_level,
+                            SUMMARY_LEVELS[summary_level])
+    return geo_race_cvap_bgs
+
+def make_race_cvap_df(state_abbr: str, download_allowed: bool = False,
+                      summary_level: str = "block_group",
+                      tiger_columns: list = None, selector: dict = None,
+                      columns: list = None):
+    """
+    Returns a pandas DataFrame of Block Groups in target State with CVAP
+    and ACS Race information formatted to mggg-standards, without any
+    geometry.
+
+    Only the asked for attributes of the TIGER .dbf are read, if any,
+    and no polygons are parsed, so it takes a fraction of the time and
+    memory of make_race_cvap_gdf.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    summary_level : str
+        "block_group", "tract" or "county". Counts and TIGER attributes
+        are added up within tracts or counties, of only the selected
+        block groups given a selector. See rollup.py.
+
+    tiger_columns : list of str
+        TIGER attributes to keep, e.g. ["ALAND", "AWATER"] for density.
+        Defaults to TABULAR_TIGER_COLUMNS in settings. With none, TIGER
+        isn't read at all, and block groups are those found in both
+        CVAP and race data rather than in TIGER.
+
+    selector : dict
+        GEOID prefixes, counties, bbox or mask of the Block Groups to
+        merge. Default of whole state. See selection.py.
+
+    columns : list of str
+        MGGG columns to merge, e.g. ["TOTPOP", "CVAP", "HCVAP"], read
+        alone from every source. A source none of them come from isn't
+        read at all. Defaults to every column of every source.
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame of Block Groups, or Tracts or Counties, in target
+        State with TIGER attributes and CVAP and ACS Race information
+        formatted to mggg-standards, sorted by GEOID_KEY.
+
+    Raises
+    ------
+    ValueError
+        State abbreviation, summary level and columns must be valid.
+    """
+    if summary_level not in SUMMARY_LEVELS:
+        raise ValueError(f"Summary level must be one of " + \
+                         f"{list(SUMMARY_LEVELS)}, not {summary_level}.")
+    check_columns(columns, RACE_CVAP_COLUMNS)
+    if tiger_columns is None:
+        tiger_columns = SET.TABULAR_TIGER_COLUMNS
+    tiger_bgs = None
+    if tiger_columns or is_spatial(selector):
+        tiger_bgs = get_tiger_attributes(state_abbr, tiger_columns,
+                                         download_allowed, selector)
+        # Csv's have no geometry, so a bbox or mask becomes the GEOIDs
+        # of the block groups read within it
+        if is_spatial(selector):
+            selector = {"geoids": tiger_bgs["GEOID"].astype(str).tolist()}
+
+    cvap_bgs, race_origin_bgs = read_sources(state_abbr, selector, columns)
+    if tiger_bgs is None or not tiger_columns:
         race_cvap_bgs = race_cvap_merge(race_origin_bgs, cvap_bgs)
+    else:
+        race_cvap_bgs = merge_race_cvap_gdf(tiger_bgs, cvap_bgs,
+                                            race_origin_bgs)
+
+    if summary_level != "block_group":
+        report = race_cvap_bgs.attrs.get("join_report")
+        race_cvap_bgs = aggregate_counts(race_cvap_bgs, summary_level,
+                                         tiger_columns)
+        race_cvap_bgs.attrs["join_report"] = report
+        validate_schema(race_cvap_bgs, summary_level,
+                        SUMMARY_LEVELS[summary_level])
+    return race_cvap_bgs
+
+def merge_race_cvap_gdf(tiger_bgs, cvap_bgs, race_origin_bgs):
+    """
+    Merges CVAP and ACS Race data onto TIGER Block Groups, all already
+    following the MGGG schema.
 
-        # These follwing variables are geopandas.DataFrames
-        tiger_bgs = get_tiger_bgs(state_abbr, download_allowed)
-        geo_race_cvap_bgs = tiger_bgs.merge(
-            race_cvap_bgs,
-            on="GEOID",
-            how="left"
-        )
+    All three are sorted by GEOID_KEY, so CVAP and race data are
+    inner-joined to each other and left-joined onto TIGER block groups
+    in one pass.
+
+    Parameters
+    ----------
+    tiger_bgs: geopandas.GeoDataFrame
+        Block Groups of a state, from get_tiger_bgs.
+    cvap_bgs: pandas.DataFrame
+        CVAP data of the same state, from get_cvap_bgs, or None if none
+        of its columns were asked for.
+    race_origin_bgs: pandas.DataFrame
+        ACS Race data of the same state, from get_race_origin_bgs, or
+        None if none of its columns were asked for.
+
+    Returns
+    -------
+    geopandas.geoDataFrame
+        GeoDataFrame of Block Groups with CVAP and ACS Race information
+        formatted to mggg-standards
+
+    """
+    sides = read_sides(cvap_bgs, race_origin_bgs)
+    geo_race_cvap_bgs = sorted_merge(
+        tiger_bgs,
+        [data for name, data in sides],
+        how="left",
+        names=["tiger"] + [name for name, data in sides]
+    )
+    validate_schema(geo_race_cvap_bgs, "merged")
     return geo_race_cvap_bgs
 
+def iter_race_cvap_county_gdfs(state_abbr: str, \
+                               download_allowed: bool = False, \
+                               counties: list = None):
+    """
+    Yields GeoDataFrames of Block Groups in target State with CVAP and
+    ACS Race information formatted to mggg-standards, one county at a
+    time.
+
+    CVAP and race data are joined to TIGER GEOIDs for the whole state
+    first, reading no geometry, so that the join is reported once.
+    Geometry is then read, merged and handed over one county at a time,
+    such that peak memory is bounded by the largest county rather than
+    the whole state, e.g. Los Angeles rather than California.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    counties : list of str
+        Three-digit County FIPS codes to yield, reading geometry of no
+        others. Defaults to every county.
+
+    Yields
+    ------
+    tuple of str and geopandas.geoDataFrame
+        Three-digit County FIPS code and GeoDataFrame of its Block
+        Groups. Its attrs carry the state's "join_report" and the
+        "float_columns" holding missing values anywhere in the state.
+
+    """
+    state = us.states.lookup(state_abbr)
+
+    # These variables are simple pandas.DataFrames
+    cvap_bgs = get_cvap_bgs(state_abbr)
+    race_origin_bgs = get_race_origin_bgs(state_abbr)
+    validate_schema(cvap_bgs, "cvap")
+    validate_schema(race_origin_bgs, "race")
+    tiger_geoids = get_tiger_attributes(state_abbr,
+                                        download_allowed=download_allowed)
+    race_cvap_bgs = sorted_merge(
+        tiger_geoids,
+        [cvap_bgs, race_origin_bgs],
+        how="left",
+        names=["tiger", "cvap", "race"]
+    )
+    del cvap_bgs, race_origin_bgs, tiger_geoids
+
+    # Counties are digits 3 to 5 of each GEOID
+    float_columns = race_cvap_bgs.columns[race_cvap_bgs.isna().any()].tolist()
+    state_counties = np.unique(
+        race_cvap_bgs["GEOID_KEY"].to_numpy() // 10**7 % 1000)
+    for county in state_counties:
+        county_fips = f"{county:03d}"
+        if counties is not None and county_fips not in counties:
+            continue
+        low, high = state_key_range(state.fips, county_fips)
+        county_tiger_bgs = get_tiger_bgs(state_abbr, download_allowed,
+                                         county_fips)
+        county_gdf = sorted_merge(
+            county_tiger_bgs,
+            [slice_key_range(race_cvap_bgs, low, high)],
+            how="left",
+            names=["tiger", "race_cvap"]
+        )
+        validate_schema(county_gdf, "merged")
+        county_gdf.attrs["join_report"] = race_cvap_bgs.attrs["join_report"]
+        county_gdf.attrs["float_columns"] = float_columns
+        yield county_fips, county_gdf
+
 def make_race_cvap_shp(state_abbr: str, output = "", \
-                                        download_allowed: bool = False):
+                                        download_allowed: bool = False, \
+                                        by_county: bool = False, \
+                                        strict: bool = None):
     """
     Creates Shapefile of Block Groups in target State with CVAP and ACS
     Race information formatted to mggg-standards as well
@@ -245,6 +591,17 @@ def make_race_cvap_shp(state_abbr: str, output = "", \
     download_allowed : bool
         Flag as to whether to download missing data or raise error.
         Set to avoid downloading by default.
+
+    by_county : bool
+        Flag as to whether to merge and append Block Groups to the
+        shapefile one county at a time, bounding memory for very large
+        states. See iter_race_cvap_county_gdfs.
+
+    strict : bool
+        Flag as to whether a failed validation check fails the build
+        before anything is written. Either way, a validation report is
+        written next to the shapefile. Defaults to VALIDATION_STRICT in
+        settings. See validate.py.
         
     Returns
     -------
@@ -252,6 +609,8 @@ def make_race_cvap_shp(state_abbr: str, output = "", \
 
     Raises
     ------
+    ValueError
+        In strict mode, if any validation check fails.
 
     """
     actual_output = ""
@@ -271,9 +630,571 @@ def make_race_cvap_shp(state_abbr: str, output = "", \
         actual_output = state_folder + \
                                      f"{state_abbr}_{SET.DEFAULT_OUTPUT}.shp"
                                      
-    make_race_cvap_gdf(state_abbr, download_allowed).to_file(actual_output)
+    if by_county:
+        # Counties are appended one at a time, so they are written aside
+        # and moved into place only once every county has passed
+        output_folder, output_name = os.path.split(actual_output)
+        tmp_folder = os.path.join(output_folder,
+                                  f".tmp_{os.path.splitext(output_name)[0]}")
+        if os.path.isdir(tmp_folder):
+            shutil.rmtree(tmp_folder)
+        os.makedirs(tmp_folder)
+        reports = []
+        try:
+            county_gdfs = iter_race_cvap_county_gdfs(state_abbr,
+                                                     download_allowed)
+            for i, (county_fips, county_gdf) in enumerate(county_gdfs):
+                reports.append(validate_race_cvap(county_gdf, state_abbr,
+                                                  strict))
+                county_gdf = to_output_dtypes(
+                    county_gdf, county_gdf.attrs["float_columns"])
+                county_gdf.to_file(os.path.join(tmp_folder, output_name),
+                                   mode="a" if i else "w")
+        except Exception:
+            shutil.rmtree(tmp_folder)
+            raise
+        for filename in os.listdir(tmp_folder):
+            os.replace(os.path.join(tmp_folder, filename),
+                       os.path.join(output_folder, filename))
+        os.rmdir(tmp_folder)
+        report = combine_reports(reports)
+    else:
+        race_cvap_gdf = make_race_cvap_gdf(state_abbr, download_allowed)
+        report = validate_race_cvap(race_cvap_gdf, state_abbr, strict)
+        to_output_dtypes(race_cvap_gdf).to_file(actual_output)
+    write_report(report, os.path.splitext(actual_output)[0] + \
+                         SET.VALIDATION_SUFFIX)
     return
 
+def make_race_cvap_tiers(state_abbr: str, tolerances: list = None, \
+                         output_folder: str = "", \
+                         download_allowed: bool = False) -> dict:
+    """
+    Creates Shapefiles of Block Groups in target State with CVAP and ACS
+    Race information at full resolution and at each simplified tier, all
+    from one merge.
+
+    Tiers are simplified on shared boundaries so neighbors never develop
+    gaps, and are cached next to the TIGER shapefile. See simplify.py.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+
+    tolerances: list of float
+        Simplification tolerances in degrees. Defaults to
+        SIMPLIFY_TOLERANCES in settings.
+
+    output_folder: str
+        Folder for output shapefiles. Default, set in settings with
+        State abbr prefix.
+
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    dict
+        Filename of each tier, keyed by tolerance, or "full".
+
+    """
+    if not output_folder:
+        output_folder = SET.DEFAULT_OUPUT_FOLDER + \
+                        f"{state_abbr}_{SET.DEFAULT_OUTPUT}/"
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+    base_name = os.path.join(output_folder,
+                             f"{state_abbr}_{SET.DEFAULT_OUTPUT}")
+
+    race_cvap_gdf = to_output_dtypes(
+        make_race_cvap_gdf(state_abbr, download_allowed))
+    race_cvap_gdf.to_file(base_name + ".shp")
+    filenames = {"full": base_name + ".shp"}
+
+    # Tiers hold the same block groups as TIGER, in the same key order.
+    tiers = get_simplified_tiers(state_abbr, tolerances, download_allowed)
+    for tolerance, tier in tiers.items():
+        if not (tier["GEOID"].astype(str).to_numpy() ==
+                race_cvap_gdf["GEOID"].to_numpy()).all():
+            raise ValueError(f"Simplified tier {tolerance:g} of " + \
+                             f"{state_abbr} does not match TIGER GEOIDs.")
+        filename = base_name + f"{SET.SIMPLIFIED_SUFFIX}{tolerance:g}.shp"
+        race_cvap_gdf.set_geometry(tier.geometry.values).to_file(filename)
+        filenames[tolerance] = filename
+    return filenames
+
+def make_race_cvap_topojson(state_abbr: str, output: str = "", \
+                            quantization: int = None, \
+                            download_allowed: bool = False) -> str:
+    """
+    Creates TopoJSON of Block Groups in target State with CVAP and ACS
+    Race information formatted to mggg-standards, for browsers.
+
+    Every boundary shared by neighbors is stored once as an arc, on a
+    quantized grid, and delta-encoded. See topology.py.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+
+    output: str
+        Desired TopoJSON filename. Default, set in settings with State
+        abbr prefix.
+
+    quantization: int
+        Number of grid steps across the state. Defaults to
+        TOPOJSON_QUANTIZATION in settings.
+
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    str
+        Filename of the TopoJSON.
+
+    """
+    if not output:
+        state_folder = SET.DEFAULT_OUPUT_FOLDER + \
+                       f"{state_abbr}_{SET.DEFAULT_OUTPUT}/"
+        if not os.path.isdir(state_folder):
+            os.makedirs(state_folder)
+        output = state_folder + f"{state_abbr}_{SET.DEFAULT_OUTPUT}.topojson"
+
+    race_cvap_gdf = make_race_cvap_gdf(state_abbr, download_allowed)
+    return write_topojson(race_cvap_gdf, output, quantization=quantization)
+
+def make_race_cvap_graph(state_abbr: str, output: str = "", \
+                         adjacency: str = None, \
+                         download_allowed: bool = False) -> str:
+    """
+    Creates a GerryChain-compatible JSON dual graph of Block Groups in
+    target State with CVAP and ACS Race information formatted to
+    mggg-standards as node attributes.
+
+    Adjacency is found with a spatial index and cached by a hash of the
+    TIGER geometry, so it is built once per state and vintage. See
+    graph.py.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+
+    output: str
+        Desired JSON filename. Default, set in settings with State abbr
+        prefix.
+
+    adjacency: str
+        "rook" or "queen". Defaults to GRAPH_ADJACENCY in settings.
+
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    str
+        Filename of the JSON graph.
+
+    """
+    adjacency = adjacency if adjacency else SET.GRAPH_ADJACENCY
+    if not output:
+        state_folder = SET.DEFAULT_OUPUT_FOLDER + \
+                       f"{state_abbr}_{SET.DEFAULT_OUTPUT}/"
+        if not os.path.isdir(state_folder):
+            os.makedirs(state_folder)
+        output = state_folder + f"{state_abbr}_{SET.DEFAULT_OUTPUT}.json"
+
+    race_cvap_gdf = make_race_cvap_gdf(state_abbr, download_allowed)
+    return write_graph_json(race_cvap_gdf, output, adjacency)
+
+def make_race_cvap_tiles(state_abbr: str, output: str = "", \
+                         minzoom: int = None, maxzoom: int = None, \
+                         jobs: int = None, \
+                         download_allowed: bool = False) -> str:
+    """
+    Creates a Mapbox Vector Tile pyramid of Block Groups in target State
+    with CVAP and ACS Race information formatted to mggg-standards,
+    straight from the merged GeoDataFrame. See tiles.py.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+
+    output: str
+        MBTiles filename, or folder for z/x/y.pbf tiles. Default, set in
+        settings with State abbr prefix.
+
+    minzoom, maxzoom: int
+        Range of zoom levels to cut. Defaults to TILE_MINZOOM and
+        TILE_MAXZOOM in settings.
+
+    jobs: int
+        Number of worker processes. Defaults to the number of CPUs.
+
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    str
+        The output filename or folder.
+
+    """
+    # Only tile builds need mapbox_vector_tile
+    try: from tiles import make_tile_pyramid
+    except: from tools.tiles import make_tile_pyramid
+
+    if not output:
+        state_folder = SET.DEFAULT_OUPUT_FOLDER + \
+                       f"{state_abbr}_{SET.DEFAULT_OUTPUT}/"
+        if not os.path.isdir(state_folder):
+            os.makedirs(state_folder)
+        output = state_folder + f"{state_abbr}_{SET.DEFAULT_OUTPUT}.mbtiles"
+
+    race_cvap_gdf = make_race_cvap_gdf(state_abbr, download_allowed)
+    return make_tile_pyramid(race_cvap_gdf, output, minzoom, maxzoom, jobs)
+
+def to_national_dtypes(race_cvap_gdf):
+    """
+    Returns a copy of merged Block Groups with the output dtypes shared
+    by every partition of a national dataset. Every count is float64,
+    whether or not a state or county has missing values, so partitions
+    never disagree on the schema.
+    """
+    return to_output_dtypes(race_cvap_gdf, COUNT_COLUMNS)
+
+def partition_schema(frame) -> dict:
+    """
+    Returns the dtype of each column of a written partition, by name.
+    """
+    return {col: str(dtype) for col, dtype in frame.dtypes.items()}
+
+def write_state_partition(state_abbr: str, dataset_root: str, \
+                          by_county: bool = False, \
+                          download_allowed: bool = False) -> dict:
+    """
+    Writes the Block Groups of one state into a hive-partitioned
+    GeoParquet dataset, e.g. STATEFP=15/part-0.parquet or, by county,
+    STATEFP=15/COUNTYFP=007/part-0.parquet.
+
+    The partition is written to a hidden temporary folder first and
+    moved into place only once complete, so readers never see half a
+    state. Any earlier partition of the same state is replaced.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    dataset_root: str
+        Folder holding the whole national dataset.
+    by_county: bool
+        Flag as to whether to partition each state by county as well.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+
+    Returns
+    -------
+    dict
+        Entry for the national manifest, listing the state, its
+        partition folder, files, number of rows and schema.
+
+    """
+    state = us.states.lookup(state_abbr)
+    partition = f"STATEFP={state.fips}"
+    tmp_folder = os.path.join(dataset_root, f".tmp_{partition}")
+    final_folder = os.path.join(dataset_root, partition)
+    if os.path.isdir(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.makedirs(tmp_folder)
+
+    # Partition values live in folder names, not in the files.
+    files = []
+    rows = 0
+    schema = {}
+    if by_county:
+        county_gdfs = iter_race_cvap_county_gdfs(state_abbr, download_allowed)
+        for county, county_gdf in county_gdfs:
+            county_file = os.path.join(f"COUNTYFP={county}", "part-0.parquet")
+            os.makedirs(os.path.join(tmp_folder, f"COUNTYFP={county}"))
+            county_gdf = to_national_dtypes(county_gdf)
+            county_gdf.to_parquet(os.path.join(tmp_folder, county_file),
+                                  index=False)
+            files.append(county_file)
+            rows += len(county_gdf)
+            schema = partition_schema(county_gdf)
+    else:
+        race_cvap_gdf = to_national_dtypes(
+            make_race_cvap_gdf(state_abbr, download_allowed))
+        race_cvap_gdf.to_parquet(
+            os.path.join(tmp_folder, "part-0.parquet"), index=False)
+        files.append("part-0.parquet")
+        rows = len(race_cvap_gdf)
+        schema = partition_schema(race_cvap_gdf)
+
+    if os.path.isdir(final_folder):
+        shutil.rmtree(final_folder)
+    os.replace(tmp_folder, final_folder)
+
+    return {
+        "state": state.abbr,
+        "partition": partition,
+        "files": [os.path.join(partition, file) for file in files],
+        "rows": rows,
+        "schema": schema,
+    }
+
+def write_county_partitions(state_abbr: str, counties: list, \
+                            dataset_root: str, \
+                            download_allowed: bool = False) -> list:
+    """
+    Writes some counties of one state into a hive-partitioned GeoParquet
+    dataset, e.g. STATEFP=15/COUNTYFP=007/part-0.parquet, leaving the
+    state's other counties as they are.
+
+    Each county is written to a hidden temporary folder first and moved
+    into place only once complete.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    counties: list of str
+        Three-digit County FIPS codes to write.
+    dataset_root: str
+        Folder holding the whole national dataset.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+
+    Returns
+    -------
+    list of dict
+        Entry for the national manifest of each county written.
+
+    """
+    state = us.states.lookup(state_abbr)
+    state_folder = os.path.join(dataset_root, f"STATEFP={state.fips}")
+    if not os.path.isdir(state_folder):
+        os.makedirs(state_folder, exist_ok=True)
+
+    entries = []
+    county_gdfs = iter_race_cvap_county_gdfs(state_abbr, download_allowed,
+                                             counties)
+    for county, county_gdf in county_gdfs:
+        partition = f"STATEFP={state.fips}/COUNTYFP={county}"
+        tmp_folder = os.path.join(state_folder, f".tmp_COUNTYFP={county}")
+        final_folder = os.path.join(dataset_root, partition)
+        if os.path.isdir(tmp_folder):
+            shutil.rmtree(tmp_folder)
+        os.makedirs(tmp_folder)
+        county_gdf = to_national_dtypes(county_gdf)
+        county_gdf.to_parquet(os.path.join(tmp_folder, "part-0.parquet"),
+                              index=False)
+        if os.path.isdir(final_folder):
+            shutil.rmtree(final_folder)
+        os.replace(tmp_folder, final_folder)
+        entries.append({
+            "state": state.abbr,
+            "county": county,
+            "partition": partition,
+            "files": [os.path.join(partition, "part-0.parquet")],
+            "rows": len(county_gdf),
+            "schema": partition_schema(county_gdf),
+        })
+    return entries
+
+def commit_national_manifest(dataset_root: str, partitions: list, \
+                             partitioning: list, failed: dict) -> str:
+    """
+    Commits the manifest of a national dataset, listing every partition
+    and the one schema they share, written whole then moved into place.
+
+    Parameters
+    ----------
+    dataset_root: str
+        Folder holding the whole national dataset.
+    partitions: list of dict
+        Entry of each partition, as returned by write_state_partition.
+    partitioning: list of str
+        Partition columns, e.g. ["STATEFP"].
+    failed: dict
+        Error of each state, or unit of work, that failed.
+
+    Returns
+    -------
+    str
+        Filepath of the committed manifest.
+
+    Raises
+    ------
+    ValueError
+        If partitions were written with different schemas.
+
+    """
+    partitions = sorted(partitions, key=lambda entry: entry["partition"])
+    schemas = {}
+    for entry in partitions:
+        schema = entry.pop("schema", None)
+        if schema:
+            schemas.setdefault(json.dumps(schema), []).append(
+                entry["partition"])
+    if len(schemas) > 1:
+        raise ValueError("Partitions do not share one schema: " + \
+                         "; ".join(f"{partitions_of} as {schema}"
+                                   for schema, partitions_of
+                                   in schemas.items()))
+    manifest = {
+        "format": "geoparquet",
+        "partitioning": partitioning,
+        "schema": json.loads(next(iter(schemas))) if schemas else {},
+        "partitions": partitions,
+        "rows": sum(entry["rows"] for entry in partitions),
+        "failed": failed,
+    }
+    manifest_file = os.path.join(dataset_root, SET.NATIONAL_MANIFEST)
+    tmp_file = f"{manifest_file}.tmp{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_file, "w") as tmp_manifest:
+        json.dump(manifest, tmp_manifest, indent=2)
+    os.replace(tmp_file, manifest_file)
+    return manifest_file
+
+def make_national_race_cvap_parquet(state_abbrs: list = None, \
+                                    output: str = "", \
+                                    by_county: bool = False, \
+                                    jobs: int = None, \
+                                    download_allowed: bool = False) -> str:
+    """
+    Creates one GeoParquet dataset of Block Groups for the whole nation
+    with CVAP and ACS Race information formatted to mggg-standards,
+    partitioned by state and optionally by county.
+
+    Workers build and write their states' partitions concurrently. Once
+    all are done, a manifest listing every partition is committed to the
+    dataset root. Readers can then query the whole nation at once and
+    skip the states they don't need, e.g.
+
+        gpd.read_parquet(output, filters=[("STATEFP", "=", 15)])
+
+    Parameters
+    ----------
+    state_abbrs: list of str
+        Two-letter state abbreviations to include. Defaults to all
+        states plus DC and Puerto Rico.
+    output: str
+        Folder for the dataset. Default, set in settings.
+    by_county: bool
+        Flag as to whether to partition each state by county as well.
+    jobs: int
+        Number of worker processes. Defaults to the number of CPUs.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    str
+        Filepath of the committed manifest.
+
+    Raises
+    ------
+    RuntimeError
+        If any state could not be written. The manifest is still
+        committed, listing the failed states.
+
+    """
+    if not state_abbrs:
+        state_abbrs = [state.abbr for state in
+                       us.states.STATES + [us.states.DC, us.states.PR]]
+    dataset_root = output if output else \
+                   SET.DEFAULT_OUPUT_FOLDER + SET.NATIONAL_OUTPUT + "/"
+    if not os.path.isdir(dataset_root):
+        os.makedirs(dataset_root)
+
+    partitions = []
+    failed = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(write_state_partition, state_abbr, dataset_root,
+                        by_county, download_allowed): state_abbr
+            for state_abbr in state_abbrs
+        }
+        for future in as_completed(futures):
+            try:
+                partitions.append(future.result())
+            except Exception as err:
+                print(f"Unable to write partition for {futures[future]}")
+                failed[futures[future]] = repr(err)
+
+    manifest_file = commit_national_manifest(
+        dataset_root, partitions,
+        ["STATEFP", "COUNTYFP"] if by_county else ["STATEFP"], failed)
+
+    if failed:
+        raise RuntimeError(f"Partitions failed for {sorted(failed)}")
+    return manifest_file
+
+def prorate_race_cvap_gdf(targets, race_cvap_gdf, overwrite: bool = False):
+    """
+    Prorates the counts of merged Block Groups onto other shapes, e.g.
+    precincts, by the share of each Block Group's area falling within
+    each shape.
+
+    Areas are measured in the UTM zone of the Block Groups, and Block
+    Groups missing a count add nothing to it.
+
+    Parameters
+    ----------
+    targets: geopandas.GeoDataFrame
+        Shapes to prorate onto, in any CRS.
+    race_cvap_gdf: geopandas.GeoDataFrame
+        Merged Block Groups, e.g. from make_race_cvap_gdf.
+    overwrite: bool
+        Flag as to whether counts replace columns of the same name
+        already in targets.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        The targets with a prorated float column for every count.
+
+    Raises
+    ------
+    ValueError
+        If targets already hold count columns and overwrite is off.
+
+    """
+    counts = [col for col in race_cvap_gdf.columns if col in COUNT_COLUMNS]
+    existing = [col for col in counts if col in targets.columns]
+    if existing and not overwrite:
+        raise ValueError(f"Columns {existing} already exist. " + \
+                         "Set overwrite to replace them.")
+
+    crs = race_cvap_gdf.estimate_utm_crs()
+    bg_geoms = race_cvap_gdf.geometry.to_crs(crs).to_numpy()
+    target_geoms = targets.geometry.to_crs(crs).to_numpy()
+    target_idx, bg_idx = shapely.STRtree(bg_geoms).query(
+        target_geoms, predicate="intersects")
+    shared = shapely.area(shapely.intersection(target_geoms[target_idx],
+                                               bg_geoms[bg_idx]))
+    bg_areas = shapely.area(bg_geoms)[bg_idx]
+    weights = np.divide(shared, bg_areas, out=np.zeros_like(shared),
+                        where=bg_areas > 0)
+
+    prorated = targets.copy()
+    for col in counts:
+        values = np.nan_to_num(race_cvap_gdf[col].astype("float64")
+                               .to_numpy())[bg_idx]
+        prorated[col] = np.bincount(target_idx, weights=weights * values,
+                                    minlength=len(targets))
+    return prorated
+
 ### Functions for Command Line Application ###
 import typer
 
@@ -281,11 +1202,8 @@ def main(filename: str, output: str, \
                     postal_code: str, overwrite: bool = False):
     """
     To ensure some compatibility, we retain the original CLI inputs from
-    original MGGG-tooling repository.
-
-    In the future, we will aim for complete backwards compatibility by
-    including the overwriting and mauping functionality of the original
-    CLI.
+    original MGGG-tooling repository. Batches of states, other formats
+    and summary levels are handled by the CLI in cli.py.
 
     Parameters
     ----------
@@ -307,18 +1225,17 @@ def main(filename: str, output: str, \
         Null
     Raises
     ------
+    ValueError
+        If the shapefile already holds count columns and overwrite is
+        off.
 
     """
     state = us.states.lookup(postal_code)
-    new_race_cvap_bgs = make_race_cvap_gdf(state.abbriation, \
+    new_race_cvap_bgs = make_race_cvap_gdf(state.abbr, \
                                         download_allowed = True)
-
-    ### !!! No maup-ing abilities right now
-    ### Please see @InnovativeInventor/mggg-tooling/census_adder.py
-
-    # return read_and_maup_old_file(filename, new_race_cvap_bgs):
-    print (f"{filename} is ignored in this version of the CLI application.")
-    new_race_cvap_bgs.to_file(output)
+    targets = gpd.read_file(filename)
+    prorate_race_cvap_gdf(targets, new_race_cvap_bgs, overwrite) \
+        .to_file(output)
 
 if __name__ == "__main__":
     typer.run(main)
@@ -0,0 +1,468 @@
+"""
+Command line application for building CVAP and ACS Race data for whole
+batches of states in one process, so that imports, national csv indexes
+and source caches are paid for once rather than once per state.
+
+Examples
+--------
+Each stage is a subcommand. States are given as a comma-separated list
+and default to every state plus DC and Puerto Rico.
+
+    First, ingest downloads and caches the sources of each state, e.g.
+    TIGER shapefiles, csv indexes and race data.
+
+    python tools/cli.py ingest --states HI,RI --download
+
+    Second, build merges and writes each state, in any format and
+    summary level, with --jobs states at a time.
+
+    python tools/cli.py build --states HI,RI --format parquet \\
+        --summary-level tract --jobs 4
+
+    Third, validate checks the written output of each state again, and
+    bench times each stage of each state.
+
+    python tools/cli.py validate --states HI,RI --format parquet \\
+        --summary-level tract
+    python tools/cli.py bench --states HI
+
+    prorate adds up counts of block groups by area onto an extant
+    shapefile, e.g. precincts.
+
+    python tools/cli.py prorate tests/PA_final.shp PA_cvap.shp --states PA
+
+    serve keeps merged states in memory and serves them locally. See
+    service.py.
+
+    python tools/cli.py serve --states HI,RI --port 8765
+
+Notes
+-----
+Formats are
+
+shp
+    Shapefile, with a validation report next to it.
+parquet
+    GeoParquet, with a validation report next to it.
+topojson
+    TopoJSON with shared arcs. See topology.py.
+graph
+    GerryChain JSON dual graph. See graph.py.
+tiles
+    Mapbox Vector Tiles in MBTiles. See tiles.py.
+csv
+    Table with ALAND and AWATER but no geometry, which is never read.
+    See make_race_cvap_df in census_adder.py.
+
+each written to the state's folder of the output folder, e.g.
+data/cvap_acs_output/HI_cvap_acs/HI_cvap_acs_tract.parquet.
+
+--columns builds only the given counts, e.g. TOTPOP,CVAP,HCVAP, and
+each source reads only the columns they're made of.
+
+--cache-dir moves every data folder of the settings, e.g. TIGER
+shapefiles, national csv's and their caches, from LOCAL_DATA_FOLDER to
+the given folder.
+
+States of a batch are built as tasks of the scheduler, merging in the
+"cpu" pool and writing in the "disk" pool, both with --jobs workers. A
+state that fails is reported and the rest carry on. Any failure ends
+the command with exit code 1.
+"""
+import os
+import json
+import time
+import tempfile
+
+import us
+import typer
+import geopandas as gpd
+import pandas as pd
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from tiger import check_download_tiger_file, get_tiger_bgs, \
+                       get_tiger_attributes
+except: from tools.tiger import check_download_tiger_file, get_tiger_bgs, \
+                              get_tiger_attributes
+
+try: from cvap2019 import get_cvap_bgs
+except: from tools.cvap2019 import get_cvap_bgs
+
+try: from rollup import rollup_race_cvap_gdf, aggregate_counts, \
+                        SUMMARY_LEVELS
+except: from tools.rollup import rollup_race_cvap_gdf, aggregate_counts, \
+                               SUMMARY_LEVELS
+
+try: from validate import validate_race_cvap, write_report
+except: from tools.validate import validate_race_cvap, write_report
+
+try: from schema import to_output_dtypes, check_columns
+except: from tools.schema import to_output_dtypes, check_columns
+
+try: from topology import write_topojson
+except: from tools.topology import write_topojson
+
+try: from graph import write_graph_json
+except: from tools.graph import write_graph_json
+
+try: from scheduler import run_tasks
+except: from tools.scheduler import run_tasks
+
+try: from service import serve as serve_race_cvap
+except: from tools.service import serve as serve_race_cvap
+
+try: from census_adder import get_race_origin_bgs, make_race_cvap_gdf, \
+                              make_race_cvap_df, merge_race_cvap_gdf, \
+                              prorate_race_cvap_gdf, RACE_CVAP_COLUMNS
+except: from tools.census_adder import get_race_origin_bgs, \
+                                       make_race_cvap_gdf, \
+                                       make_race_cvap_df, \
+                                       merge_race_cvap_gdf, \
+                                       prorate_race_cvap_gdf, \
+                                       RACE_CVAP_COLUMNS
+
+
+# File extension of each output format
+FORMATS = {"shp": ".shp", "parquet": ".parquet", "topojson": ".topojson",
+           "graph": ".json", "tiles": ".mbtiles", "csv": ".csv"}
+
+app = typer.Typer(help="Builds CVAP and ACS Race data for batches of states.")
+
+def use_cache_dir(cache_dir: str):
+    """
+    Moves every data folder of the settings, i.e. every setting under
+    LOCAL_DATA_FOLDER, to cache_dir.
+    """
+    if not cache_dir:
+        return
+    old_folder = SET.LOCAL_DATA_FOLDER
+    new_folder = os.path.join(cache_dir, "")
+    for name in dir(SET):
+        value = getattr(SET, name)
+        if name.isupper() and isinstance(value, str) and \
+           value.startswith(old_folder):
+            setattr(SET, name, new_folder + value[len(old_folder):])
+
+def parse_states(states: str) -> list:
+    """
+    Returns the state abbreviations of a comma-separated list, or every
+    state plus DC and Puerto Rico if empty.
+
+    Raises
+    ------
+    typer.BadParameter
+        If any is not a state or territory.
+
+    """
+    if not states:
+        return [state.abbr for state in us.states.STATES +
+                                        [us.states.DC, us.states.PR]]
+    state_abbrs = []
+    for name in states.replace(" ", ",").split(","):
+        if not name:
+            continue
+        state = us.states.lookup(name)
+        if state is None:
+            raise typer.BadParameter(f"{name} is not a state or territory.")
+        state_abbrs.append(state.abbr)
+    return state_abbrs
+
+def parse_columns(columns: str) -> list:
+    """
+    Returns the MGGG columns of a comma-separated list, or None for all
+    of them if empty.
+
+    Raises
+    ------
+    typer.BadParameter
+        If any is not a count CVAP or race data can produce.
+
+    """
+    if not columns:
+        return None
+    columns = [col for col in columns.replace(" ", ",").split(",") if col]
+    try:
+        check_columns(columns, RACE_CVAP_COLUMNS)
+    except ValueError as error:
+        raise typer.BadParameter(str(error))
+    return columns
+
+def check_options(fmt: str, summary_level: str):
+    """
+    Raises typer.BadParameter for unknown formats or summary levels.
+    """
+    if fmt not in FORMATS:
+        raise typer.BadParameter(f"Format must be one of {list(FORMATS)}, " + \
+                                 f"not {fmt}.")
+    if summary_level not in SUMMARY_LEVELS:
+        raise typer.BadParameter(f"Summary level must be one of " + \
+                                 f"{list(SUMMARY_LEVELS)}, not " + \
+                                 f"{summary_level}.")
+
+def output_filename(state_abbr: str, fmt: str, summary_level: str, \
+                    output_folder: str = "") -> str:
+    """
+    Returns the output filename of a state, e.g.
+    data/cvap_acs_output/HI_cvap_acs/HI_cvap_acs_tract.parquet, in the
+    folder make_race_cvap_shp writes to.
+    """
+    output_folder = output_folder if output_folder \
+                    else SET.DEFAULT_OUPUT_FOLDER
+    state_name = f"{state_abbr}_{SET.DEFAULT_OUTPUT}"
+    level = "" if summary_level == "block_group" else f"_{summary_level}"
+    return os.path.join(output_folder, state_name,
+                        f"{state_name}{level}{FORMATS[fmt]}")
+
+def write_output(race_cvap_gdf, state_abbr: str, output: str, fmt: str, \
+                 jobs: int = None) -> str:
+    """
+    Writes merged data of a state in a format, returning its filename.
+    Shapefiles and GeoParquet get a validation report next to them.
+    """
+    output_folder = os.path.dirname(output)
+    if output_folder and not os.path.isdir(output_folder):
+        os.makedirs(output_folder, exist_ok=True)
+
+    if fmt in ("shp", "parquet"):
+        report = validate_race_cvap(race_cvap_gdf, state_abbr)
+        output_gdf = to_output_dtypes(race_cvap_gdf)
+        if fmt == "shp":
+            output_gdf.to_file(output)
+        else:
+            output_gdf.to_parquet(output, index=False)
+        write_report(report, os.path.splitext(output)[0] + \
+                             SET.VALIDATION_SUFFIX)
+    elif fmt == "topojson":
+        write_topojson(race_cvap_gdf, output)
+    elif fmt == "graph":
+        write_graph_json(race_cvap_gdf, output)
+    elif fmt == "tiles":
+        # Only tile builds need mapbox_vector_tile
+        try: from tiles import make_tile_pyramid
+        except: from tools.tiles import make_tile_pyramid
+        make_tile_pyramid(race_cvap_gdf, output, jobs=jobs)
+    elif fmt == "csv":
+        to_output_dtypes(race_cvap_gdf).to_csv(output, index=False)
+    return output
+
+def report_errors(errors: dict):
+    """
+    Prints every failed task and exits with code 1 if there are any.
+    """
+    for name, error in errors.items():
+        typer.echo(f"{name}: {type(error).__name__}: {error}", err=True)
+    if errors:
+        raise typer.Exit(code=1)
+
+@app.command()
+def ingest(states: str = typer.Option("", help="e.g. HI,RI"),
+           jobs: int = typer.Option(SET.SCHEDULER_POOLS["network"],
+                                    help="Sources fetched at once."),
+           cache_dir: str = typer.Option("", help="Data folder."),
+           download: bool = typer.Option(False,
+                                         help="Download missing TIGER.")):
+    """
+    Downloads and caches the TIGER, CVAP and race sources of each state.
+    """
+    use_cache_dir(cache_dir)
+    tasks = []
+    for state_abbr in parse_states(states):
+        # Only the caches are wanted, not the data itself
+        tasks += [
+            {"name": f"{state_abbr}:tiger", "pool": "network",
+             "func": check_download_tiger_file,
+             "args": [state_abbr, download]},
+            {"name": f"{state_abbr}:cvap", "pool": "cpu",
+             "func": lambda state_abbr: len(get_cvap_bgs(state_abbr)),
+             "args": [state_abbr]},
+            {"name": f"{state_abbr}:race", "pool": "network",
+             "func": lambda state_abbr: len(get_race_origin_bgs(state_abbr)),
+             "args": [state_abbr]},
+        ]
+    results, errors = run_tasks(tasks, {"network": jobs})
+    typer.echo(f"Ingested {len(results)} of {len(tasks)} sources.")
+    report_errors(errors)
+
+@app.command()
+def build(states: str = typer.Option("", help="e.g. HI,RI"),
+          fmt: str = typer.Option("shp", "--format",
+                                  help=f"One of {', '.join(FORMATS)}."),
+          summary_level: str = typer.Option("block_group",
+                                            help="block_group, tract " + \
+                                                 "or county."),
+          jobs: int = typer.Option(SET.SCHEDULER_POOLS["cpu"],
+                                   help="States merged at once."),
+          cache_dir: str = typer.Option("", help="Data folder."),
+          output: str = typer.Option("", help="Output folder."),
+          download: bool = typer.Option(False,
+                                        help="Download missing TIGER."),
+          columns: str = typer.Option("", help="Counts to build, e.g. " + \
+                                              "TOTPOP,CVAP,HCVAP.")):
+    """
+    Merges and writes each state in a format and summary level.
+    """
+    check_options(fmt, summary_level)
+    columns = parse_columns(columns)
+    use_cache_dir(cache_dir)
+    tasks = []
+    for state_abbr in parse_states(states):
+        tasks += [
+            {"name": f"{state_abbr}:merge", "pool": "cpu",
+             "func": make_race_cvap_df if fmt == "csv" \
+                     else make_race_cvap_gdf,
+             "args": [state_abbr, download, summary_level],
+             "kwargs": {"columns": columns}},
+            {"name": f"{state_abbr}:write", "pool": "disk",
+             "func": write_output,
+             "args": [state_abbr, output_filename(state_abbr, fmt,
+                                                  summary_level, output),
+                      fmt, jobs],
+             "inputs": [f"{state_abbr}:merge"]},
+        ]
+    results, errors = run_tasks(tasks, {"cpu": jobs, "disk": jobs})
+    for filename in results.values():
+        typer.echo(filename)
+    report_errors(errors)
+
+@app.command()
+def prorate(filename: str = typer.Argument(..., help="Shapefile to " + \
+                                                     "prorate onto."),
+            output: str = typer.Argument(..., help="New shapefile."),
+            states: str = typer.Option(..., help="States it covers."),
+            summary_level: str = typer.Option("block_group",
+                                              help="block_group, tract " + \
+                                                   "or county."),
+            overwrite: bool = typer.Option(False, help="Replace counts " + \
+                                                       "already there."),
+            cache_dir: str = typer.Option("", help="Data folder."),
+            download: bool = typer.Option(False,
+                                          help="Download missing TIGER.")):
+    """
+    Prorates counts of the states by area onto the shapes of a file.
+    """
+    check_options("shp", summary_level)
+    use_cache_dir(cache_dir)
+    race_cvap_gdf = pd.concat([make_race_cvap_gdf(state_abbr, download,
+                                                  summary_level)
+                               for state_abbr in parse_states(states)],
+                              ignore_index=True)
+    prorated = prorate_race_cvap_gdf(gpd.read_file(filename), race_cvap_gdf,
+                                     overwrite)
+    prorated.to_file(output)
+    typer.echo(output)
+
+@app.command()
+def validate(states: str = typer.Option("", help="e.g. HI,RI"),
+             fmt: str = typer.Option("shp", "--format",
+                                     help="shp or parquet."),
+             summary_level: str = typer.Option("block_group",
+                                               help="block_group, tract " + \
+                                                    "or county."),
+             cache_dir: str = typer.Option("", help="Data folder."),
+             output: str = typer.Option("", help="Output folder."),
+             strict: bool = typer.Option(False, help="Fail on any " + \
+                                                     "failed check.")):
+    """
+    Checks the written output of each state, rewriting its report.
+    """
+    check_options(fmt, summary_level)
+    if fmt not in ("shp", "parquet"):
+        raise typer.BadParameter("Only shp and parquet output is validated.")
+    use_cache_dir(cache_dir)
+    errors = {}
+    for state_abbr in parse_states(states):
+        filename = output_filename(state_abbr, fmt, summary_level, output)
+        try:
+            race_cvap_gdf = gpd.read_file(filename) if fmt == "shp" \
+                            else gpd.read_parquet(filename)
+            report = validate_race_cvap(race_cvap_gdf, state_abbr, False)
+        except Exception as error:
+            errors[state_abbr] = error
+            continue
+        write_report(report, os.path.splitext(filename)[0] + \
+                             SET.VALIDATION_SUFFIX)
+        failed = {check: result["failed"]
+                  for check, result in report["checks"].items()
+                  if result["failed"]}
+        typer.echo(f"{state_abbr}: {'passed' if report['passed'] else failed}")
+        if strict and not report["passed"]:
+            errors[state_abbr] = ValueError(f"Validation failed: {failed}")
+    report_errors(errors)
+
+@app.command()
+def bench(states: str = typer.Option("HI", help="e.g. HI,RI"),
+          fmt: str = typer.Option("parquet", "--format",
+                                  help=f"One of {', '.join(FORMATS)}."),
+          summary_level: str = typer.Option("block_group",
+                                            help="block_group, tract " + \
+                                                 "or county."),
+          jobs: int = typer.Option(None, help="Worker processes of " + \
+                                              "rollups and tiles."),
+          cache_dir: str = typer.Option("", help="Data folder."),
+          report: str = typer.Option("", help="JSON file of timings.")):
+    """
+    Times each stage of each state, one after another, writing output
+    to a temporary folder.
+    """
+    check_options(fmt, summary_level)
+    use_cache_dir(cache_dir)
+    timings = {}
+    with tempfile.TemporaryDirectory() as output_folder:
+        for state_abbr in parse_states(states):
+            stages = timings[state_abbr] = {}
+
+            def timed(stage, func, *args, **kwargs):
+                start = time.perf_counter()
+                result = func(*args, **kwargs)
+                stages[stage] = round(time.perf_counter() - start, 3)
+                typer.echo(f"{state_abbr} {stage:<8} {stages[stage]:9.3f}s")
+                return result
+
+            cvap_bgs = timed("cvap", get_cvap_bgs, state_abbr)
+            race_origin_bgs = timed("race", get_race_origin_bgs, state_abbr)
+            # Tables read only the attributes of TIGER, no geometry
+            if fmt == "csv":
+                tiger_bgs = timed("tiger", get_tiger_attributes, state_abbr,
+                                  SET.TABULAR_TIGER_COLUMNS)
+            else:
+                tiger_bgs = timed("tiger", get_tiger_bgs, state_abbr)
+            race_cvap_gdf = timed("merge", merge_race_cvap_gdf, tiger_bgs,
+                                  cvap_bgs, race_origin_bgs)
+            del cvap_bgs, race_origin_bgs, tiger_bgs
+            if summary_level != "block_group" and fmt == "csv":
+                race_cvap_gdf = timed("rollup", aggregate_counts,
+                                      race_cvap_gdf, summary_level,
+                                      SET.TABULAR_TIGER_COLUMNS)
+            elif summary_level != "block_group":
+                race_cvap_gdf = timed("rollup", rollup_race_cvap_gdf,
+                                      race_cvap_gdf, state_abbr,
+                                      summary_level, jobs)
+            timed("write", write_output, race_cvap_gdf, state_abbr,
+                  output_filename(state_abbr, fmt, summary_level,
+                                  output_folder), fmt, jobs)
+            stages["total"] = round(sum(stages.values()), 3)
+    if report:
+        with open(report, "w") as report_file:
+            json.dump(timings, report_file, indent=2)
+
+@app.command()
+def serve(states: str = typer.Option("", help="States merged up front. " + \
+                                               "Others on request."),
+          port: int = typer.Option(SET.SERVICE_PORT, help="Port."),
+          unix_socket: str = typer.Option("", help="Unix socket to " + \
+                                                   "serve on instead."),
+          cache_dir: str = typer.Option("", help="Data folder."),
+          download: bool = typer.Option(False,
+                                        help="Download missing TIGER.")):
+    """
+    Serves merged states, held in memory, until interrupted.
+    """
+    use_cache_dir(cache_dir)
+    serve_race_cvap(parse_states(states) if states else [], port=port,
+                    unix_socket=unix_socket, download_allowed=download)
+
+if __name__ == "__main__":
+    app()
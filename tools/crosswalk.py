@@ -0,0 +1,380 @@
+"""
+This pipeline is pinned to 2019 TIGER block groups, drawn on 2010
+geography, while plans are now drawn on 2020 geography. This module
+reads the Census relationship files between 2010 and 2020 blocks, builds
+a sparse matrix converting 2019 block groups into 2020 block groups or
+blocks, and converts every count column in one sparse multiply.
+
+Examples
+--------
+This module has three functions that can be used separately.
+
+    First, get_relationship_file returns the filename of a state's
+    2010 to 2020 block relationship file, downloading it if allowed.
+
+    hi_relationships = get_relationship_file("HI", download_allowed=True)
+
+    Second, get_crosswalk returns a state's conversion matrix, building
+    it from the relationship file the first time and from cache after.
+
+    hi_crosswalk = get_crosswalk("HI", "block_group")
+
+    Third, crosswalk_counts converts every count of merged block groups.
+
+    hi_bgs = census_adder.make_race_cvap_gdf("HI")
+    hi_bgs20 = crosswalk_counts(hi_bgs, "HI", "block_group")
+    hi_blocks20 = crosswalk_counts(hi_bgs, "HI", "block",
+                                   block_weights=hi_block_pops)
+
+Notes
+-----
+Each row of a relationship file is a piece of a 2010 block within a
+2020 block, with the land area of their intersection, AREALAND_INT. A
+2019 block group is its 2010 blocks, so its counts are split among the
+2020 units its pieces fall in, in proportion to
+
+    land area of each piece, or
+    2010 population of the piece's block times its share of the
+    block's land, given block_weights as in disaggregate.py,
+
+falling back on water area, then equal shares, for block groups that
+have no weight at all. Every column of the matrix adds up to one, so
+conversion keeps each state's totals.
+
+The matrix is sparse, each row a 2020 unit and each column a 2019 block
+group, so converting a state's counts is one product
+
+    counts_2020 = crosswalk @ counts_2019
+
+Matrices are cached in CROSSWALK_FOLDER, one per state, target level and
+weighting, e.g.
+
+    data/Crosswalk10_20/15_block_group_land.npz
+
+A few counties were renamed between the 2010 Census and 2019 TIGER,
+e.g. Shannon County, SD, into Oglala Lakota. Their codes are changed
+with COUNTY_RECODES in the settings so that they meet the 2019 keys.
+
+Counts come out as floats, as pieces split block groups unevenly.
+
+Requires scipy.
+"""
+import os
+import glob
+import errno
+import hashlib
+import threading
+import warnings
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+import us
+import wget
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from schema import COUNT_COLUMNS, GEOID_DTYPE
+except: from tools.schema import COUNT_COLUMNS, GEOID_DTYPE
+
+try: from geoid import parse_geoid_keys, geoid_keys_to_strings, \
+                       check_sorted_keys, GEOID_DIGITS
+except: from tools.geoid import parse_geoid_keys, geoid_keys_to_strings, \
+                              check_sorted_keys, GEOID_DIGITS
+
+
+# Number of GEOID digits of each 2020 target
+TARGET_LEVELS = {"block_group": 12, "block": 15}
+
+# Columns of the relationship files read, codes then areas
+RELATIONSHIP_CODES = ["STATE_2010", "COUNTY_2010", "TRACT_2010", "BLK_2010",
+                      "STATE_2020", "COUNTY_2020", "TRACT_2020", "BLK_2020"]
+RELATIONSHIP_AREAS = ["AREALAND_INT", "AREAWATER_INT"]
+
+def get_relationship_file(state_abbr: str, \
+                          download_allowed: bool = False) -> str:
+    """
+    Returns the filename of a state's 2010 to 2020 block relationship
+    file, downloading and unzipping it from the Census if allowed.
+
+    Raises
+    ------
+    FileNotFoundError
+        In case the file isn't found and downloading is not permitted.
+
+    """
+    state = us.states.lookup(state_abbr)
+    if not os.path.isdir(SET.CROSSWALK_FOLDER):
+        os.makedirs(SET.CROSSWALK_FOLDER)
+
+    # e.g. tab2010_tab2020_st15_hi.txt
+    pattern = f"{SET.CROSSWALK_FOLDER}tab2010_tab2020_st{state.fips}*.txt"
+    found = sorted(glob.glob(pattern) + glob.glob(pattern.upper()))
+    if found:
+        return found[0]
+
+    zip_name = f"{SET.CROSSWALK_PREFIX}{state.fips}.zip"
+    local_zip = SET.CROSSWALK_FOLDER + zip_name
+    if not os.path.isfile(local_zip):
+        if not download_allowed:
+            raise FileNotFoundError(
+                errno.ENOENT,
+                (f"Relationship file for {state.name} not found, " +
+                    "downloading disabled."),
+                zip_name)
+        try:
+            wget.download(SET.CROSSWALK_URL + zip_name, local_zip, bar=None)
+        except Exception as err:
+            print(f"Unable to download {state.name} relationship file " + \
+                  f"from: {SET.CROSSWALK_URL + zip_name}")
+            raise err
+    with ZipFile(local_zip, "r") as relationship_zip:
+        relationship_zip.extractall(SET.CROSSWALK_FOLDER)
+    os.remove(local_zip)
+    return get_relationship_file(state_abbr)
+
+def read_relationships(filename: str) -> pd.DataFrame:
+    """
+    Reads the codes and areas of every piece of a relationship file.
+    """
+    return pd.read_csv(filename, sep="|", usecols=RELATIONSHIP_CODES +
+                       RELATIONSHIP_AREAS, dtype=str,
+                       encoding="latin-1")
+
+def block_keys(relationships: pd.DataFrame, vintage: str) -> np.ndarray:
+    """
+    Returns the int64 fifteen-digit key of the 2010 or 2020 block of
+    each piece, from its codes, without building strings.
+    """
+    codes = [pd.to_numeric(relationships[f"{name}_{vintage}"]).to_numpy(
+                 dtype=np.int64)
+             for name in ("STATE", "COUNTY", "TRACT", "BLK")]
+    state, county, tract, block = codes
+    return ((state * 1000 + county) * 1000000 + tract) * 10000 + block
+
+def recode_counties(bg_keys: np.ndarray) -> np.ndarray:
+    """
+    Changes the keys of block groups of counties renamed since 2010 to
+    their 2019 codes, see COUNTY_RECODES in settings.
+    """
+    scale = 10 ** (GEOID_DIGITS - 5)
+    counties = bg_keys // scale
+    for old, new in SET.COUNTY_RECODES.items():
+        bg_keys = np.where(counties == int(old),
+                           bg_keys + (int(new) - int(old)) * scale, bg_keys)
+    return bg_keys
+
+def piece_weights(sources: np.ndarray, candidates: list) -> np.ndarray:
+    """
+    Returns the weight of each piece from the first of the candidate
+    weights under which its source block group weighs anything, else 1.
+    """
+    weights = candidates[0]
+    for fallback in candidates[1:] + [np.ones(len(sources))]:
+        totals = np.bincount(sources, weights=weights)
+        weights = np.where(totals[sources] > 0, weights, fallback)
+    return weights
+
+def make_crosswalk(relationships: pd.DataFrame, \
+                   target_level: str = "block_group", \
+                   block_weights: pd.DataFrame = None, \
+                   block_column: str = "", weight_column: str = "") -> dict:
+    """
+    Builds the sparse matrix converting 2019 block groups into 2020
+    block groups or blocks from the pieces of a relationship file.
+
+    Parameters
+    ----------
+    relationships: pandas.DataFrame
+        Pieces of a relationship file, see read_relationships.
+    target_level: str
+        "block_group" or "block" of 2020.
+    block_weights: pandas.DataFrame
+        Fifteen-digit GEOID and weight, e.g. population, of each 2010
+        block. Default of land area alone.
+    block_column, weight_column: str
+        Columns of block_weights. Default to BLOCK_GEOID_COLUMN and
+        BLOCK_WEIGHT_COLUMN in settings.
+
+    Returns
+    -------
+    dict
+        "matrix", a scipy.sparse.csr_array of 2020 units by 2019 block
+        groups, "source_keys" and "target_keys", each sorted.
+
+    """
+    if target_level not in TARGET_LEVELS:
+        raise ValueError(f"Target level must be one of " + \
+                         f"{list(TARGET_LEVELS)}, not {target_level}.")
+    blocks_2010 = block_keys(relationships, "2010")
+    blocks_2020 = block_keys(relationships, "2020")
+    land, water = (pd.to_numeric(relationships[col]).to_numpy(dtype=float)
+                   for col in RELATIONSHIP_AREAS)
+
+    bg_keys = recode_counties(blocks_2010 // 1000)
+    target_keys = blocks_2020 // 10 ** (15 - TARGET_LEVELS[target_level])
+    source_keys, sources = np.unique(bg_keys, return_inverse=True)
+    target_keys, targets = np.unique(target_keys, return_inverse=True)
+
+    candidates = [land, water]
+    if block_weights is not None:
+        block_column = block_column if block_column else \
+                       SET.BLOCK_GEOID_COLUMN
+        weight_column = weight_column if weight_column else \
+                        SET.BLOCK_WEIGHT_COLUMN
+        # Each piece takes its share of its block's land of the block's
+        # weight, or all of it for a block of water alone
+        weighted_keys = parse_geoid_keys(
+            block_weights[block_column].astype(str), digits=15)
+        order = np.argsort(weighted_keys, kind="stable")
+        weighted_keys = weighted_keys[order]
+        weight = pd.to_numeric(block_weights[weight_column]).to_numpy(
+            dtype=float, na_value=0.0)[order]
+        rows = np.searchsorted(weighted_keys, blocks_2010).clip(
+            0, max(len(weighted_keys) - 1, 0))
+        found = (weighted_keys[rows] == blocks_2010) if len(weighted_keys) \
+                else np.zeros(len(blocks_2010), dtype=bool)
+        _, block_index = np.unique(blocks_2010, return_inverse=True)
+        shares = piece_weights(block_index, [land, water])
+        shares = shares / np.bincount(block_index, weights=shares)[block_index]
+        candidates.insert(0, np.where(found, weight[rows], 0.0) * shares)
+
+    weights = piece_weights(sources, candidates)
+    weights = weights / np.bincount(sources, weights=weights)[sources]
+    matrix = scipy.sparse.coo_array(
+        (weights, (targets, sources)),
+        shape=(len(target_keys), len(source_keys))).tocsr()
+    return {"matrix": matrix, "source_keys": source_keys,
+            "target_keys": target_keys}
+
+def get_crosswalk(state_abbr: str, target_level: str = "block_group", \
+                  block_weights: pd.DataFrame = None, \
+                  block_column: str = "", weight_column: str = "", \
+                  download_allowed: bool = False) -> dict:
+    """
+    Returns a state's conversion matrix from 2019 block groups, reading
+    it from cache if it was built before with the same weights. See
+    make_crosswalk for the parameters and what is returned.
+    """
+    state = us.states.lookup(state_abbr)
+    weighting = "land"
+    if block_weights is not None:
+        block_column = block_column if block_column else \
+                       SET.BLOCK_GEOID_COLUMN
+        weight_column = weight_column if weight_column else \
+                        SET.BLOCK_WEIGHT_COLUMN
+        digest = hashlib.sha256()
+        for col in (block_column, weight_column):
+            digest.update(pd.util.hash_pandas_object(
+                block_weights[col], index=False).to_numpy().tobytes())
+        weighting = f"{weight_column}_{digest.hexdigest()[:16]}"
+    filename = (SET.CROSSWALK_FOLDER +
+                f"{state.fips}_{target_level}_{weighting}.npz")
+
+    if os.path.isfile(filename):
+        with np.load(filename) as cached:
+            matrix = scipy.sparse.csr_array(
+                (cached["data"], cached["indices"], cached["indptr"]),
+                shape=tuple(cached["shape"]))
+            return {"matrix": matrix, "source_keys": cached["source_keys"],
+                    "target_keys": cached["target_keys"]}
+
+    relationships = read_relationships(
+        get_relationship_file(state_abbr, download_allowed))
+    crosswalk = make_crosswalk(relationships, target_level, block_weights,
+                               block_column, weight_column)
+
+    # Write whole then move into place, as other runs may be reading
+    matrix = crosswalk["matrix"]
+    tmp_file = f"{filename}.tmp{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_file, "wb") as cache_file:
+        np.savez(cache_file, data=matrix.data, indices=matrix.indices,
+                 indptr=matrix.indptr, shape=np.array(matrix.shape),
+                 source_keys=crosswalk["source_keys"],
+                 target_keys=crosswalk["target_keys"])
+    os.replace(tmp_file, filename)
+    return crosswalk
+
+def crosswalk_counts(race_cvap_bgs: pd.DataFrame, state_abbr: str, \
+                     target_level: str = "block_group", \
+                     block_weights: pd.DataFrame = None, \
+                     block_column: str = "", weight_column: str = "", \
+                     download_allowed: bool = False) -> pd.DataFrame:
+    """
+    Converts every count of a state's 2019 block groups into 2020 block
+    groups or blocks.
+
+    Parameters
+    ----------
+    race_cvap_bgs: pandas.DataFrame
+        Block groups with counts, sorted by GEOID_KEY, e.g. from
+        make_race_cvap_gdf. Geometry, if any, is left behind.
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    target_level: str
+        "block_group" or "block" of 2020.
+    block_weights: pandas.DataFrame
+        Weight of each 2010 block, see make_crosswalk. Default of land
+        area.
+    block_column, weight_column: str
+        Columns of block_weights. Default to BLOCK_GEOID_COLUMN and
+        BLOCK_WEIGHT_COLUMN in settings.
+    download_allowed : bool
+        Flag as to whether to download missing relationship files or
+        raise error.
+
+    Returns
+    -------
+    pandas.DataFrame
+        GEOID, GEOID_KEY and float counts of each 2020 unit, sorted by
+        GEOID_KEY. A count is missing wherever a block group adding to
+        it misses it. Block groups found on one side only are listed in
+        attrs["crosswalk_report"].
+
+    """
+    crosswalk = get_crosswalk(state_abbr, target_level, block_weights,
+                              block_column, weight_column, download_allowed)
+    source_keys = crosswalk["source_keys"]
+
+    bg_keys = race_cvap_bgs["GEOID_KEY"].to_numpy()
+    check_sorted_keys(bg_keys, "block groups")
+    rows = np.searchsorted(bg_keys, source_keys).clip(
+        0, max(len(bg_keys) - 1, 0))
+    found = (bg_keys[rows] == source_keys) if len(bg_keys) else \
+            np.zeros(len(source_keys), dtype=bool)
+
+    # One dense column per count, in the order of the matrix, then one
+    # product for all of them
+    counts = [col for col in race_cvap_bgs.columns if col in COUNT_COLUMNS]
+    sources = np.zeros((len(source_keys), len(counts)))
+    for i, col in enumerate(counts):
+        values = race_cvap_bgs[col].to_numpy(dtype=float, na_value=np.nan)
+        sources[:, i] = np.where(found, values[rows], 0.0)
+    converted = crosswalk["matrix"] @ sources
+
+    target_keys = crosswalk["target_keys"]
+    targets = pd.DataFrame({
+        "GEOID": geoid_keys_to_strings(target_keys,
+                                       TARGET_LEVELS[target_level]),
+        "GEOID_KEY": target_keys,
+    })
+    targets["GEOID"] = targets["GEOID"].astype(GEOID_DTYPE)
+    targets[counts] = converted
+
+    lost = bg_keys[~np.isin(bg_keys, source_keys)]
+    absent = source_keys[~found]
+    targets.attrs["crosswalk_report"] = {
+        "block_groups_not_in_crosswalk": {
+            "count": int(len(lost)),
+            "geoids": geoid_keys_to_strings(lost).tolist()},
+        "crosswalk_block_groups_without_data": {
+            "count": int(len(absent)),
+            "geoids": geoid_keys_to_strings(absent).tolist()},
+    }
+    if len(lost) or len(absent):
+        warnings.warn(f"{len(lost)} block groups not in crosswalk and " + \
+                      f"{len(absent)} crosswalk block groups without data.")
+    return targets
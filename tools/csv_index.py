@@ -0,0 +1,267 @@
+"""
+Reading the rows of one state from a national csv means tokenizing the
+whole file, every time. This module builds a small sidecar index of
+where each state's and county's rows lie in the csv, in bytes, so that
+a state, or a few counties, can be read by parsing only their own
+slices of a memory-mapped file.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, get_csv_index returns the index of a csv, building it once
+    and saving it next to the csv, e.g. BlockGr.csv.idx.json.
+
+    cvap_index = get_csv_index(SET.LOCAL_CVAP_CSV, "15000US")
+    cvap_index["states"]["15"]
+
+    Second, read_indexed_rows parses only the rows of one state, or of
+    some of its GEOID prefixes, e.g. the county of Maui.
+
+    hi_rows = read_indexed_rows(SET.LOCAL_CVAP_CSV, "geoid", "15000US",
+                                "15")
+    maui_rows = read_indexed_rows(SET.LOCAL_CVAP_CSV, "geoid", "15000US",
+                                  "15", geoid_prefixes=["15009"])
+
+    ingest.read_state_rows does so with CSV_INDEX set to True in the
+    settings, unless in low memory mode, which takes precedence.
+
+Notes
+-----
+The index is a JSON file holding the size and modification time of the
+csv, the byte range of its header and, for each State FIPS and each
+State and County FIPS, a list of byte ranges of its rows.
+
+    {"size": 455871983, "mtime_ns": 1612137600000000000,
+     "geoid_prefix": "15000US", "header": [0, 81],
+     "states": {"01": [[81, 7540018]], ...},
+     "counties": {"01001": [[81, 121345]], ...}}
+
+An index whose size or modification time no longer matches its csv, or
+made before counties were indexed, is rebuilt. Runs building the same
+index take turns on a lock file beside it, so only the first scans the
+csv and the rest read what it wrote.
+
+The State and County FIPS of each row are taken from the first long
+GEOID on it, found by the GEOID prefix and five digits, e.g.
+"15000US15009". Commas in
+quoted names, like "Census Tract 201, Honolulu County, Hawaii", do not
+matter. Consecutive rows of one state, or county, form one range, so a
+csv sorted by GEOID has one range per state and county.
+"""
+import os
+import io
+import re
+import json
+import mmap
+import fcntl
+import threading
+
+import numpy as np
+import pandas as pd
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+
+# Bytes scanned for line breaks at a time while building an index
+SCAN_BYTES = 2 ** 26
+
+def index_filename(csv_path: str) -> str:
+    """
+    Returns the filename of the sidecar index of a csv.
+    """
+    return csv_path + SET.CSV_INDEX_SUFFIX
+
+def byte_ranges(rows: np.ndarray, row_fips: np.ndarray, starts: np.ndarray,
+                ends: np.ndarray, digits: int) -> dict:
+    """
+    Returns the byte ranges of the rows of each FIPS code, consecutive
+    rows of one code becoming one range.
+    """
+    new_run = np.ones(len(rows), dtype=bool)
+    new_run[1:] = (np.diff(rows) != 1) | (np.diff(row_fips) != 0)
+    run_first = np.flatnonzero(new_run)
+    run_last = np.append(run_first[1:], len(rows))[:len(run_first)] - 1
+
+    ranges = {}
+    for first_row, last_row, fips in zip(rows[run_first], rows[run_last],
+                                         row_fips[run_first]):
+        ranges.setdefault(f"{fips:0{digits}d}", []).append(
+            [int(starts[first_row]), int(ends[last_row])])
+    return ranges
+
+def build_csv_index(csv_path: str, geoid_prefix: str) -> dict:
+    """
+    Scans a national csv once for the byte ranges of each state's rows.
+
+    Parameters
+    ----------
+    csv_path: str
+        Filepath of national csv.
+    geoid_prefix: str
+        Start of long GEOIDs before the State FIPS, e.g. "15000US".
+
+    Returns
+    -------
+    dict
+        Index of the csv. See Notes of this module.
+
+    """
+    stat = os.stat(csv_path)
+    with open(csv_path, "rb") as csv_file, \
+         mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        size = len(data)
+        header_end = data.find(b"\n") + 1 or size
+
+        # Start of every row after the header, block by block
+        starts = [np.array([header_end])]
+        for block in range(header_end, size, SCAN_BYTES):
+            line_breaks = np.frombuffer(data, np.uint8,
+                                        min(SCAN_BYTES, size - block),
+                                        block) == ord("\n")
+            starts.append(np.flatnonzero(line_breaks) + block + 1)
+        starts = np.concatenate(starts)
+        starts = starts[starts < size]
+
+        # State and County FIPS of the first long GEOID on each row
+        pattern = re.compile(re.escape(geoid_prefix.encode()) +
+                             rb"(\d{5})")
+        positions = []
+        fips = []
+        match = None
+        for match in pattern.finditer(data, header_end):
+            positions.append(match.start())
+            fips.append(int(match.group(1)))
+        # A match holds on to the memory map until let go
+        del match
+
+    rows = np.searchsorted(starts, np.array(positions, dtype=np.int64),
+                           side="right") - 1
+    rows, first = np.unique(rows, return_index=True)
+    row_fips = np.array(fips, dtype=np.int64)[first]
+    ends = np.append(starts[1:], size)
+
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "geoid_prefix": geoid_prefix,
+        "header": [0, header_end],
+        "states": byte_ranges(rows, row_fips // 1000, starts, ends, 2),
+        "counties": byte_ranges(rows, row_fips, starts, ends, 5),
+    }
+
+def read_matching_index(filename: str, stat: os.stat_result,
+                        geoid_prefix: str):
+    """
+    Returns the saved index if it still matches the csv's size,
+    modification time and GEOID prefix, or else None.
+    """
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as index_file:
+        csv_index = json.load(index_file)
+    if csv_index["size"] == stat.st_size and \
+       csv_index["mtime_ns"] == stat.st_mtime_ns and \
+       csv_index["geoid_prefix"] == geoid_prefix and \
+       "counties" in csv_index:
+        return csv_index
+    return None
+
+def get_csv_index(csv_path: str, geoid_prefix: str) -> dict:
+    """
+    Returns the index of a national csv, from its sidecar file if it
+    still matches the csv's size and modification time, or else built
+    anew and saved.
+
+    Parameters
+    ----------
+    csv_path: str
+        Filepath of national csv.
+    geoid_prefix: str
+        Start of long GEOIDs before the State FIPS, e.g. "15000US".
+
+    Returns
+    -------
+    dict
+        Index of the csv. See Notes of this module.
+
+    """
+    stat = os.stat(csv_path)
+    filename = index_filename(csv_path)
+    csv_index = read_matching_index(filename, stat, geoid_prefix)
+    if csv_index is not None:
+        return csv_index
+
+    # Only one run scans, the rest wait for it and read its index
+    with open(filename + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        csv_index = read_matching_index(filename, stat, geoid_prefix)
+        if csv_index is not None:
+            return csv_index
+
+        csv_index = build_csv_index(csv_path, geoid_prefix)
+
+        # Write whole then move into place, as other runs may be reading
+        tmp_file = f"{filename}.tmp{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_file, "w") as index_file:
+            json.dump(csv_index, index_file)
+        os.replace(tmp_file, filename)
+    return csv_index
+
+def read_indexed_rows(csv_path: str, geoid_column: str, geoid_prefix: str,
+                      state_fips: str, columns: list = None,
+                      geoid_prefixes: list = None) -> pd.DataFrame:
+    """
+    Returns the rows of one state of a national csv, parsing only the
+    byte ranges the index lists for it, or for the counties of the
+    given GEOID prefixes.
+
+    Parameters
+    ----------
+    csv_path: str
+        Filepath of national csv.
+    geoid_column: str
+        Name of column of long GEOIDs, e.g. "geoid".
+    geoid_prefix: str
+        Start of long GEOIDs before the State FIPS, e.g. "15000US".
+    state_fips: str
+        Two-digit State FIPS code, e.g. "15".
+    columns: list of str
+        Columns to read. Defaults to all columns.
+    geoid_prefixes: list of str
+        Short GEOID prefixes within the state to read, e.g. "15009" for
+        a county. Defaults to the whole state.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Rows of the target state, which may be none.
+
+    """
+    csv_index = get_csv_index(csv_path, geoid_prefix)
+    # Any prefix shorter than a county reads the whole state
+    if geoid_prefixes is None or \
+       any(len(prefix) < 5 for prefix in geoid_prefixes):
+        ranges = csv_index["states"].get(state_fips, [])
+    else:
+        ranges = sorted({tuple(byte_range) for prefix in geoid_prefixes
+                         for byte_range in
+                         csv_index["counties"].get(prefix[:5], [])})
+    with open(csv_path, "rb") as csv_file, \
+         mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        header_start, header_end = csv_index["header"]
+        state_bytes = b"".join(
+            [data[header_start:header_end]] +
+            [data[start:end] for start, end in ranges])
+
+    state_rows = pd.read_csv(io.BytesIO(state_bytes), usecols=columns,
+                             dtype={geoid_column: str})
+    # Only rows whose own GEOID is selected, as in a full scan
+    long_prefixes = tuple(f"{geoid_prefix}{prefix}" for prefix in
+                          (geoid_prefixes if geoid_prefixes is not None
+                           else [state_fips]))
+    selected = state_rows[geoid_column].str.startswith(long_prefixes) \
+               if long_prefixes else pd.Series(False, index=state_rows.index)
+    return state_rows[selected.fillna(False)].reset_index(drop=True)
@@ -62,11 +62,34 @@ with due credit to the creators above for solving the puzzle.
 """
 import os
 import us
-import polars as pl
+import pandas as pd
 # To make work in project or editor namespace
 try: import settings as SET
 except: import tools.settings as SET
 
+try: from schema import conform_to_schema, check_columns
+except: from tools.schema import conform_to_schema, check_columns
+
+try: from geoid import attach_geoid_keys
+except: from tools.geoid import attach_geoid_keys
+
+try: from ingest import read_state_rows, iter_state_chunks
+except: from tools.ingest import read_state_rows, iter_state_chunks
+
+try: from selection import selector_prefixes, resolve_selector
+except: from tools.selection import selector_prefixes, resolve_selector
+
+# Long GEOIDs carry a summary level prefix, e.g. "15000US010010201001"
+CVAP_GEOID_PREFIX = "15000US"
+
+# Only these columns of the CVAP csv are ever used. Citizens of all
+# ages, cit_est, are kept only for the Total lntitle, as CPOP, and
+# geoname never makes it into MGGG columns.
+CVAP_CSV_COLUMNS = ["lntitle", "geoid", "cit_est", "cvap_est"]
+CVAP_GROUP_COLUMNS = ["lntitle", "geoid"]
+CVAP_SUMS = {"cvap_est": "sum", "cit_est": "sum"}
+CPOP_LNTITLE = "Total"
+
 
 # A dictionary that converts CVAP lntitle to MGGG-standard names
 CVAP_RACE_NAMES = {
@@ -123,9 +146,35 @@ RENAME_AGAIN = {
         "POP_NH_NHPI": "NHPIPOP",
         "CPOP_NH_WHITE": "WCPOP",
         "POP_NH_WHITE": "WPOP",
-        "CPOP_TOT": "CPOP",
+        "CPOP_TOTPOP": "CPOP",
     }
 
+# MGGG columns of CVAP data, in the order get_cvap_bgs returns them
+CVAP_COLUMNS = [RENAME_AGAIN[f"CVAP_{name}"]
+                for name in sorted(set(CVAP_RACE_NAMES.values()))
+                if name != "NH"] + ["CPOP"]
+
+def cvap_lntitles(columns: list = None) -> list:
+    """
+    Returns the lntitles of the CVAP csv that make up a list of MGGG
+    columns, e.g. the five lntitles of 2MORECVAP.
+
+    Parameters
+    ----------
+    columns: list of str
+        MGGG-named count columns, e.g. ["CVAP", "HCVAP"]. Defaults to
+        every lntitle.
+
+    Returns
+    -------
+    list of str
+        lntitles to keep.
+
+    """
+    return [lntitle for lntitle, name in CVAP_RACE_NAMES.items()
+            if columns is None or RENAME_AGAIN[f"CVAP_{name}"] in columns
+            or (lntitle == CPOP_LNTITLE and "CPOP" in columns)]
+
 def check_download_cvap19_data():
     """
     Checks if the CVAP 2019 csv file exists in the location specified by
@@ -154,7 +203,40 @@ def check_download_cvap19_data():
                                             "Please fetch CVAP data manually.")
     return SET.LOCAL_CVAP_CSV if file_exists else ""
 
-def get_cvap_bgs(state_abbr: str):
+def sum_cvap_estimates(cvap_rows: pd.DataFrame, \
+                       lntitles: list = None) -> pd.DataFrame:
+    """
+    Renames lntitles to MGGG standards and sums the CVAP and, if read,
+    citizen estimates of lntitles sharing a name in each block group,
+    e.g. the many NH_2MORE lines.
+
+    Parameters
+    ----------
+    cvap_rows: pandas.DataFrame
+        Rows of the CVAP csv.
+    lntitles: list of str
+        lntitles to keep, dropping all other rows before summing.
+        Defaults to all of them.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row for each block group and MGGG-named lntitle.
+
+    """
+    if lntitles is not None:
+        cvap_rows = cvap_rows[cvap_rows["lntitle"].isin(lntitles)]
+    cvap_rows = cvap_rows.replace(to_replace=CVAP_RACE_NAMES)
+    return (
+        cvap_rows.groupby(CVAP_GROUP_COLUMNS)
+        .agg({col: how for col, how in CVAP_SUMS.items()
+              if col in cvap_rows.columns})
+        .reset_index()
+    )
+
+def get_cvap_bgs(state_abbr: str, low_memory: bool = None, \
+                 memory_ceiling_mb: int = None, selector: dict = None, \
+                 columns: list = None):
     """
     This returns a pandas DataFrame of the Citizens of Voting Age
     Population in each Block Group of the specified state.
@@ -176,6 +258,21 @@ def get_cvap_bgs(state_abbr: str):
     ----------
     state_abbr: str
         Two-letter state abbriation of target state.
+    low_memory: bool
+        Flag as to whether to stream the national csv in chunks, keeping
+        only sums for the target state in memory. The result is the
+        same either way. Defaults to LOW_MEMORY in settings.
+    memory_ceiling_mb: int
+        Memory in megabytes any one chunk may take. Defaults to
+        MEMORY_CEILING_MB in settings.
+    selector: dict
+        GEOID prefixes, counties, bbox or mask of the block groups to
+        read, parsing only the rows of their counties. Default of whole
+        state. See selection.py.
+    columns: list of str
+        MGGG columns to return, e.g. ["CVAP", "HCVAP"], summing only
+        the lntitles they're made of. Columns of race data are ignored.
+        Defaults to every column in CVAP_COLUMNS.
 
     Returns
     -------
@@ -186,30 +283,58 @@ def get_cvap_bgs(state_abbr: str):
     """
     state = us.states.lookup(state_abbr)
     state_cvap_bgs = ""
+    check_columns(columns)
+    # With no CVAP column asked for, Total rows still list the GEOIDs
+    lntitles = None if columns is None else \
+               (cvap_lntitles(columns) or [CPOP_LNTITLE])
+    # Citizens of all ages are only read for CPOP
+    estimates = ["cvap_est"] + \
+                (["cit_est"] if columns is None or "CPOP" in columns else [])
+    csv_columns = [col for col in CVAP_CSV_COLUMNS
+                   if col in CVAP_GROUP_COLUMNS + estimates]
+
+    if low_memory is None:
+        low_memory = SET.LOW_MEMORY
 
     if check_download_cvap19_data():
-        cvap_bgs_pl = pl.scan_csv(SET.LOCAL_CVAP_CSV)
-        state_cvap_bgs = (
-            cvap_bgs_pl.filter(pl.lazy.col("geoname").str_contains(state.name))
-            .collect()
-            .to_pandas()
-        )
+        # Filter on State FIPS in the GEOID, as a state name like
+        # Virginia can also be found inside West Virginia.
+        state_prefix = f"{CVAP_GEOID_PREFIX}{state.fips}"
+        geoid_prefixes = selector_prefixes(
+            resolve_selector(state_abbr, selector), state.fips)
 
-        state_cvap_bgs.replace(to_replace=CVAP_RACE_NAMES, inplace=True)
-        
         # Sum cit estimate and cvap estimate in each geoid block group
-        state_cvap_bgs = (
-            state_cvap_bgs.groupby(["geoname", "lntitle", "geoid"])
-            .agg({"cit_est": "sum","cvap_est": "sum"})
-            .reset_index()
-        )
+        if low_memory:
+            # Sum each chunk as it streams by, then sum the sums.
+            chunk_sums = [
+                sum_cvap_estimates(chunk, lntitles) for chunk in
+                iter_state_chunks(SET.LOCAL_CVAP_CSV, "geoid", state_prefix,
+                                  csv_columns, memory_ceiling_mb,
+                                  geoid_prefixes=geoid_prefixes)
+            ]
+            state_cvap_bgs = (
+                pd.concat(chunk_sums).groupby(CVAP_GROUP_COLUMNS)
+                .agg({col: CVAP_SUMS[col] for col in estimates})
+                .reset_index()
+            )
+        else:
+            state_cvap_bgs = sum_cvap_estimates(
+                read_state_rows(SET.LOCAL_CVAP_CSV, "geoid", state_prefix,
+                                csv_columns, low_memory=False,
+                                geoid_prefixes=geoid_prefixes),
+                lntitles)
 
         # Pivot table such that new index is geoid
         state_cvap_bgs = state_cvap_bgs.pivot(
             index="geoid",
             columns="lntitle",
-            values=["cvap_est", "cit_est"],
+            values=estimates,
         )
+        if state_cvap_bgs.empty:
+            # A selection of no block groups pivots into no columns
+            state_cvap_bgs = state_cvap_bgs.reindex(
+                columns=pd.MultiIndex.from_product(
+                    [estimates, sorted(set(CVAP_RACE_NAMES.values()))]))
 
         # Reset index to make geoid a column
         state_cvap_bgs = state_cvap_bgs.reset_index()
@@ -217,24 +342,31 @@ def get_cvap_bgs(state_abbr: str):
         state_cvap_bgs.rename(columns={"cvap_est": "CVAP", "cit_est": "CPOP"},
                                         inplace=True)
 
-        # CPOP columns measure Total Citizens.
-        # We only want Total Citizens over 18: CVAP
-        # state_cvap_bgs.drop(columns=['CPOP'])
-        state_cvap_bgs = state_cvap_bgs.drop('CPOP', axis=1, level=0)
-
         # Demographics are listed in triplicate bewteen CVAP, CPOP
         # and POP. This is how we separate them out into columns.
         state_cvap_bgs.columns = [
             "_".join(col).strip() for col in state_cvap_bgs.columns.values
         ]
 
-        state_cvap_bgs = state_cvap_bgs.drop("CVAP_NH", axis=1)
+        state_cvap_bgs = state_cvap_bgs.drop("CVAP_NH", axis=1,
+                                             errors="ignore")
 
-        # Clean up to conform to MGGG Naming Standards
-        state_cvap_bgs = state_cvap_bgs.rename(columns={"geoid_": "GEOID"})
+        # CPOP columns measure Citizens of all ages. Only their Total
+        # is kept, to check that CVAP is no larger.
+        state_cvap_bgs = state_cvap_bgs.drop(columns=[
+            col for col in state_cvap_bgs.columns
+            if col.startswith("CPOP_") and col != "CPOP_TOTPOP"])
 
-        state_cvap_bgs["GEOID"] = state_cvap_bgs["GEOID"].apply(lambda x: x[7:])
+        # Clean up to conform to MGGG Naming Standards
+        # Parse short GEOID keys once and sort by them
+        state_cvap_bgs = attach_geoid_keys(state_cvap_bgs, "geoid_",
+                                           len(CVAP_GEOID_PREFIX))
         state_cvap_bgs = state_cvap_bgs.rename(columns=RENAME_AGAIN)
-        state_cvap_bgs.reset_index(inplace=True)
-
-        return state_cvap_bgs
+        if columns is not None:
+            # Lntitles a selection lacks still make <NA> columns
+            state_cvap_bgs = state_cvap_bgs.reindex(
+                columns=["GEOID", "GEOID_KEY"] +
+                        [col for col in CVAP_COLUMNS if col in columns])
+
+        # Compact dtypes, pivot holes become <NA> rather than float NaN
+        return conform_to_schema(state_cvap_bgs)
@@ -0,0 +1,243 @@
+"""
+Many plans are drawn on census blocks rather than block groups, so CVAP
+and Race/Origin data must be carried down from block groups to the
+blocks within them, in proportion to some weight such as population.
+This module does so for a whole state at once with sorted keys alone,
+without any geometry.
+
+Examples
+--------
+This module has one function to be used.
+
+    disaggregate_to_blocks allocates every count of merged block groups
+    to their blocks in proportion to a block weight, by default POP10
+    from TIGER's 2010 tabblock2010_15_pophu.
+
+    hi_bgs = census_adder.make_race_cvap_gdf("HI")
+    hi_blocks = disaggregate_to_blocks(hi_bgs, hi_block_pops)
+
+    or, in whole numbers adding up to each block group's counts,
+
+    hi_blocks = disaggregate_to_blocks(hi_bgs, hi_block_pops, integer=True)
+
+Notes
+-----
+A block GEOID is that of its block group followed by three digits,
+
+    15 007 040301 1 023
+    |--|---|------|-|---|
+    block group (12)
+
+so a block's block group key is its key divided by 1000, and blocks
+sorted by key are sorted by block group. Each block group's weights are
+then summed in one pass over the sorted keys, and each block takes its
+weight over that sum of every count of its block group.
+
+The 2019 ACS is tabulated on 2010 geography, so weights must be given
+for 2010 blocks, e.g. POP10 of TIGER 2010, and not 2020 blocks, which
+don't nest within 2019 block groups.
+
+A block group whose blocks all weigh nothing, e.g. one of only parks
+and water with residents in the ACS, is split equally among its blocks.
+With integer=True, counts are rounded down and what is left of each
+block group is handed out one each to the blocks with the largest
+remainders, ties going to the lowest GEOID, so every block group adds
+up exactly and runs give the same blocks the same counts.
+
+Block groups with no blocks in the weight table, and blocks of no
+block group in the data, are listed in attrs["disaggregation_report"].
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from schema import conform_to_schema, COUNT_COLUMNS, GEOID_DTYPE
+except: from tools.schema import conform_to_schema, COUNT_COLUMNS, \
+                                 GEOID_DTYPE
+
+try: from geoid import parse_geoid_keys, geoid_keys_to_strings, \
+                       check_sorted_keys, GEOID_DIGITS
+except: from tools.geoid import parse_geoid_keys, geoid_keys_to_strings, \
+                              check_sorted_keys, GEOID_DIGITS
+
+
+# Block GEOIDs are a Block Group GEOID followed by BLOCKCE(3)
+BLOCK_DIGITS = 15
+BLOCKS_PER_KEY = 10 ** (BLOCK_DIGITS - GEOID_DIGITS)
+
+def block_shares(bg_of_blocks: np.ndarray, weights: np.ndarray) -> tuple:
+    """
+    Returns each block's share of its block group, by weight or, where
+    a block group weighs nothing, equally.
+
+    Parameters
+    ----------
+    bg_of_blocks: numpy.ndarray
+        Sorted block group key of each block.
+    weights: numpy.ndarray
+        Non-negative weight of each block.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Share of each block, first block of each block group and which
+        block groups weigh nothing.
+
+    """
+    firsts = np.flatnonzero(np.r_[len(bg_of_blocks) > 0,
+                                  bg_of_blocks[1:] != bg_of_blocks[:-1]])
+    sizes = np.diff(np.r_[firsts, len(bg_of_blocks)])
+    totals = np.add.reduceat(weights, firsts) if len(firsts) else \
+             np.zeros(0)
+    weightless = totals <= 0
+
+    group = np.repeat(np.arange(len(firsts)), sizes)
+    shares = np.where(weightless[group], 1 / sizes[group],
+                      weights / np.where(weightless, 1, totals)[group])
+    return shares, firsts, weightless
+
+def round_within_groups(allocated: np.ndarray, totals: np.ndarray, \
+                        firsts: np.ndarray) -> np.ndarray:
+    """
+    Rounds allocated counts to whole numbers adding up to each block
+    group's total, by largest remainder, ties to the first block.
+
+    Parameters
+    ----------
+    allocated: numpy.ndarray
+        Fractional count of each block, sorted by block group.
+    totals: numpy.ndarray
+        Whole count of each block group.
+    firsts: numpy.ndarray
+        First block of each block group.
+
+    Returns
+    -------
+    numpy.ndarray
+        Whole count of each block.
+
+    """
+    sizes = np.diff(np.r_[firsts, len(allocated)])
+    group = np.repeat(np.arange(len(firsts)), sizes)
+    floors = np.floor(allocated + 1e-9)
+    left = totals - (np.add.reduceat(floors, firsts) if len(firsts) else 0)
+
+    # Rank remainders within each block group, largest first, in one
+    # sort on the group plus a fraction falling as remainders grow
+    order = np.argsort(group + 0.5 * (1 - (allocated - floors)),
+                       kind="stable")
+    ranks = np.empty(len(allocated), dtype=np.int64)
+    ranks[order] = np.arange(len(allocated)) - firsts[group[order]]
+    return floors + (ranks < left[group])
+
+def disaggregate_to_blocks(race_cvap_bgs: pd.DataFrame, \
+                           block_weights: pd.DataFrame, \
+                           block_column: str = "", \
+                           weight_column: str = "", \
+                           integer: bool = False) -> pd.DataFrame:
+    """
+    Allocates every count of block groups to their blocks in proportion
+    to a block weight.
+
+    Parameters
+    ----------
+    race_cvap_bgs: pandas.DataFrame
+        Block groups with counts, sorted by GEOID_KEY, e.g. from
+        make_race_cvap_gdf. Geometry, if any, is left behind.
+    block_weights: pandas.DataFrame
+        Fifteen-digit GEOID and weight of each 2010 block, e.g. from
+        tabblock2010_15_pophu.
+    block_column: str
+        Column of block GEOIDs. Defaults to BLOCK_GEOID_COLUMN in
+        settings.
+    weight_column: str
+        Column of block weights. Defaults to BLOCK_WEIGHT_COLUMN in
+        settings. Missing weights weigh nothing.
+    integer: bool
+        Flag as to whether to round counts to whole numbers adding up to
+        those of each block group. Default of fractional counts.
+
+    Returns
+    -------
+    pandas.DataFrame
+        GEOID, GEOID_KEY and weight of each block with its share of
+        every count, sorted by GEOID_KEY. Counts are floats, or UInt32
+        with integer=True, and missing where a block group's are.
+
+    Raises
+    ------
+    ValueError
+        If block GEOIDs aren't fifteen digits, weights are negative or
+        block groups are not sorted.
+
+    """
+    block_column = block_column if block_column else SET.BLOCK_GEOID_COLUMN
+    weight_column = weight_column if weight_column else \
+                    SET.BLOCK_WEIGHT_COLUMN
+
+    block_keys = parse_geoid_keys(block_weights[block_column].astype(str),
+                                  digits=BLOCK_DIGITS)
+    weights = pd.to_numeric(block_weights[weight_column]).to_numpy(
+        dtype=float, na_value=0.0)
+    if (weights < 0).any():
+        raise ValueError(f"Block weights in {weight_column} must not " + \
+                         "be negative.")
+    order = np.argsort(block_keys, kind="stable")
+    block_keys, weights = block_keys[order], weights[order]
+    bg_of_blocks = block_keys // BLOCKS_PER_KEY
+
+    bg_keys = race_cvap_bgs["GEOID_KEY"].to_numpy()
+    check_sorted_keys(bg_keys, "block groups")
+    rows = np.searchsorted(bg_keys, bg_of_blocks).clip(0, max(len(bg_keys) - 1,
+                                                              0))
+    found = (bg_keys[rows] == bg_of_blocks) if len(bg_keys) else \
+            np.zeros(len(block_keys), dtype=bool)
+
+    shares, firsts, weightless = block_shares(bg_of_blocks, weights)
+    counts = [col for col in race_cvap_bgs.columns if col in COUNT_COLUMNS]
+    blocks = pd.DataFrame({
+        "GEOID": geoid_keys_to_strings(block_keys, BLOCK_DIGITS),
+        "GEOID_KEY": block_keys,
+        weight_column: weights,
+    })
+    for col in counts:
+        bg_counts = race_cvap_bgs[col].to_numpy(dtype=float, na_value=np.nan)
+        block_counts = np.where(found, bg_counts[rows], np.nan)
+        allocated = block_counts * shares
+        if integer:
+            missing = np.isnan(allocated)
+            allocated = round_within_groups(
+                np.nan_to_num(allocated), np.nan_to_num(block_counts[firsts]),
+                firsts)
+            allocated = pd.array(allocated, dtype="Float64")
+            allocated[missing] = pd.NA
+        blocks[col] = allocated
+
+    blocks = conform_to_schema(blocks) if integer else \
+             blocks.assign(GEOID=blocks["GEOID"].astype(GEOID_DTYPE))
+
+    # What could not be carried down, rather than silently dropped
+    lost = bg_keys[~np.isin(bg_keys, bg_of_blocks)]
+    orphans = block_keys[~found]
+    report = {
+        "block_groups_without_blocks": {
+            "count": int(len(lost)),
+            "geoids": geoid_keys_to_strings(lost).tolist()},
+        "blocks_without_block_group": {
+            "count": int(len(orphans)),
+            "geoids": geoid_keys_to_strings(orphans, BLOCK_DIGITS).tolist()},
+        "weightless_block_groups": {
+            "count": int(weightless.sum()),
+            "geoids": geoid_keys_to_strings(
+                bg_of_blocks[firsts][weightless]).tolist()},
+    }
+    if len(lost) or len(orphans):
+        warnings.warn(f"{len(lost)} block groups without blocks and " + \
+                      f"{len(orphans)} blocks without block group.")
+    blocks.attrs["disaggregation_report"] = report
+    return blocks
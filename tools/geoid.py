@@ -0,0 +1,315 @@
+"""
+Every source names its Block Groups by GEOID, but each spells it a
+little differently. CVAP and NHGIS prefix it with "15000US", the Census
+API with "1500000US" and TIGER not at all. This module parses all of
+them into plain int64 keys, once, as data is read in, and joins sources
+on those keys.
+
+Examples
+--------
+This module has five functions that can be used separately.
+
+    First, parse_geoid_keys turns a column of GEOID strings into int64
+    keys, skipping the geographic level prefix, without touching one
+    row at a time in Python.
+
+    keys = parse_geoid_keys(cvap_bgs["geoid"], prefix_length=7)
+
+    Second, attach_geoid_keys does this for a whole frame. It gives the
+    frame a short GEOID and GEOID_KEY column and sorts it by key, which
+    is how every getter hands its data over.
+
+    cvap_bgs = attach_geoid_keys(cvap_bgs, "geoid", prefix_length=7)
+
+    Third, state_key_range returns the range of keys belonging to a
+    state, or a county within it, and slice_key_range cuts that range
+    out of a key-sorted frame.
+
+    low, high = state_key_range("15", "007")
+    maui_bgs = slice_key_range(hi_cvap_bgs, low, high)
+
+    Fourth, sorted_merge joins any number of key-sorted frames in one
+    pass and reports the keys found on one side but not the other,
+    rather than silently dropping them.
+
+    merged = sorted_merge(tiger_bgs, [cvap_bgs, race_bgs], how="left")
+    merged.attrs["join_report"]
+
+Notes
+-----
+A Block Group GEOID is twelve digits,
+
+    15 007 040301 1
+    |--|---|------|-|
+    (1)(2)  (3)  (4)
+
+(1) State FIPS, (2) County FIPS, (3) Census Tract and (4) Block Group,
+which fits easily in an int64. Sorting by key sorts by state, county and
+tract all at once, so any state or county is one contiguous run of keys.
+
+Leading zeros are lost in the integer and must be padded back on when
+GEOIDs are written out, e.g. Alabama's 010010201001.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+# Block Group GEOIDs are STATE(2) + COUNTY(3) + TRACT(6) + BLKGRP(1)
+GEOID_DIGITS = 12
+
+# Place value of each of the twelve digits, most significant first
+DIGIT_VALUES = 10 ** np.arange(GEOID_DIGITS - 1, -1, -1, dtype=np.int64)
+
+def digit_values(digits: int) -> np.ndarray:
+    """
+    Returns the place value of each of so many digits, most significant
+    first.
+    """
+    if digits == GEOID_DIGITS:
+        return DIGIT_VALUES
+    return 10 ** np.arange(digits - 1, -1, -1, dtype=np.int64)
+
+def parse_geoid_keys(geoids: pd.Series, prefix_length: int = 0,
+                     digits: int = GEOID_DIGITS) -> np.ndarray:
+    """
+    Parses GEOID strings into int64 keys.
+
+    Strings are laid out as a fixed-width byte matrix so that the digits
+    after the prefix are read all at once by numpy.
+
+    Parameters
+    ----------
+    geoids: pandas.Series
+        Series of GEOID strings, e.g. "15000US150070403011".
+    prefix_length: int
+        Number of characters before the twelve GEOID digits, e.g. 7 for
+        "15000US" or 9 for "1500000US". Default of no prefix.
+    digits: int
+        Number of GEOID digits, e.g. 15 for blocks. Default of twelve,
+        for block groups.
+
+    Returns
+    -------
+    numpy.ndarray
+        int64 keys, one for each GEOID, e.g. 150070403011.
+
+    Raises
+    ------
+    ValueError
+        If any GEOID is too short, too long or holds anything but
+        digits.
+
+    """
+    width = prefix_length + digits
+    # One byte wider than a GEOID, so that longer ones are not cut short
+    # unnoticed, while shorter ones end in zero bytes among the digits
+    raw = np.asarray(geoids, dtype=f"S{width + 1}")
+    matrix = raw.view(np.uint8).reshape(len(raw), width + 1)
+    values = matrix[:, prefix_length:width].astype(np.int64) - ord("0")
+    if matrix[:, width].any() or ((values < 0) | (values > 9)).any():
+        raise ValueError(f"GEOIDs must carry {digits} digits " + \
+                         f"after a prefix of {prefix_length} characters.")
+    return values @ digit_values(digits)
+
+def geoid_keys_to_strings(keys: np.ndarray,
+                          digits: int = GEOID_DIGITS) -> np.ndarray:
+    """
+    Turns int64 keys back into twelve-character GEOID strings, padding
+    leading zeros, by writing out each digit at once with numpy.
+
+    Parameters
+    ----------
+    keys: numpy.ndarray
+        int64 keys as returned by parse_geoid_keys.
+    digits: int
+        Number of GEOID digits. Default of twelve, for block groups.
+
+    Returns
+    -------
+    numpy.ndarray
+        GEOID strings, e.g. "010010201001".
+
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    values = (keys[:, None] // digit_values(digits) % 10 + ord("0"))
+    return (np.ascontiguousarray(values.astype(np.uint8))
+            .view(f"S{digits}").ravel().astype(f"U{digits}"))
+
+def attach_geoid_keys(frame: pd.DataFrame, column: str = "GEOID",
+                      prefix_length: int = 0) -> pd.DataFrame:
+    """
+    Gives a frame its short GEOID and int64 GEOID_KEY and sorts it by
+    key. Getters call this once as data is read in.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        DataFrame carrying a column of GEOID strings.
+    column: str
+        Name of the column of GEOID strings, which is replaced by GEOID.
+    prefix_length: int
+        Number of characters before the twelve GEOID digits.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Frame sorted by GEOID_KEY with GEOID and GEOID_KEY columns.
+
+    """
+    keys = parse_geoid_keys(frame[column], prefix_length)
+    frame = frame.drop(columns=column)
+    frame.insert(0, "GEOID_KEY", keys)
+    frame.insert(0, "GEOID", geoid_keys_to_strings(keys))
+    return frame.sort_values("GEOID_KEY", kind="stable").reset_index(drop=True)
+
+def state_key_range(state_fips: str, county_fips: str = "") -> tuple:
+    """
+    Returns the range of GEOID keys that belong to a state, or a county
+    within it, as a half-open interval.
+
+    Parameters
+    ----------
+    state_fips: str
+        Two-digit state FIPS code, e.g. "15".
+    county_fips: str
+        Optional three-digit county FIPS code, e.g. "007".
+
+    Returns
+    -------
+    tuple of int
+        Low and high keys, low inclusive and high exclusive.
+
+    """
+    prefix = f"{state_fips}{county_fips}"
+    scale = 10 ** (GEOID_DIGITS - len(prefix))
+    return int(prefix) * scale, (int(prefix) + 1) * scale
+
+def slice_key_range(frame: pd.DataFrame, low: int, high: int) -> pd.DataFrame:
+    """
+    Returns the rows of a key-sorted frame with keys from low up to, but
+    not including, high, found by binary search rather than a scan.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        DataFrame sorted by GEOID_KEY.
+    low: int
+        Lowest key to include.
+    high: int
+        Key to stop before, e.g. as returned by state_key_range.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Contiguous slice of frame.
+
+    """
+    start, stop = np.searchsorted(frame["GEOID_KEY"].to_numpy(), [low, high])
+    return frame.iloc[start:stop].reset_index(drop=True)
+
+def check_sorted_keys(keys: np.ndarray, name: str = ""):
+    """
+    Checks that keys are strictly increasing, i.e. sorted and unique.
+
+    Raises
+    ------
+    ValueError
+        If keys are out of order or repeated.
+
+    """
+    if len(keys) > 1 and not (np.diff(keys) > 0).all():
+        raise ValueError(f"GEOID keys of {name} data must be sorted " + \
+                         "and unique.")
+
+def sorted_merge(base: pd.DataFrame, others: list, how: str = "inner",
+                 names: list = None) -> pd.DataFrame:
+    """
+    Joins key-sorted frames onto a key-sorted base frame in one pass.
+
+    Each other frame is aligned against the base with a binary search
+    over its sorted keys, rather than by building a hash table. A row
+    of the base is matched only if its key is found in every other
+    frame, i.e. the others are inner-joined with each other.
+
+    The keys found in one frame but not joined are counted and listed in
+    merged.attrs["join_report"] and a warning is raised, rather than
+    being silently dropped.
+
+    Parameters
+    ----------
+    base: pandas.DataFrame
+        DataFrame sorted by unique GEOID_KEY, e.g. TIGER block groups.
+    others: list of pandas.DataFrame
+        DataFrames sorted by unique GEOID_KEY whose columns are added.
+    how: str
+        "inner" to keep only matched rows of base or "left" to keep all
+        rows of base with <NA> where unmatched.
+    names: list of str
+        Names for base and each of the others, used in the report.
+        Defaults to "base", "other_1", "other_2"...
+
+    Returns
+    -------
+    pandas.DataFrame
+        Base frame with columns of the others added, still sorted.
+
+    Raises
+    ------
+    ValueError
+        If how is unknown or any keys are unsorted or repeated.
+
+    """
+    if how not in ("inner", "left"):
+        raise ValueError(f"Join must be inner or left, not {how}.")
+    if not names:
+        names = ["base"] + [f"other_{i + 1}" for i in range(len(others))]
+
+    base_keys = base["GEOID_KEY"].to_numpy()
+    check_sorted_keys(base_keys, names[0])
+
+    # One pass over each frame, aligned on the base.
+    positions = []
+    matched = np.ones(len(base_keys), dtype=bool)
+    for name, other in zip(names[1:], others):
+        other_keys = other["GEOID_KEY"].to_numpy()
+        check_sorted_keys(other_keys, name)
+        position = np.searchsorted(other_keys, base_keys)
+        position = np.minimum(position, max(len(other_keys) - 1, 0))
+        found = (other_keys[position] == base_keys if len(other_keys)
+                 else np.zeros(len(base_keys), dtype=bool))
+        positions.append(position)
+        matched &= found
+
+    # Which keys went unjoined on each side
+    joined_keys = base_keys[matched]
+    report = {names[0]: _unmatched(base_keys, joined_keys)}
+    for name, other in zip(names[1:], others):
+        report[name] = _unmatched(other["GEOID_KEY"].to_numpy(), joined_keys)
+    unmatched = {name: side["count"] for name, side in report.items()
+                 if side["count"]}
+    if unmatched:
+        warnings.warn(f"Unmatched GEOIDs in join: {unmatched}")
+
+    # Gather columns from the others by position
+    keep = matched if how == "inner" else np.ones(len(base_keys), dtype=bool)
+    merged = base[keep].reset_index(drop=True)
+    mask = pd.Series(matched[keep])
+    for other, position in zip(others, positions):
+        for col in other.columns:
+            if col in ("GEOID", "GEOID_KEY") or col in merged.columns:
+                continue
+            values = other[col].iloc[position[keep]].reset_index(drop=True)
+            merged[col] = values if mask.all() else values.where(mask)
+
+    merged.attrs["join_report"] = report
+    return merged
+
+def _unmatched(keys: np.ndarray, joined_keys: np.ndarray) -> dict:
+    """
+    Counts and lists GEOIDs among keys that are not among joined keys.
+    """
+    missing = keys[~np.isin(keys, joined_keys, assume_unique=True)]
+    return {"count": int(len(missing)),
+            "geoids": geoid_keys_to_strings(missing).tolist()}
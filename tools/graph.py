@@ -0,0 +1,263 @@
+"""
+Ensemble analysis with GerryChain starts from the dual graph of a state,
+with a node for each block group and an edge between each pair of
+neighbors. This module builds that graph from the geometry using a
+spatial index, caches it by a hash of that geometry, and writes it as
+JSON that GerryChain reads directly.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, get_adjacency returns the neighbors of every block group and
+    the length of boundary they share, from cache if the very same
+    geometry was seen before.
+
+    hi_adjacency = get_adjacency(hi_gdf, "rook")
+
+    Second, write_graph_json writes the graph with every column of
+    demographic data as node attributes.
+
+    write_graph_json(hi_gdf, "hi_cvap_acs.json", "rook")
+
+    census_adder.make_race_cvap_graph does so for a whole state, e.g.
+
+    make_race_cvap_graph("HI")
+
+    which GerryChain reads with
+
+    graph = gerrychain.Graph.from_json("HI_cvap_acs.json")
+
+Notes
+-----
+Two kinds of adjacency are offered, as in GerryChain.
+
+rook
+    Neighbors share a stretch of boundary of some length.
+queen
+    Neighbors touch at all, even at a single corner.
+
+Candidate pairs come from a shapely STRtree, so only block groups whose
+bounds meet are ever compared, rather than every pair in the state.
+Shared boundaries are then measured for all pairs at once.
+
+Lengths and areas are measured in meters. Geometry in degrees, such as
+TIGER's NAD83, is first projected to its local UTM zone. As in
+GerryChain, each edge carries its "shared_perim", and each node its
+"area", its "boundary_perim" along the outside of the state and whether
+it is a "boundary_node".
+
+Adjacency is cached in GRAPH_FOLDER, set in settings, under the SHA-256
+of the geometry's WKB. A new vintage of TIGER files has a new hash, and
+so gets a graph of its own, built once.
+"""
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from schema import to_output_dtypes
+except: from tools.schema import to_output_dtypes
+
+
+ADJACENCY_TYPES = ("rook", "queen")
+
+def geometry_hash(gdf) -> str:
+    """
+    Returns the SHA-256 hex digest of a GeoDataFrame's geometry, in
+    order, and its CRS.
+    """
+    digest = hashlib.sha256(str(gdf.crs).encode())
+    for wkb in shapely.to_wkb(gdf.geometry.to_numpy()):
+        digest.update(wkb)
+    return digest.hexdigest()
+
+def measure_adjacency(gdf, adjacency: str = "rook") -> dict:
+    """
+    Finds the neighbors of every polygon with a spatial index and
+    measures their shared boundaries.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        GeoDataFrame of Polygons and MultiPolygons, e.g. Block Groups.
+    adjacency: str
+        "rook" or "queen".
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        "left" and "right", the positions of each pair of neighbors with
+        left before right, their "shared_perim", and for each polygon
+        its "area" and "boundary_perim".
+
+    """
+    if adjacency not in ADJACENCY_TYPES:
+        raise ValueError(f"Adjacency must be one of {ADJACENCY_TYPES}, " + \
+                         f"not {adjacency}.")
+
+    geometry = gdf.geometry
+    if geometry.crs is not None and geometry.crs.is_geographic:
+        geometry = geometry.to_crs(geometry.estimate_utm_crs())
+    geoms = geometry.to_numpy()
+
+    # Only pairs whose bounds meet are tested, each pair once
+    tree = shapely.STRtree(geoms)
+    left, right = tree.query(geoms, predicate="intersects")
+    once = left < right
+    left, right = left[once], right[once]
+
+    boundaries = shapely.boundary(geoms)
+    shared_perim = shapely.length(
+        shapely.intersection(boundaries[left], boundaries[right]))
+    if adjacency == "rook":
+        shares_edge = shared_perim > 0
+        left, right = left[shares_edge], right[shares_edge]
+        shared_perim = shared_perim[shares_edge]
+
+    # What is not shared with a neighbor lies along the outside
+    perimeter = shapely.length(geoms)
+    shared_total = (np.bincount(left, shared_perim, len(geoms)) +
+                    np.bincount(right, shared_perim, len(geoms)))
+    boundary_perim = perimeter - shared_total
+    boundary_perim[boundary_perim <= perimeter * 1e-9] = 0
+
+    return {
+        "left": left,
+        "right": right,
+        "shared_perim": shared_perim,
+        "area": shapely.area(geoms),
+        "boundary_perim": boundary_perim,
+    }
+
+def get_adjacency(gdf, adjacency: str = "rook",
+                  cache_folder: str = None) -> dict:
+    """
+    Returns the neighbors of every polygon and their shared boundaries,
+    reading them from cache if the same geometry was measured before.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        GeoDataFrame of Polygons and MultiPolygons, e.g. Block Groups.
+    adjacency: str
+        "rook" or "queen".
+    cache_folder: str
+        Folder of cached adjacency. Defaults to GRAPH_FOLDER in
+        settings.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        See measure_adjacency.
+
+    """
+    if cache_folder is None:
+        cache_folder = SET.GRAPH_FOLDER
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+    filename = os.path.join(cache_folder,
+                            f"{adjacency}_{geometry_hash(gdf)}.npz")
+
+    if os.path.isfile(filename):
+        with np.load(filename) as cached:
+            return {name: cached[name] for name in cached.files}
+
+    measured = measure_adjacency(gdf, adjacency)
+
+    # Write whole then move into place, as other runs may be reading
+    tmp_file = f"{filename}.tmp{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_file, "wb") as cache_file:
+        np.savez(cache_file, **measured)
+    os.replace(tmp_file, filename)
+    return measured
+
+def make_graph_data(gdf, adjacency: str = "rook",
+                    cache_folder: str = None) -> dict:
+    """
+    Returns the dual graph of a GeoDataFrame in the JSON adjacency
+    format of networkx, which GerryChain reads with Graph.from_json.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        GeoDataFrame of Polygons and MultiPolygons, e.g. Block Groups.
+    adjacency: str
+        "rook" or "queen".
+    cache_folder: str
+        Folder of cached adjacency. Defaults to GRAPH_FOLDER in
+        settings.
+
+    Returns
+    -------
+    dict
+        Graph with a node for each row, numbered by position, holding
+        its data, and a "shared_perim" on each edge.
+
+    """
+    measured = get_adjacency(gdf, adjacency, cache_folder)
+
+    data = to_output_dtypes(gdf.drop(columns=gdf.geometry.name))
+    data = data.assign(
+        boundary_node=measured["boundary_perim"] > 0,
+        boundary_perim=measured["boundary_perim"],
+        area=measured["area"],
+    )
+    nodes = data.astype(object).where(data.notna(), None).to_dict("records")
+    for node_id, node in enumerate(nodes):
+        node["id"] = node_id
+
+    # Every edge is listed under both of its ends
+    edges = pd.DataFrame({
+        "node": np.concatenate([measured["left"], measured["right"]]),
+        "id": np.concatenate([measured["right"], measured["left"]]),
+        "shared_perim": np.tile(measured["shared_perim"], 2),
+    }).sort_values(["node", "id"])
+    neighbors = [[] for _ in nodes]
+    for node_id, group in edges.groupby("node"):
+        neighbors[node_id] = group[["shared_perim", "id"]].to_dict("records")
+
+    return {
+        "directed": False,
+        "multigraph": False,
+        "graph": [],
+        "nodes": nodes,
+        "adjacency": neighbors,
+    }
+
+def write_graph_json(gdf, output: str, adjacency: str = "rook",
+                     cache_folder: str = None) -> str:
+    """
+    Writes the dual graph of a GeoDataFrame as GerryChain-compatible
+    JSON.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        GeoDataFrame of Polygons and MultiPolygons, e.g. Block Groups.
+    output: str
+        Filename for the JSON graph.
+    adjacency: str
+        "rook" or "queen".
+    cache_folder: str
+        Folder of cached adjacency. Defaults to GRAPH_FOLDER in
+        settings.
+
+    Returns
+    -------
+    str
+        Filename of the JSON graph.
+
+    """
+    graph_data = make_graph_data(gdf, adjacency, cache_folder)
+    with open(output, "w") as graph_file:
+        json.dump(graph_data, graph_file)
+    return output
@@ -0,0 +1,216 @@
+"""
+Both the CVAP and NHGIS data come as one csv for the whole nation, from
+which we only ever want the rows of one state. This module reads those
+rows, either all at once with polars or, on smaller machines, in chunks
+that fit under a memory ceiling.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, read_state_rows returns the rows of a national csv whose long
+    GEOID starts with a given prefix, e.g. Hawaii's "15000US15", as a
+    pandas DataFrame.
+
+    hi_rows = read_state_rows(SET.LOCAL_NHGIS_CSV, "GEOID", "15000US15")
+
+    Second, iter_state_chunks streams the same rows chunk by chunk, so
+    that a getter can aggregate each chunk and throw it away before the
+    next is read.
+
+    for chunk in iter_state_chunks(SET.LOCAL_CVAP_CSV, "geoid",
+                                   "15000US15", memory_ceiling_mb=256):
+        ...
+
+Notes
+-----
+Each getter decides on its own how to keep only per-state aggregates
+of its chunks, but must return the very same DataFrame in either mode.
+
+The low memory mode and ceiling are set in the settings with LOW_MEMORY
+and MEMORY_CEILING_MB, and can be overridden in each call.
+
+With CSV_INDEX set, read_state_rows instead parses only the state's own
+rows, found through a byte-range index of the csv. See csv_index.py.
+Building the index scans the whole csv without regard to the memory
+ceiling, so low memory mode takes precedence and never uses the index.
+
+Both take geoid_prefixes, short GEOID prefixes within the state, e.g.
+"15009" for a county, to keep only the rows of a selection. Through the
+index, only the byte ranges of the selected counties are parsed. See
+selection.py.
+
+Chunk sizes are guessed from the average length of the first lines of
+the csv. A parsed pandas row takes several times its length in raw
+bytes, once strings become Python objects, which PARSE_EXPANSION
+accounts for.
+"""
+import pandas as pd
+import polars as pl # Polars reads csv's faster than pandas!
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from csv_index import read_indexed_rows
+except: from tools.csv_index import read_indexed_rows
+
+
+# Memory of a parsed pandas row over its raw length in the csv
+PARSE_EXPANSION = 8
+
+# Bytes read from the top of a csv to guess the average line length
+SAMPLE_BYTES = 2 ** 20
+
+# No chunk is made smaller than this, however low the ceiling
+MIN_CHUNK_ROWS = 1000
+
+def rows_per_chunk(csv_path: str, memory_ceiling_mb: int = None) -> int:
+    """
+    Returns how many rows of a csv fit in a chunk under the memory
+    ceiling.
+
+    Parameters
+    ----------
+    csv_path: str
+        Filepath of csv.
+    memory_ceiling_mb: int
+        Memory in megabytes any one chunk may take. Defaults to
+        MEMORY_CEILING_MB in settings.
+
+    Returns
+    -------
+    int
+        Number of rows per chunk.
+
+    """
+    if memory_ceiling_mb is None:
+        memory_ceiling_mb = SET.MEMORY_CEILING_MB
+    with open(csv_path, "rb") as csv_file:
+        sample = csv_file.read(SAMPLE_BYTES)
+    line_bytes = len(sample) / max(sample.count(b"\n"), 1)
+    chunk_rows = (memory_ceiling_mb * 2 ** 20) / (line_bytes * PARSE_EXPANSION)
+    return max(int(chunk_rows), MIN_CHUNK_ROWS)
+
+def iter_state_chunks(csv_path: str, geoid_column: str, geoid_prefix: str,
+                      columns: list = None, memory_ceiling_mb: int = None,
+                      sep: str = ",", geoid_prefixes: list = None):
+    """
+    Yields the rows of a national csv whose long GEOID starts with
+    geoid_prefix, one chunk at a time.
+
+    Parameters
+    ----------
+    csv_path: str
+        Filepath of national csv.
+    geoid_column: str
+        Name of column of long GEOIDs, e.g. "geoid".
+    geoid_prefix: str
+        Start of the long GEOIDs of the target state, e.g. "15000US15".
+    columns: list of str
+        Columns to read. Defaults to all columns.
+    memory_ceiling_mb: int
+        Memory in megabytes any one chunk may take. Defaults to
+        MEMORY_CEILING_MB in settings.
+    sep: str
+        Delimiter of the csv, e.g. "|" for ACS Summary Files.
+    geoid_prefixes: list of str
+        Short GEOID prefixes within the state to keep, e.g. "15009".
+        Defaults to the whole state.
+
+    Yields
+    ------
+    pandas.DataFrame
+        Rows of the target state found in the next chunk, which may be
+        empty.
+
+    """
+    chunk_rows = rows_per_chunk(csv_path, memory_ceiling_mb)
+    reader = pd.read_csv(csv_path, sep=sep, usecols=columns,
+                         chunksize=chunk_rows, dtype={geoid_column: str})
+    starts = long_prefixes(geoid_prefix, geoid_prefixes)
+    with reader:
+        for chunk in reader:
+            in_state = chunk[geoid_column].str.startswith(starts)
+            yield chunk[in_state.fillna(False)]
+
+def long_prefixes(geoid_prefix: str, geoid_prefixes: list = None) -> tuple:
+    """
+    Returns the starts of the long GEOIDs to keep, e.g. ("15000US15009",)
+    for the prefix "15000US15" and short prefixes ["15009"].
+    """
+    if geoid_prefixes is None:
+        return (geoid_prefix,)
+    return tuple(geoid_prefix[:-2] + prefix for prefix in geoid_prefixes)
+
+def read_state_rows(csv_path: str, geoid_column: str, geoid_prefix: str,
+                    columns: list = None, low_memory: bool = None,
+                    memory_ceiling_mb: int = None,
+                    use_index: bool = None,
+                    geoid_prefixes: list = None) -> pd.DataFrame:
+    """
+    Returns the rows of a national csv whose long GEOID starts with
+    geoid_prefix as a pandas DataFrame.
+
+    Parameters
+    ----------
+    csv_path: str
+        Filepath of national csv.
+    geoid_column: str
+        Name of column of long GEOIDs, e.g. "GEOID".
+    geoid_prefix: str
+        Start of the long GEOIDs of the target state, e.g. "15000US15".
+    columns: list of str
+        Columns to keep, in this order. Defaults to all columns.
+    low_memory: bool
+        Flag as to whether to read the csv in chunks under the memory
+        ceiling. Defaults to LOW_MEMORY in settings.
+    memory_ceiling_mb: int
+        Memory in megabytes any one chunk may take. Defaults to
+        MEMORY_CEILING_MB in settings.
+    use_index: bool
+        Flag as to whether to parse only the state's rows, found through
+        a byte-range index of the csv, built on first use. Defaults to
+        CSV_INDEX in settings. Ignored in low memory mode.
+    geoid_prefixes: list of str
+        Short GEOID prefixes within the state to keep, e.g. "15009".
+        Defaults to the whole state.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Rows of the target state, or of its selected prefixes.
+
+    """
+    if low_memory is None:
+        low_memory = SET.LOW_MEMORY
+    if use_index is None:
+        use_index = SET.CSV_INDEX
+    if geoid_prefixes == []:
+        # Nothing selected, so only the header is read
+        return pd.read_csv(csv_path, usecols=columns, nrows=0,
+                           dtype={geoid_column: str})
+    if low_memory:
+        # Before the index, as building it scans the csv unbounded
+        chunks = iter_state_chunks(csv_path, geoid_column, geoid_prefix,
+                                   columns, memory_ceiling_mb,
+                                   geoid_prefixes=geoid_prefixes)
+        state_rows = pd.concat(chunks, ignore_index=True)
+        return state_rows[columns] if columns else state_rows
+    if use_index:
+        # The prefix ends in the two digits of the State FIPS
+        state_rows = read_indexed_rows(csv_path, geoid_column,
+                                       geoid_prefix[:-2], geoid_prefix[-2:],
+                                       columns, geoid_prefixes)
+        return state_rows[columns] if columns else state_rows
+
+    pattern = "^(" + "|".join(long_prefixes(geoid_prefix, geoid_prefixes)) \
+              + ")"
+    state_scan = (
+        pl.scan_csv(csv_path)
+        .filter(pl.col(geoid_column).str.contains(pattern))
+    )
+    if columns:
+        # Pushed down into the scan, so other columns are never parsed
+        state_scan = state_scan.select(columns)
+    return state_scan.collect().to_pandas()
@@ -0,0 +1,243 @@
+"""
+Building states in parallel with a fixed number of workers runs out of
+memory as soon as California, Texas and Florida land together, while a
+fixed number small enough for those leaves the machine idle on the rest.
+This module estimates the peak memory of each state before it is built
+and admits states to a pool of workers against a memory budget instead.
+
+Examples
+--------
+This module has three functions that can be used separately.
+
+    First, state_features measures what a state's peak memory depends
+    on, without reading its data.
+
+    hi_features = state_features("HI")
+
+    Second, fit_memory_model calibrates a linear model of peak memory
+    on those features from the peaks measured in earlier batch runs,
+    and estimate_peak_mb applies it.
+
+    model = fit_memory_model(batch.load_journal(SET.BATCH_JOURNAL))
+    estimate_peak_mb(hi_features, model)
+
+    Third, run_within_budget runs jobs in worker processes, starting
+    each only once its estimate fits in the memory left.
+
+    batch.run_batch(memory_budget_mb=48000) does all of this.
+
+Notes
+-----
+A state's features are
+
+block_groups
+    Number of block groups, from the header of the TIGER .dbf.
+shp_mb
+    Megabytes of the TIGER .shp and .dbf.
+csv_mb
+    Megabytes of the state's rows in national csv's, from their byte
+    range index. See csv_index.py.
+
+and its estimated peak is intercept + sum(coefficient * feature), in
+megabytes, times MEMORY_SAFETY from the settings. Until the journal
+holds enough measured states, MEMORY_MODEL from the settings is used.
+
+Each state is built in a fresh worker process, so the peak resident
+memory of the process once done is the peak of that state alone. It is
+recorded in the journal with the features, to calibrate the next run.
+
+At least one job always runs, even one estimated above the whole
+budget, so that no state waits forever.
+"""
+import os
+import sys
+import resource
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import us
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from tiger import check_download_tiger_file
+except: from tools.tiger import check_download_tiger_file
+
+try: from shards import dbf_record_count
+except: from tools.shards import dbf_record_count
+
+try: from csv_index import get_csv_index
+except: from tools.csv_index import get_csv_index
+
+
+FEATURES = ["block_groups", "shp_mb", "csv_mb"]
+
+MB = 2 ** 20
+
+def state_features(state_abbr: str, download_allowed: bool = False) -> dict:
+    """
+    Measures the features of a state that its peak memory depends on.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    download_allowed : bool
+        Flag as to whether to download missing TIGER files or raise
+        error.
+
+    Returns
+    -------
+    dict
+        Value of each of FEATURES.
+
+    """
+    tiger_file = check_download_tiger_file(state_abbr, download_allowed)
+    shp_bytes = sum(os.path.getsize(os.path.splitext(tiger_file)[0] + ext)
+                    for ext in (".shp", ".dbf"))
+
+    # Only the state's own rows of national csv's are ever parsed
+    state_fips = us.states.lookup(state_abbr).fips
+    csv_paths = [SET.LOCAL_CVAP_CSV]
+    if SET.ACS_PLUGIN == "NHGIS":
+        csv_paths.append(SET.LOCAL_NHGIS_CSV)
+    csv_bytes = 0
+    for csv_path in csv_paths:
+        if os.path.isfile(csv_path):
+            ranges = get_csv_index(csv_path, "15000US")["states"]
+            csv_bytes += sum(end - start
+                             for start, end in ranges.get(state_fips, []))
+
+    return {
+        "block_groups": dbf_record_count(tiger_file),
+        "shp_mb": shp_bytes / MB,
+        "csv_mb": csv_bytes / MB,
+    }
+
+def fit_memory_model(journal: dict) -> dict:
+    """
+    Fits peak memory as a linear function of the features of the states
+    measured in a batch journal, by least squares.
+
+    Parameters
+    ----------
+    journal: dict
+        Batch journal, see batch.py, whose entries may hold "features"
+        and "peak_mb". Only states whose status is "done" are fit.
+
+    Returns
+    -------
+    dict
+        "intercept" and coefficient of each of FEATURES, in megabytes.
+        MEMORY_MODEL from the settings if too few states were measured.
+
+    """
+    # States that failed part way never reached their real peak
+    measured = [entry for entry in journal.get("states", {}).values()
+                if entry.get("status") == "done" and entry.get("peak_mb")
+                and entry.get("features")]
+    if len(measured) < SET.MEMORY_MIN_SAMPLES:
+        return dict(SET.MEMORY_MODEL)
+
+    features = np.array([[1.0] + [entry["features"][name]
+                                  for name in FEATURES]
+                         for entry in measured])
+    peaks = np.array([entry["peak_mb"] for entry in measured])
+    coefficients = np.linalg.lstsq(features, peaks, rcond=None)[0]
+
+    # Memory never shrinks as states grow
+    coefficients = np.clip(coefficients, 0, None)
+    return dict(zip(["intercept"] + FEATURES, coefficients.tolist()))
+
+def estimate_peak_mb(features: dict, model: dict) -> float:
+    """
+    Returns the estimated peak memory of a state in megabytes, with the
+    MEMORY_SAFETY margin from the settings.
+    """
+    peak = model["intercept"] + sum(model[name] * features[name]
+                                    for name in FEATURES)
+    return peak * SET.MEMORY_SAFETY
+
+def default_budget_mb() -> float:
+    """
+    Returns MEMORY_BUDGET_MB from the settings or, if unset, 80% of the
+    machine's physical memory, in megabytes.
+    """
+    if SET.MEMORY_BUDGET_MB:
+        return SET.MEMORY_BUDGET_MB
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return 0.8 * physical / MB
+
+def peak_rss_mb() -> float:
+    """
+    Returns the peak resident memory of this process in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / MB if sys.platform == "darwin" else peak / 1024
+
+def run_within_budget(jobs: list, budget_mb: float = None, \
+                      max_workers: int = None, on_start = None):
+    """
+    Runs jobs in fresh worker processes, starting each only once its
+    estimated peak memory fits within what is left of the budget.
+
+    Parameters
+    ----------
+    jobs: list of tuple
+        Name, estimated peak in megabytes, function and tuple of its
+        arguments of each job, started in order.
+    budget_mb: float
+        Memory in megabytes all running jobs may take together.
+        Defaults to default_budget_mb.
+    max_workers: int
+        Most jobs run at once, however small. Defaults to the number of
+        CPUs.
+    on_start: function
+        Called with the name of each job as it is started, e.g. to
+        record when. Default of none.
+
+    Yields
+    ------
+    tuple
+        Name of each finished job, its result and its error, one of
+        which is None, in order of finishing.
+
+    """
+    budget_mb = budget_mb if budget_mb else default_budget_mb()
+    max_workers = max_workers if max_workers else os.cpu_count()
+    waiting = list(jobs)
+    running = {}
+    in_use = 0.0
+
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             max_tasks_per_child=1) as pool:
+        while waiting or running:
+            # Start every waiting job that fits, in order
+            not_started = []
+            for name, estimate, func, args in waiting:
+                fits = in_use + estimate <= budget_mb or not running
+                if fits and len(running) < max_workers:
+                    if on_start is not None:
+                        on_start(name)
+                    try:
+                        future = pool.submit(func, *args)
+                    except Exception as error:
+                        # A worker killed, e.g. out of memory, breaks the pool
+                        yield name, None, error
+                        continue
+                    running[future] = (name, estimate)
+                    in_use += estimate
+                else:
+                    not_started.append((name, estimate, func, args))
+            waiting = not_started
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, estimate = running.pop(future)
+                in_use -= estimate
+                try:
+                    yield name, future.result(), None
+                except Exception as error:
+                    yield name, None, error
@@ -69,12 +69,23 @@ ALUKE.
 """
 import os
 import us
-import polars as pl # Polars reads csv's faster than pandas!
 
 # To make work in project or editor namespace
 try: import settings as SET
 except: import tools.settings as SET
 
+try: from schema import conform_to_schema, project_names
+except: from tools.schema import conform_to_schema, project_names
+
+try: from geoid import attach_geoid_keys
+except: from tools.geoid import attach_geoid_keys
+
+try: from ingest import read_state_rows
+except: from tools.ingest import read_state_rows
+
+try: from selection import selector_prefixes, resolve_selector
+except: from tools.selection import selector_prefixes, resolve_selector
+
 
 # A dictionary that converts NHGIS codes to MGGG-standard names
 NHGIS_RACE_NAMES = {
@@ -89,6 +100,9 @@ NHGIS_RACE_NAMES = {
     "ALUKE012": "HISP"
 }
 
+# Long GEOIDs carry a summary level prefix, e.g. "15000US010010201001"
+NHGIS_GEOID_PREFIX = "15000US"
+
 def check_nhgis_data():
     """
     Checks if NHGIS csv file exists in the location specified by the
@@ -114,7 +128,9 @@ def check_nhgis_data():
                                            "Please fetch NHGIS data manually.")
     return SET.LOCAL_NHGIS_CSV if file_exists else ""
 
-def get_nhgis_race_bgs(state_abbr: str):
+def get_nhgis_race_bgs(state_abbr: str, low_memory: bool = None, \
+                       memory_ceiling_mb: int = None, selector: dict = None,
+                       columns: list = None):
     """
     This returns a pandas DataFrame of NHGIS ACS 2019 Race and Origin
     data filtered by the given state in columns following MGGG naming
@@ -130,6 +146,20 @@ def get_nhgis_race_bgs(state_abbr: str):
     ----------
     state_abbr: str
         Two-letter state abbreviation of target state.
+    low_memory: bool
+        Flag as to whether to stream the national csv in chunks, keeping
+        only rows of the target state in memory. The result is the same
+        either way. Defaults to LOW_MEMORY in settings.
+    memory_ceiling_mb: int
+        Memory in megabytes any one chunk may take. Defaults to
+        MEMORY_CEILING_MB in settings.
+    selector: dict
+        GEOID prefixes, counties, bbox or mask of the block groups to
+        read. Default of whole state. See selection.py.
+    columns: list of str
+        MGGG columns to return, e.g. ["TOTPOP", "HISP"], reading only
+        their NHGIS codes from the csv. Columns of CVAP data are
+        ignored. Defaults to every column in NHGIS_RACE_NAMES.
 
     Returns
     -------
@@ -140,24 +170,30 @@ def get_nhgis_race_bgs(state_abbr: str):
     """
     state = us.states.lookup(state_abbr)
     state_nhgis_bgs = ""
+    race_names = project_names(NHGIS_RACE_NAMES, columns)
     if check_nhgis_data():
 
         # Create pandas DataFrame of Blockgroup Race Data from NHGIS
-        nhgis_bgs_pl = pl.scan_csv(SET.LOCAL_NHGIS_CSV)
-
-        # Filter for specific state
-        state_nhgis_bgs = (
-            nhgis_bgs_pl.filter(pl.lazy.col("STATE").str_contains(state.name))
-            .collect()
-            .to_pandas()
+        # Filter for specific state by State FIPS in the GEOID, as a
+        # state name like Virginia can also be found in West Virginia.
+        state_prefix = f"{NHGIS_GEOID_PREFIX}{state.fips}"
+        state_nhgis_bgs = read_state_rows(
+            SET.LOCAL_NHGIS_CSV, "GEOID", state_prefix,
+            ["GEOID"] + list(race_names.keys()),
+            low_memory, memory_ceiling_mb,
+            geoid_prefixes=selector_prefixes(
+                resolve_selector(state_abbr, selector), state.fips)
         )
-        # Use only last part of long GEOID, rename columns
-        state_nhgis_bgs["GEOID"] = (state_nhgis_bgs["GEOID"]
-                                    .apply(lambda x: x[7:]))
-        state_nhgis_bgs = state_nhgis_bgs.rename(columns=NHGIS_RACE_NAMES)
+        # Rename columns
+        state_nhgis_bgs = state_nhgis_bgs.rename(columns=race_names)
 
         #Keep only GEOID and named columns
         state_nhgis_bgs = (state_nhgis_bgs[ ["GEOID"]
-            + list(NHGIS_RACE_NAMES.values())])
+            + list(race_names.values())])
+
+        # Parse short GEOID keys once and sort by them
+        state_nhgis_bgs = attach_geoid_keys(state_nhgis_bgs, "GEOID",
+                                            len(NHGIS_GEOID_PREFIX))
+        state_nhgis_bgs = conform_to_schema(state_nhgis_bgs)
 
     return state_nhgis_bgs
@@ -0,0 +1,339 @@
+"""
+We often need to assign millions of geocoded points, e.g. the addresses
+of a voter file, to 2019 block groups and join CVAP and Race/Origin data
+onto each. A spatial join on freshly read TIGER data does the reading,
+parsing and indexing of a state anew for every file. This module keeps a
+packed spatial index of each state on disk instead, and looks points up
+in chunks across a pool of worker processes.
+
+Examples
+--------
+This module has three functions that can be used separately.
+
+    First, get_point_index returns the filename of a state's index,
+    building it from TIGER the first time.
+
+    hi_index = get_point_index("HI")
+
+    Second, locate_points returns the GEOID_KEY of the block group
+    holding each point, from an index loaded with load_point_index.
+
+    tree, keys, crs = load_point_index(hi_index)
+    bg_keys = locate_points(tree, keys, longitudes, latitudes)
+
+    Third, lookup_point_file streams points from a csv or Parquet file
+    and writes them out again with the GEOID and merged data of their
+    block groups.
+
+    lookup_point_file("HI_voters.csv", "HI_voters_bgs.parquet", "HI",
+                      x_column="lon", y_column="lat", jobs=8)
+
+    or lookup_points yields the same chunk by chunk as DataFrames.
+
+Notes
+-----
+The index is saved as an .npz next to the TIGER shapefile, as boundaries
+are fixed for each vintage, e.g.
+
+    data/Tiger19_bgs/tl_2019_15_bg/tl_2019_15_bg_points.npz
+
+It holds the WKB and GEOID_KEY of every block group, ordered along a
+Hilbert curve so that neighbors are stored together. Loading it parses
+the WKB in one vectorized call and packs an STRtree over it, which takes
+milliseconds, where reading the shapefile takes seconds.
+
+A point on the boundary of two block groups is given the one with the
+lower GEOID. A point in none, e.g. offshore or outside the state, is
+given no GEOID and no data.
+
+Coordinates are taken to be longitude and latitude in NAD83, the CRS of
+TIGER, unless another CRS is given. Geocoders mostly return WGS84,
+within a meter or two of NAD83 across the states.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from pyproj import CRS, Transformer
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from tiger import check_download_tiger_file, get_tiger_bgs
+except: from tools.tiger import check_download_tiger_file, get_tiger_bgs
+
+
+# Index loaded once by each worker process, see load_worker_index
+WORKER_INDEX = {}
+
+def point_index_filename(state_abbr: str, \
+                         download_allowed: bool = False) -> str:
+    """
+    Returns the filename of a state's point index, next to its TIGER
+    shapefile.
+    """
+    tiger_file = check_download_tiger_file(state_abbr, download_allowed)
+    return os.path.splitext(tiger_file)[0] + "_points.npz"
+
+def get_point_index(state_abbr: str, download_allowed: bool = False) -> str:
+    """
+    Returns the filename of a state's point index, building it from
+    TIGER block groups if it wasn't built before.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    str
+        Filename of the .npz index.
+
+    """
+    filename = point_index_filename(state_abbr, download_allowed)
+    if os.path.isfile(filename):
+        return filename
+
+    bgs = get_tiger_bgs(state_abbr, download_allowed)
+    order = np.argsort(bgs.geometry.hilbert_distance().to_numpy(),
+                       kind="stable")
+    wkbs = shapely.to_wkb(bgs.geometry.to_numpy()[order])
+    lengths = np.array([len(wkb) for wkb in wkbs], dtype=np.int64)
+
+    # Write whole then move into place, as other runs may be reading
+    tmp_file = f"{filename}.tmp{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_file, "wb") as index_file:
+        np.savez(index_file,
+                 keys=bgs["GEOID_KEY"].to_numpy()[order],
+                 wkb=np.frombuffer(b"".join(wkbs), dtype=np.uint8),
+                 offsets=np.r_[0, np.cumsum(lengths)],
+                 crs=np.array(bgs.crs.to_wkt()))
+    os.replace(tmp_file, filename)
+    return filename
+
+def load_point_index(filename: str):
+    """
+    Loads a point index saved by get_point_index.
+
+    Returns
+    -------
+    tuple
+        shapely.STRtree of block group geometry, the GEOID_KEY of each
+        and the CRS of both.
+
+    """
+    with np.load(filename) as index:
+        wkb = index["wkb"].tobytes()
+        offsets = index["offsets"]
+        keys = index["keys"]
+        crs = CRS.from_wkt(str(index["crs"]))
+    geoms = shapely.from_wkb([wkb[start:end] for start, end
+                              in zip(offsets[:-1], offsets[1:])])
+    return shapely.STRtree(geoms), keys, crs
+
+def locate_points(tree, keys: np.ndarray, xs: np.ndarray, \
+                  ys: np.ndarray) -> np.ndarray:
+    """
+    Returns the GEOID_KEY of the block group holding each point, or 0
+    for points in none.
+
+    Parameters
+    ----------
+    tree: shapely.STRtree
+        Block group geometry, from load_point_index.
+    keys: numpy.ndarray
+        GEOID_KEY of each geometry of the tree.
+    xs, ys: numpy.ndarray
+        Coordinates of the points in the CRS of the tree.
+
+    Returns
+    -------
+    numpy.ndarray
+        int64 GEOID_KEY of each point.
+
+    """
+    points = shapely.points(np.asarray(xs, dtype=float),
+                            np.asarray(ys, dtype=float))
+    point_rows, tree_rows = tree.query(points, predicate="intersects")
+
+    # On a boundary, the lowest key of all block groups touched wins
+    found_keys = keys[tree_rows]
+    order = np.lexsort((found_keys, point_rows))
+    point_rows, found_keys = point_rows[order], found_keys[order]
+    firsts = np.flatnonzero(np.r_[len(point_rows) > 0,
+                                  point_rows[1:] != point_rows[:-1]])
+
+    located = np.zeros(len(points), dtype=np.int64)
+    located[point_rows[firsts]] = found_keys[firsts]
+    return located
+
+def load_worker_index(filename: str):
+    """
+    Loads a point index once in each worker process.
+    """
+    WORKER_INDEX["tree"], WORKER_INDEX["keys"], _ = load_point_index(filename)
+
+def locate_chunk(xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """
+    Locates a chunk of points with the index of this worker process.
+    """
+    return locate_points(WORKER_INDEX["tree"], WORKER_INDEX["keys"], xs, ys)
+
+def iter_point_chunks(path: str, chunk_rows: int = None):
+    """
+    Yields the rows of a csv or Parquet file as DataFrames of at most
+    chunk_rows rows. Defaults to POINT_CHUNK_ROWS in settings.
+    """
+    chunk_rows = chunk_rows if chunk_rows else SET.POINT_CHUNK_ROWS
+    if path.endswith(".parquet"):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+
+def join_block_group_data(chunk: pd.DataFrame, located: np.ndarray, \
+                          bg_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns a chunk of points with the GEOID and data of the block group
+    holding each, from key-sorted bg_data, missing for points in none.
+    """
+    bg_keys = bg_data["GEOID_KEY"].to_numpy()
+    rows = np.searchsorted(bg_keys, located).clip(0, max(len(bg_keys) - 1, 0))
+    found = (bg_keys[rows] == located) if len(bg_keys) else \
+            np.zeros(len(located), dtype=bool)
+
+    # Points in no block group take row -1, which is all missing
+    matched = bg_data.drop(columns="GEOID_KEY").reset_index(drop=True)
+    matched = matched.reindex(np.where(found, rows, -1))
+    matched.index = chunk.index
+    return pd.concat([chunk, matched], axis=1)
+
+def lookup_points(path: str, state_abbr: str, x_column: str = "", \
+                  y_column: str = "", crs: str = None, jobs: int = None, \
+                  chunk_rows: int = None, bg_data: pd.DataFrame = None, \
+                  download_allowed: bool = False):
+    """
+    Streams points from a csv or Parquet file and yields them chunk by
+    chunk with the GEOID and merged data of their block groups.
+
+    Parameters
+    ----------
+    path: str
+        Filename of a csv or .parquet file of points.
+    state_abbr: str
+        Two-letter state abbreviation of the state of the points.
+    x_column, y_column: str
+        Columns of longitude and latitude. Default to POINT_X_COLUMN and
+        POINT_Y_COLUMN in settings.
+    crs: str
+        CRS of the coordinates, e.g. "EPSG:4326". Defaults to that of
+        TIGER.
+    jobs: int
+        Number of worker processes. Defaults to the number of CPUs, or
+        with 1, points are located in this process.
+    chunk_rows: int
+        Points read and located at a time. Defaults to POINT_CHUNK_ROWS
+        in settings.
+    bg_data: pandas.DataFrame
+        Block group data sorted by GEOID_KEY to join onto points.
+        Defaults to make_race_cvap_gdf without its geometry.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+
+    Yields
+    ------
+    pandas.DataFrame
+        Each chunk of points, in order, with GEOID and every data
+        column of bg_data added.
+
+    """
+    x_column = x_column if x_column else SET.POINT_X_COLUMN
+    y_column = y_column if y_column else SET.POINT_Y_COLUMN
+    index_file = get_point_index(state_abbr, download_allowed)
+    tree, keys, index_crs = load_point_index(index_file)
+    transformer = None
+    if crs is not None and not CRS.from_user_input(crs).equals(index_crs):
+        transformer = Transformer.from_crs(crs, index_crs, always_xy=True)
+
+    if bg_data is None:
+        # Imported here, as census_adder is heavy and optional for lookups
+        try: from census_adder import make_race_cvap_gdf
+        except: from tools.census_adder import make_race_cvap_gdf
+        race_cvap_gdf = make_race_cvap_gdf(state_abbr, download_allowed)
+        bg_data = pd.DataFrame(
+            race_cvap_gdf.drop(columns=race_cvap_gdf.geometry.name))
+
+    def coordinates(chunk):
+        xs = chunk[x_column].to_numpy(dtype=float, na_value=np.nan)
+        ys = chunk[y_column].to_numpy(dtype=float, na_value=np.nan)
+        return transformer.transform(xs, ys) if transformer else (xs, ys)
+
+    chunks = iter_point_chunks(path, chunk_rows)
+    if jobs == 1:
+        for chunk in chunks:
+            located = locate_points(tree, keys, *coordinates(chunk))
+            yield join_block_group_data(chunk, located, bg_data)
+        return
+
+    jobs = jobs if jobs else os.cpu_count()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=load_worker_index,
+                             initargs=(index_file,)) as pool:
+        # Keep a few chunks per worker in flight, not the whole file
+        pending = []
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(locate_chunk,
+                                               *coordinates(chunk))))
+            if len(pending) >= 2 * jobs:
+                chunk, future = pending.pop(0)
+                yield join_block_group_data(chunk, future.result(), bg_data)
+        for chunk, future in pending:
+            yield join_block_group_data(chunk, future.result(), bg_data)
+
+def lookup_point_file(path: str, output: str, state_abbr: str, \
+                      x_column: str = "", y_column: str = "", \
+                      crs: str = None, jobs: int = None, \
+                      chunk_rows: int = None, \
+                      download_allowed: bool = False) -> str:
+    """
+    Writes the points of a csv or Parquet file to a csv or Parquet file
+    with the GEOID and merged data of their block groups. See
+    lookup_points for the parameters.
+
+    Returns
+    -------
+    str
+        Filename of output, written whole before moved into place.
+
+    """
+    writer = None
+    tmp_output = f"{output}.tmp{os.getpid()}-{threading.get_ident()}"
+    try:
+        for i, chunk in enumerate(lookup_points(path, state_abbr, x_column,
+                                                y_column, crs, jobs,
+                                                chunk_rows,
+                                                download_allowed=\
+                                                download_allowed)):
+            if output.endswith(".parquet"):
+                # Every chunk's GEOIDs share the categories of the state
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_output, table.schema)
+                writer.write_table(table.cast(writer.schema))
+            else:
+                chunk.to_csv(tmp_output, mode="w" if i == 0 else "a",
+                             header=(i == 0), index=False)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_output, output)
+    return output
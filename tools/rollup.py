@@ -0,0 +1,279 @@
+"""
+We often need CVAP and Race/Origin data for tracts or counties rather
+than block groups. Both are made of whole block groups, so this module
+rolls block groups up into either, adding up their counts and
+dissolving their geometry.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, aggregate_counts adds up the counts of key-sorted block
+    groups within each tract or county.
+
+    hi_tract_data = aggregate_counts(hi_race_cvap_bgs, "tract")
+
+    Second, get_dissolved_geometry returns the geometry of every tract
+    or county of a state, dissolved from TIGER block groups across a
+    pool of worker processes, from cache if it was made before.
+
+    hi_county_geoms = get_dissolved_geometry("HI", "county")
+
+    make_race_cvap_gdf does both when asked for a summary level, e.g.
+
+    hi_tracts = census_adder.make_race_cvap_gdf("HI",
+                                                summary_level="tract")
+
+Notes
+-----
+A tract or county GEOID is the start of the GEOIDs of its block groups,
+
+    15 007 040301 1
+    |--|---|------|
+    county (5)
+    tract (11)
+
+so its key is that of a block group divided by a power of ten. Block
+groups sorted by key are then sorted by tract and county as well, and
+adding up counts is one groupby over those keys.
+
+Geometry is dissolved one county at a time, each county a chunk of
+neighboring block groups handed to a worker process. Tracts never cross
+county lines, so every tract is dissolved whole within its chunk.
+
+Dissolved geometry is cached as GeoParquet next to the TIGER shapefile,
+as boundaries are fixed for each vintage, e.g.
+
+    data/Tiger19_bgs/tl_2019_15_bg/tl_2019_15_bg_tract.parquet
+
+A selection of block groups, see selection.py, may cover only part of
+a tract or county. Its counts then add up the selected block groups
+alone, and its geometry is dissolved from them alone, never cached.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from tiger import check_download_tiger_file, get_tiger_bgs
+except: from tools.tiger import check_download_tiger_file, get_tiger_bgs
+
+try: from schema import conform_to_schema, COUNT_COLUMNS
+except: from tools.schema import conform_to_schema, COUNT_COLUMNS
+
+try: from geoid import GEOID_DIGITS
+except: from tools.geoid import GEOID_DIGITS
+
+
+# Number of GEOID digits at each summary level
+SUMMARY_LEVELS = {"block_group": 12, "tract": 11, "county": 5}
+
+def level_keys(keys: np.ndarray, summary_level: str) -> np.ndarray:
+    """
+    Returns the tract or county key of each block group key.
+    """
+    if summary_level not in SUMMARY_LEVELS:
+        raise ValueError(f"Summary level must be one of " + \
+                         f"{list(SUMMARY_LEVELS)}, not {summary_level}.")
+    return keys // 10 ** (GEOID_DIGITS - SUMMARY_LEVELS[summary_level])
+
+def aggregate_counts(frame: pd.DataFrame, summary_level: str, \
+                     sum_columns: list = None) -> pd.DataFrame:
+    """
+    Adds up the counts of block groups within each tract or county.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        Block groups following the MGGG schema, sorted by GEOID_KEY.
+    summary_level: str
+        "tract" or "county".
+    sum_columns: list of str
+        Other columns to add up, e.g. ["ALAND", "AWATER"]. Default of
+        counts alone.
+
+    Returns
+    -------
+    pandas.DataFrame
+        GEOID, GEOID_KEY and counts of each tract or county, sorted by
+        GEOID_KEY. A count is missing only where it is missing for
+        every block group within.
+
+    """
+    keys = level_keys(frame["GEOID_KEY"].to_numpy(), summary_level)
+    # A selection of no block groups has no firsts
+    firsts = np.flatnonzero(np.r_[len(keys) > 0, keys[1:] != keys[:-1]])
+    counts = [col for col in frame.columns
+              if col in COUNT_COLUMNS or col in (sum_columns or [])]
+
+    sums = frame[counts].groupby(keys, sort=False).sum(min_count=1)
+    geoids = frame["GEOID"].astype(str).to_numpy()[firsts]
+    aggregated = pd.DataFrame({
+        "GEOID": [geoid[:SUMMARY_LEVELS[summary_level]] for geoid in geoids],
+        "GEOID_KEY": keys[firsts],
+    })
+    aggregated[counts] = sums.reset_index(drop=True)
+    return conform_to_schema(aggregated)
+
+def dissolve_chunk(wkbs: list, keys: np.ndarray) -> list:
+    """
+    Dissolves a chunk of block group geometry by key, one union for
+    each run of equal keys. Run by each worker.
+
+    Returns
+    -------
+    list of bytes
+        WKB of each dissolved geometry, in key order.
+
+    """
+    geoms = shapely.from_wkb(wkbs)
+    firsts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    bounds = np.r_[firsts, len(keys)]
+    return [shapely.to_wkb(shapely.union_all(geoms[start:end]))
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+def dissolve_bgs(bgs, summary_level: str, jobs: int = None):
+    """
+    Dissolves block groups into tracts or counties, one county per
+    chunk, across a pool of worker processes.
+
+    Parameters
+    ----------
+    bgs: geopandas.GeoDataFrame
+        Block groups sorted by GEOID_KEY, e.g. from get_tiger_bgs.
+    summary_level: str
+        "tract" or "county".
+    jobs: int
+        Number of worker processes. Defaults to the number of CPUs.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        GEOID, GEOID_KEY and geometry of each tract or county, sorted by
+        GEOID_KEY.
+
+    """
+    keys = level_keys(bgs["GEOID_KEY"].to_numpy(), summary_level)
+    counties = level_keys(bgs["GEOID_KEY"].to_numpy(), "county")
+    # A selection of no block groups has no counties
+    county_firsts = np.flatnonzero(np.r_[len(counties) > 0,
+                                         counties[1:] != counties[:-1]])
+    bounds = np.r_[county_firsts, len(keys)]
+    wkbs = shapely.to_wkb(bgs.geometry.to_numpy())
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(dissolve_chunk, wkbs[start:end],
+                               keys[start:end])
+                   for start, end in zip(bounds[:-1], bounds[1:])]
+        dissolved = [wkb for future in futures for wkb in future.result()]
+
+    firsts = np.flatnonzero(np.r_[len(keys) > 0, keys[1:] != keys[:-1]])
+    geoids = bgs["GEOID"].astype(str).to_numpy()[firsts]
+    return conform_to_schema(gpd.GeoDataFrame({
+        "GEOID": [geoid[:SUMMARY_LEVELS[summary_level]] for geoid in geoids],
+        "GEOID_KEY": keys[firsts],
+    }, geometry=shapely.from_wkb(dissolved), crs=bgs.crs))
+
+def get_dissolved_geometry(state_abbr: str, summary_level: str, \
+                           jobs: int = None, download_allowed: bool = False):
+    """
+    Returns the tracts or counties of a state dissolved from TIGER block
+    groups, reading them from cache if they were dissolved before.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    summary_level: str
+        "tract" or "county".
+    jobs: int
+        Number of worker processes. Defaults to the number of CPUs.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        GEOID, GEOID_KEY and geometry of each tract or county, sorted by
+        GEOID_KEY.
+
+    """
+    tiger_file = check_download_tiger_file(state_abbr, download_allowed)
+    filename = os.path.splitext(tiger_file)[0] + f"_{summary_level}.parquet"
+    if os.path.isfile(filename):
+        return conform_to_schema(gpd.read_parquet(filename))
+
+    dissolved = dissolve_bgs(get_tiger_bgs(state_abbr, download_allowed),
+                             summary_level, jobs)
+
+    # Write whole then move into place, as other runs may be reading
+    tmp_file = f"{filename}.tmp{os.getpid()}-{threading.get_ident()}"
+    dissolved.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, filename)
+    return dissolved
+
+def rollup_race_cvap_gdf(race_cvap_gdf, state_abbr: str, \
+                         summary_level: str, jobs: int = None, \
+                         download_allowed: bool = False, \
+                         selected: bool = False):
+    """
+    Rolls up merged block groups of a state into tracts or counties.
+
+    Parameters
+    ----------
+    race_cvap_gdf: geopandas.GeoDataFrame
+        Merged block groups of the whole state, e.g. from
+        make_race_cvap_gdf, sorted by GEOID_KEY.
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    summary_level: str
+        "tract" or "county".
+    jobs: int
+        Number of worker processes for dissolving. Defaults to the
+        number of CPUs.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+    selected: bool
+        Flag that the block groups are a selection of the state, see
+        selection.py. Their own geometry is dissolved then, rather than
+        read from the cache of whole tracts or counties, so that each
+        shape covers just the block groups its counts add up.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        Tracts or counties with added up counts, sorted by GEOID_KEY,
+        keeping the "join_report" of the block groups in its attrs.
+
+    """
+    aggregated = aggregate_counts(
+        race_cvap_gdf.drop(columns=race_cvap_gdf.geometry.name),
+        summary_level)
+    if selected:
+        dissolved = dissolve_bgs(race_cvap_gdf, summary_level, jobs)
+    else:
+        dissolved = get_dissolved_geometry(state_abbr, summary_level, jobs,
+                                           download_allowed)
+
+    keys = aggregated["GEOID_KEY"].to_numpy()
+    dissolved_keys = dissolved["GEOID_KEY"].to_numpy()
+    rows = np.searchsorted(dissolved_keys, keys)
+    if (rows >= len(dissolved_keys)).any() or \
+       not np.array_equal(dissolved_keys[rows], keys):
+        raise ValueError(f"Dissolved {summary_level} geometry of " + \
+                         f"{state_abbr} does not match its block groups.")
+
+    rolled_up = gpd.GeoDataFrame(aggregated,
+                                 geometry=dissolved.geometry.values[rows],
+                                 crs=dissolved.crs)
+    rolled_up.attrs = dict(race_cvap_gdf.attrs)
+    return rolled_up
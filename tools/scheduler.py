@@ -0,0 +1,336 @@
+"""
+Building a state is a chain of stages, some waiting on the network,
+some on the CPU and some on the disk. Run one after another, state
+after state, the network sits idle while we parse and the CPU sits idle
+while we download. This module runs stages as a graph of tasks instead,
+each in a bounded pool of its own kind, so that downloads for upcoming
+states overlap parsing and writing of the current ones.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, run_tasks runs any list of tasks, each a dict naming its
+    function, the pool it runs in and the tasks whose results it takes
+    as its first arguments.
+
+    tasks = [
+        {"name": "HI:cvap", "func": get_cvap_bgs, "args": ["HI"],
+         "pool": "cpu"},
+        {"name": "HI:race", "func": get_race_origin_bgs, "args": ["HI"],
+         "pool": "network"},
+        {"name": "HI:merge", "func": race_cvap_merge,
+         "inputs": ["HI:race", "HI:cvap"], "pool": "cpu"},
+    ]
+    results, errors = run_tasks(tasks)
+    hi_race_cvap = results["HI:merge"]
+
+    Second, make_race_cvap_shps builds the shapefiles of many states
+    with every stage of every state scheduled together.
+
+    results, errors = make_race_cvap_shps(["HI", "RI", "DE"],
+                                          download_allowed=True)
+
+Notes
+-----
+Each task is a dict with the following keys.
+
+name
+    Unique name of the task, e.g. "HI:cvap".
+func
+    Function to run.
+inputs
+    Names of tasks whose results are passed to func, in order, before
+    any args. Defaults to none.
+args, kwargs
+    Further arguments to func. Default to none.
+pool
+    "network", "cpu" or "disk". Defaults to "cpu".
+keep
+    Flag as to whether to return the result even when other tasks use
+    it. Results of tasks no other task uses are always returned, while
+    the rest are let go once every task using them is done.
+
+Pool sizes are set in settings with SCHEDULER_POOLS. Tasks run as soon
+as their inputs are ready and their pool has a free worker, earliest
+declared first, so earlier states finish first while later states
+download.
+
+Pools are threads. Downloads wait on sockets, while reading csv's with
+polars, shapefiles with pyogrio and geometry with shapely release the
+GIL for their heavy lifting.
+
+A task that fails is recorded with its error, and every task depending
+on it is skipped, while unrelated tasks, e.g. other states, carry on.
+The results of tasks whose users were all skipped are let go too, so
+only tasks that fully succeeded, or are marked keep, are returned.
+"""
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from tiger import check_download_tiger_file, get_tiger_bgs
+except: from tools.tiger import check_download_tiger_file, get_tiger_bgs
+
+try: from cvap2019 import get_cvap_bgs
+except: from tools.cvap2019 import get_cvap_bgs
+
+try: from schema import to_output_dtypes
+except: from tools.schema import to_output_dtypes
+
+try: from census_adder import get_race_origin_bgs, merge_race_cvap_gdf
+except: from tools.census_adder import get_race_origin_bgs, \
+                                       merge_race_cvap_gdf
+
+# Pool of the race data of each ACS plugin. Only the Census API waits on
+# the network, NHGIS parses a national csv and the Summary File reads
+# its cache of one small file per state.
+RACE_POOLS = {"CensusAPI": "network", "NHGIS": "cpu", "SummaryFile": "disk"}
+
+def check_tasks(tasks: list, pool_sizes: dict):
+    """
+    Raises ValueError if tasks repeat names, name unknown inputs or
+    pools, or depend on each other in a cycle.
+    """
+    names = [task["name"] for task in tasks]
+    if len(set(names)) < len(names):
+        repeated = sorted({name for name in names if names.count(name) > 1})
+        raise ValueError(f"Task names repeat: {repeated}")
+    for task in tasks:
+        unknown = set(task.get("inputs", [])) - set(names)
+        if unknown:
+            raise ValueError(f"Task {task['name']} has unknown inputs " + \
+                             f"{sorted(unknown)}")
+        if task.get("pool", "cpu") not in pool_sizes:
+            raise ValueError(f"Task {task['name']} has unknown pool " + \
+                             f"{task.get('pool')}")
+
+    # Peel off tasks with no unfinished inputs until none are left
+    remaining = {task["name"]: set(task.get("inputs", [])) for task in tasks}
+    while remaining:
+        ready = [name for name, inputs in remaining.items() if not inputs]
+        if not ready:
+            raise ValueError(f"Tasks depend on each other in a cycle: " + \
+                             f"{sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for inputs in remaining.values():
+            inputs.difference_update(ready)
+
+def run_tasks(tasks: list, pool_sizes: dict = None) -> tuple:
+    """
+    Runs a graph of tasks, each in its own kind of bounded pool, as
+    soon as its inputs are ready.
+
+    Parameters
+    ----------
+    tasks: list of dict
+        Tasks in order of priority. See Notes of this module.
+    pool_sizes: dict
+        Number of workers of each pool, overriding SCHEDULER_POOLS in
+        settings, e.g. {"network": 16}.
+
+    Returns
+    -------
+    tuple of dict
+        Results of tasks no other task uses, or marked keep, by name,
+        and the errors of failed or skipped tasks, by name.
+
+    Raises
+    ------
+    ValueError
+        Tasks must have unique names, known inputs and pools and no
+        cycles.
+
+    """
+    pool_sizes = {**SET.SCHEDULER_POOLS, **(pool_sizes or {})}
+    check_tasks(tasks, pool_sizes)
+
+    by_name = {task["name"]: task for task in tasks}
+    priority = {task["name"]: i for i, task in enumerate(tasks)}
+    waiting_on = {task["name"]: set(task.get("inputs", [])) for task in tasks}
+    dependents = {name: [] for name in by_name}
+    users_left = Counter()
+    for task in tasks:
+        for input_name in task.get("inputs", []):
+            dependents[input_name].append(task["name"])
+            users_left[input_name] += 1
+
+    results = {}
+    errors = {}
+
+    def release_inputs(name):
+        # Let go of results no task still needs
+        for input_name in by_name[name].get("inputs", []):
+            users_left[input_name] -= 1
+            if not users_left[input_name] and \
+               not by_name[input_name].get("keep"):
+                results.pop(input_name, None)
+
+    def skip(name, cause):
+        errors[name] = RuntimeError(f"Skipped, as {cause} failed.")
+        release_inputs(name)
+        for dependent in dependents[name]:
+            if dependent not in errors:
+                skip(dependent, cause)
+
+    pools = {pool: ThreadPoolExecutor(max_workers=size,
+                                      thread_name_prefix=pool)
+             for pool, size in pool_sizes.items()}
+    busy = Counter()
+    running = {}
+    ready = [name for name in by_name if not waiting_on[name]]
+    try:
+        while ready or running:
+            # Fill free workers of each pool, earliest declared first
+            not_started = []
+            for name in ready:
+                task = by_name[name]
+                pool = task.get("pool", "cpu")
+                if busy[pool] >= pool_sizes[pool]:
+                    not_started.append(name)
+                    continue
+                args = [results[input_name]
+                        for input_name in task.get("inputs", [])]
+                future = pools[pool].submit(task["func"], *args,
+                                            *task.get("args", []),
+                                            **task.get("kwargs", {}))
+                running[future] = name
+                busy[pool] += 1
+            ready = not_started
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                busy[by_name[name].get("pool", "cpu")] -= 1
+                try:
+                    result = future.result()
+                except Exception as error:
+                    print(f"Task {name} failed with " + \
+                          f"{type(error).__name__}: {error}")
+                    errors[name] = error
+                else:
+                    # Every task using it may already have been skipped,
+                    # having let go of it before it was even done
+                    if by_name[name].get("keep") or \
+                       not dependents[name] or \
+                       any(dependent not in errors
+                           for dependent in dependents[name]):
+                        results[name] = result
+                release_inputs(name)
+
+                for dependent in dependents[name]:
+                    if dependent in errors:
+                        continue
+                    if name in errors:
+                        skip(dependent, name)
+                        continue
+                    waiting_on[dependent].discard(name)
+                    if not waiting_on[dependent]:
+                        ready.append(dependent)
+            ready.sort(key=priority.get)
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+    return results, errors
+
+def write_race_cvap_shp(race_cvap_gdf, output: str) -> str:
+    """
+    Writes merged Block Groups to a shapefile, returning its filename.
+    """
+    output_folder = os.path.dirname(output)
+    if output_folder and not os.path.isdir(output_folder):
+        os.makedirs(output_folder, exist_ok=True)
+    to_output_dtypes(race_cvap_gdf).to_file(output)
+    return output
+
+def make_state_tasks(state_abbr: str, output: str = "", \
+                     download_allowed: bool = False) -> list:
+    """
+    Returns the tasks building the shapefile of one state, named with
+    the state abbreviation as prefix, e.g. "HI:cvap".
+
+    The TIGER download waits on the network, CVAP parsing and the merge
+    on the CPU and the TIGER read and shapefile write on the disk. Race
+    data goes to the pool of ACS_PLUGIN in RACE_POOLS, the network for
+    the Census API alone.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    output: str
+        Desired shapefile path and name for output. Default, set in
+        settings with State abbr prefix.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+
+    Returns
+    -------
+    list of dict
+        Tasks ending in f"{state_abbr}:write", whose result is the
+        shapefile's filename.
+
+    """
+    if not output:
+        output = SET.DEFAULT_OUPUT_FOLDER + \
+                 f"{state_abbr}_{SET.DEFAULT_OUTPUT}/" + \
+                 f"{state_abbr}_{SET.DEFAULT_OUTPUT}.shp"
+    return [
+        {"name": f"{state_abbr}:tiger_download", "pool": "network",
+         "func": check_download_tiger_file,
+         "args": [state_abbr, download_allowed]},
+        {"name": f"{state_abbr}:race",
+         "pool": RACE_POOLS.get(SET.ACS_PLUGIN, "cpu"),
+         "func": get_race_origin_bgs, "args": [state_abbr]},
+        {"name": f"{state_abbr}:cvap", "pool": "cpu",
+         "func": get_cvap_bgs, "args": [state_abbr]},
+        # The download is an input only to wait for it
+        {"name": f"{state_abbr}:tiger", "pool": "disk",
+         "func": lambda tiger_file: get_tiger_bgs(state_abbr),
+         "inputs": [f"{state_abbr}:tiger_download"]},
+        {"name": f"{state_abbr}:merge", "pool": "cpu",
+         "func": merge_race_cvap_gdf,
+         "inputs": [f"{state_abbr}:tiger", f"{state_abbr}:cvap",
+                    f"{state_abbr}:race"]},
+        {"name": f"{state_abbr}:write", "pool": "disk",
+         "func": write_race_cvap_shp, "args": [output],
+         "inputs": [f"{state_abbr}:merge"]},
+    ]
+
+def make_race_cvap_shps(state_abbrs: list, pool_sizes: dict = None, \
+                        download_allowed: bool = False) -> tuple:
+    """
+    Creates Shapefiles of Block Groups in many States with CVAP and ACS
+    Race information, overlapping the stages of all states.
+
+    Parameters
+    ----------
+    state_abbrs: list of str
+        Two-letter state abbreviations of target states, in the order
+        they should be finished.
+    pool_sizes: dict
+        Number of workers of each pool, overriding SCHEDULER_POOLS in
+        settings.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    tuple of dict
+        Shapefile filename of each state done, and the error of every
+        failed or skipped task, by name.
+
+    """
+    tasks = [task for state_abbr in state_abbrs
+             for task in make_state_tasks(state_abbr,
+                                          download_allowed=download_allowed)]
+    results, errors = run_tasks(tasks, pool_sizes)
+    filenames = {name.split(":")[0]: filename
+                 for name, filename in results.items()}
+    return filenames, errors
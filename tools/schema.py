@@ -0,0 +1,249 @@
+"""
+Every getter in this package returns a pandas DataFrame of Block Groups
+in columns following MGGG naming standards. This module holds the one
+schema those frames conform to, derived from the naming convention in
+the settings, so that CVAP, Race/Origin and TIGER data all meet at the
+merge speaking the same types.
+
+Examples
+--------
+This module has four functions that can be used separately.
+
+    First, conform_to_schema casts a frame's GEOID and MGGG-named count
+    columns to the compact dtypes listed below. Getters call it right
+    before they return.
+
+    cvap_bgs = conform_to_schema(cvap_bgs)
+
+    Second, validate_schema checks that a frame already conforms and
+    raises an exception naming the stage where it did not. We call it
+    at the boundaries between stages, e.g. on the way into
+    race_cvap_merge.
+
+    validate_schema(race_bgs, "race")
+
+    Third, to_output_dtypes turns a conforming frame back into plain
+    numpy dtypes that shapefile writers understand.
+
+    hi_gdf = to_output_dtypes(hi_gdf)
+    hi_gdf.to_file("hi_race_cvap.shp")
+
+    Last, project_names maps the counts a caller asks for back to the
+    columns of a source, so that nothing else of it is read.
+
+    project_names(NHGIS_RACE_NAMES, ["TOTPOP", "HISP"])
+    {"ALUKE001": "TOTPOP", "ALUKE012": "HISP"}
+
+Notes
+-----
+Counts come out of pandas as int64 or, once to_numeric coerces or a
+pivot leaves holes, float64 with NaN. GEOIDs come out as Python object
+strings. Neither is needed.
+
+COUNT_DTYPE
+    Unsigned 32-bit nullable integers, "UInt32". No block group holds
+    more than four billion people, and missing values stay <NA> rather
+    than turning the whole column into floats.
+GEOID_DTYPE
+    Dictionary-encoded strings, "category". Each 12-character GEOID is
+    stored once and every row holds only a small integer code.
+GEOID_KEY_DTYPE
+    The same GEOID parsed as an int64, "int64", which frames are sorted
+    by and joined on. See geoid.py.
+
+Together these cut per-state tabular memory by well over half.
+"""
+import pandas as pd
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+
+COUNT_DTYPE = "UInt32"
+GEOID_DTYPE = "category"
+GEOID_KEY_DTYPE = "int64"
+
+# Block Group GEOIDs are STATE(2) + COUNTY(3) + TRACT(6) + BLKGRP(1)
+GEOID_LENGTH = 12
+
+# Every MGGG-named demographic column is a count.
+COUNT_COLUMNS = list(SET.NAME_CONVENTION.keys())
+
+MGGG_SCHEMA = {"GEOID": GEOID_DTYPE, "GEOID_KEY": GEOID_KEY_DTYPE}
+MGGG_SCHEMA.update({col: COUNT_DTYPE for col in COUNT_COLUMNS})
+
+def conform_to_schema(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts GEOID and any MGGG-named count columns of a frame to the MGGG
+    schema. Other columns, like geometry, are left untouched.
+
+    Notes
+    -----
+    Counts are coerced to numbers first. Anything that cannot be read as
+    a number, and any negative value, becomes <NA>. The Census API, for
+    one, reports missing estimates with large negative annotations such
+    as -666666666.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        DataFrame with a GEOID column and MGGG-named count columns.
+
+    Returns
+    -------
+    pandas.DataFrame
+        New frame with its columns cast to the MGGG schema.
+
+    """
+    conformed = {}
+    for col in frame.columns:
+        if col not in MGGG_SCHEMA or str(frame[col].dtype) == MGGG_SCHEMA[col]:
+            continue
+        if col == "GEOID":
+            conformed[col] = frame[col].astype(str).astype(GEOID_DTYPE)
+        elif col == "GEOID_KEY":
+            conformed[col] = frame[col].astype(GEOID_KEY_DTYPE)
+        else:
+            counts = pd.to_numeric(frame[col], errors="coerce")
+            conformed[col] = counts.where(counts >= 0).astype(COUNT_DTYPE)
+    return frame.assign(**conformed)
+
+def validate_schema(frame: pd.DataFrame, stage: str = "",
+                    geoid_length: int = GEOID_LENGTH):
+    """
+    Checks that a frame conforms to the MGGG schema, to be called at the
+    boundary between stages.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        DataFrame that should have been passed through conform_to_schema.
+    stage: str
+        Name of the stage that produced the frame, used in error
+        messages, e.g. "cvap" or "race".
+    geoid_length: int
+        Length of every GEOID. Defaults to 12, that of Block Groups, or
+        e.g. 11 for tracts and 5 for counties.
+
+    Raises
+    ------
+    ValueError
+        If GEOID or GEOID_KEY is missing, a column has the wrong dtype,
+        a GEOID is not geoid_length characters long or keys are not
+        sorted.
+
+    """
+    for col in ("GEOID", "GEOID_KEY"):
+        if col not in frame.columns:
+            raise ValueError(f"No {col} column found in {stage} data.")
+    wrong_dtypes = [
+        f"{col} ({frame[col].dtype})" for col in frame.columns
+        if col in MGGG_SCHEMA and str(frame[col].dtype) != MGGG_SCHEMA[col]
+    ]
+    if wrong_dtypes:
+        raise ValueError(f"Columns in {stage} data do not follow the " + \
+                         "MGGG schema: " + ", ".join(wrong_dtypes))
+    # Only the dictionary of a categorical needs checking, not every row.
+    geoids = frame["GEOID"].cat.categories
+    if len(geoids) and not (geoids.str.len() == geoid_length).all():
+        raise ValueError(f"GEOIDs in {stage} data are not all " + \
+                         f"{geoid_length} characters long.")
+    if not frame["GEOID_KEY"].is_monotonic_increasing:
+        raise ValueError(f"{stage} data is not sorted by GEOID_KEY.")
+
+def check_columns(columns: list = None, available: list = None):
+    """
+    Checks that a list of columns asked for are all MGGG-named counts
+    that the sources at hand can produce.
+
+    Parameters
+    ----------
+    columns: list of str
+        MGGG-named count columns, e.g. ["TOTPOP", "CVAP", "HCVAP"], or
+        None for all of them.
+    available: list of str
+        Columns the sources can produce, e.g. those of CVAP and race
+        data together. Defaults to every MGGG-named count.
+
+    Raises
+    ------
+    ValueError
+        If the list is empty or names columns not available.
+
+    """
+    if columns is None:
+        return
+    if not len(columns):
+        raise ValueError("No columns asked for. Leave columns as None " + \
+                         "for all of them.")
+    available = COUNT_COLUMNS if available is None else available
+    unknown = [col for col in columns if col not in available]
+    if unknown:
+        raise ValueError("Columns not produced by any source: " + \
+                         ", ".join(unknown) + ". Choose from " + \
+                         ", ".join(available))
+
+def project_names(names: dict, columns: list = None) -> dict:
+    """
+    Returns only those source columns of a dictionary of source to MGGG
+    names whose MGGG names are asked for, so no more of a source is
+    read than is needed.
+
+    Parameters
+    ----------
+    names: dict
+        Source column names each with its MGGG name, e.g.
+        NHGIS_RACE_NAMES.
+    columns: list of str
+        MGGG-named count columns asked for, or None for all of them.
+        Columns the source doesn't have are left to other sources.
+
+    Returns
+    -------
+    dict
+        Part of names, in the same order.
+
+    Raises
+    ------
+    ValueError
+        If columns are not MGGG-named counts.
+
+    """
+    check_columns(columns)
+    if columns is None:
+        return dict(names)
+    return {source: name for source, name in names.items() if name in columns}
+
+def to_output_dtypes(frame: pd.DataFrame,
+                     float_columns: list = None) -> pd.DataFrame:
+    """
+    Returns a copy of a conforming frame with plain numpy dtypes, which
+    shapefile and other file writers expect.
+
+    GEOID becomes a string again and GEOID_KEY, needed only for joins,
+    is dropped. Count columns become int64, or float64 where they hold
+    missing values, just like pandas made them before the schema existed.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        DataFrame or GeoDataFrame following the MGGG schema.
+    float_columns: list of str
+        Count columns to make float64 whether or not they hold missing
+        values, so that chunks of one file all share the same types.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Copy of frame ready for writing to file.
+
+    """
+    frame = frame.drop(columns="GEOID_KEY", errors="ignore")
+    for col in frame.columns:
+        if col == "GEOID":
+            frame[col] = frame[col].astype(str)
+        elif col in COUNT_COLUMNS:
+            has_na = col in (float_columns or []) or frame[col].isna().any()
+            frame[col] = frame[col].astype("float64" if has_na else "int64")
+    return frame
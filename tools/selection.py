@@ -0,0 +1,194 @@
+"""
+We often need only one county of a state, or a handful of block groups
+around a city, yet every getter read the whole state. This module turns
+a selector into what each reader can filter on as it reads, so that the
+cost of a read follows the selection rather than the state.
+
+Examples
+--------
+A selector is a dict with any of the following keys, passed to every
+getter and to make_race_cvap_gdf.
+
+    maui = {"counties": ["009"]}
+    some_tracts = {"geoids": ["15001021", "15001021300"]}
+    honolulu = {"bbox": (-158.0, 21.25, -157.75, 21.4)}
+
+    hi_cvap_bgs = cvap2019.get_cvap_bgs("HI", selector=maui)
+    honolulu_gdf = census_adder.make_race_cvap_gdf("HI", selector=honolulu)
+
+This module has three functions that readers use.
+
+    First, selector_prefixes returns the short GEOID prefixes a selector
+    picks out of a state, which csv scans filter on and which csv
+    indexes turn into byte ranges of single counties.
+
+    selector_prefixes({"counties": ["009"]}, "15")
+
+    Second, tiger_read_options returns the where clause, bbox and mask
+    for reading a TIGER shapefile, so that OGR skips every other block
+    group.
+
+    Third, select_prefixes cuts the rows of prefixes out of any frame
+    sorted by GEOID_KEY, e.g. a state read from cache.
+
+Notes
+-----
+A selector's keys are
+
+geoids
+    Short GEOID prefixes, from a State FIPS of two digits to a whole
+    block group of twelve, e.g. "15001" for a county.
+counties
+    Three-digit County FIPS codes within the state.
+bbox
+    Bounds (minx, miny, maxx, maxy) in the longitude and latitude of
+    TIGER, NAD83.
+mask
+    A shapely geometry in the same coordinates.
+
+GEOIDs and counties together select their union. A bbox or mask then
+keeps only the block groups intersecting it. Csv's carry no geometry,
+so a bbox or mask is first resolved into GEOIDs by reading TIGER within
+it, see resolve_selector.
+
+Tracts and counties rolled up from a selection add up only the block
+groups selected.
+"""
+import numpy as np
+import pandas as pd
+import shapely
+
+# To make work in project or editor namespace
+try: from geoid import state_key_range
+except: from tools.geoid import state_key_range
+
+
+SELECTOR_KEYS = ("geoids", "counties", "bbox", "mask")
+
+def check_selector(selector: dict):
+    """
+    Raises ValueError if a selector has unknown keys or malformed
+    values.
+    """
+    unknown = set(selector) - set(SELECTOR_KEYS)
+    if unknown:
+        raise ValueError(f"Selector keys must be among {SELECTOR_KEYS}, " + \
+                         f"not {sorted(unknown)}.")
+    for geoid in selector.get("geoids") or []:
+        if not (geoid.isdigit() and 2 <= len(geoid) <= 12):
+            raise ValueError(f"GEOID prefix {geoid} must be 2 to 12 digits.")
+    for county in selector.get("counties") or []:
+        if not (county.isdigit() and len(county) == 3):
+            raise ValueError(f"County FIPS {county} must be three digits.")
+    if selector.get("bbox") is not None and len(selector["bbox"]) != 4:
+        raise ValueError("A bbox must be (minx, miny, maxx, maxy).")
+
+def is_spatial(selector: dict) -> bool:
+    """
+    Returns whether a selector has a bbox or mask.
+    """
+    return bool(selector) and (selector.get("bbox") is not None or
+                               selector.get("mask") is not None)
+
+def selector_prefixes(selector: dict, state_fips: str) -> list:
+    """
+    Returns the short GEOID prefixes a selector picks out of a state,
+    none nested in another, or None to keep the whole state.
+
+    Parameters
+    ----------
+    selector: dict
+        Selector, see Notes of this module. Its bbox or mask is ignored.
+    state_fips: str
+        Two-digit State FIPS code, e.g. "15".
+
+    Returns
+    -------
+    list of str or None
+        Sorted prefixes, each starting with state_fips, which may be
+        none at all if the selector picks nothing of the state.
+
+    """
+    if not selector or (selector.get("geoids") is None and
+                        selector.get("counties") is None):
+        return None
+    check_selector(selector)
+    prefixes = [geoid for geoid in selector.get("geoids") or []
+                if geoid[:2] == state_fips]
+    prefixes += [state_fips + county
+                 for county in selector.get("counties") or []]
+
+    # A prefix within another adds nothing
+    kept = []
+    for prefix in sorted(set(prefixes)):
+        if not (kept and prefix.startswith(kept[-1])):
+            kept.append(prefix)
+    return kept
+
+def select_prefixes(frame: pd.DataFrame, prefixes: list) -> pd.DataFrame:
+    """
+    Returns the rows of a frame sorted by GEOID_KEY whose GEOIDs start
+    with any of the prefixes, or the whole frame for None.
+    """
+    if prefixes is None:
+        return frame
+    keys = frame["GEOID_KEY"].to_numpy()
+    rows = [np.arange(*np.searchsorted(keys, state_key_range(prefix)))
+            for prefix in prefixes]
+    rows = np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+    return frame.iloc[rows].reset_index(drop=True)
+
+def tiger_read_options(selector: dict, state_fips: str) -> dict:
+    """
+    Returns the where clause, bbox and mask with which to read only the
+    selected block groups of a TIGER shapefile.
+
+    Returns
+    -------
+    dict
+        Keyword arguments of geopandas.read_file, none if the selector
+        is empty.
+
+    """
+    if not selector:
+        return {}
+    check_selector(selector)
+    options = {}
+    prefixes = selector_prefixes(selector, state_fips)
+    if prefixes is not None:
+        # An impossible GEOID when nothing of the state is selected
+        options["where"] = " OR ".join(
+            f"GEOID LIKE '{prefix}%'" for prefix in prefixes) \
+            if prefixes else "GEOID = ''"
+    if selector.get("mask") is not None:
+        options["mask"] = selector["mask"]
+    elif selector.get("bbox") is not None:
+        options["bbox"] = tuple(selector["bbox"])
+    return options
+
+def select_intersecting(gdf, selector: dict):
+    """
+    Keeps the rows of a GeoDataFrame intersecting the selector's bbox or
+    mask, as a bbox read keeps any whose bounds do.
+    """
+    if not is_spatial(selector):
+        return gdf
+    area = selector["mask"] if selector.get("mask") is not None \
+           else shapely.box(*selector["bbox"])
+    return gdf[gdf.intersects(area)].reset_index(drop=True)
+
+def resolve_selector(state_abbr: str, selector: dict, \
+                     download_allowed: bool = False) -> dict:
+    """
+    Returns a selector with its bbox or mask resolved into the GEOIDs of
+    the block groups intersecting it, read from TIGER, for readers of
+    csv's without geometry.
+    """
+    if not is_spatial(selector):
+        return selector
+    # Only csv readers resolve, so TIGER is imported here
+    try: from tiger import get_tiger_attributes
+    except: from tools.tiger import get_tiger_attributes
+    geoids = get_tiger_attributes(state_abbr, download_allowed=download_allowed,
+                                  selector=selector)["GEOID"]
+    return {"geoids": geoids.astype(str).tolist()}
@@ -0,0 +1,351 @@
+"""
+Every notebook and script calling make_race_cvap_gdf reads the same
+csv's and shapefiles from cold, at tens of seconds a state. This module
+runs a long-lived local service that merges each state once, keeps it
+resident in memory and serves slices of it, by state, county or list of
+GEOIDs, in milliseconds.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, serve runs the service until interrupted, merging the given
+    states up front and any other state on its first request.
+
+    serve(["HI", "RI"])
+
+    or, on a Unix socket rather than a port,
+
+    serve(["HI", "RI"], unix_socket="/tmp/cvap.sock")
+
+    Second, fetch_race_cvap asks a running service for merged data and
+    returns it as a GeoDataFrame.
+
+    hi_gdf = fetch_race_cvap("/states/HI")
+    maui_gdf = fetch_race_cvap("/states/HI?counties=009")
+    bgs_gdf = fetch_race_cvap("/geoids?ids=150010201001,440010301001")
+
+    From any other client, e.g. with curl,
+
+    curl "localhost:8765/states/HI?format=parquet" -o HI.parquet
+    curl --unix-socket /tmp/cvap.sock "http://localhost/states/HI"
+
+Notes
+-----
+The service answers GET requests on these paths.
+
+/states/<abbr>
+    Every block group of a state, or with counties=001,003 only those
+    of the given counties.
+/geoids
+    Block groups of ids=<GEOID>,<GEOID>,..., from any states. GEOIDs not
+    found are counted in the X-Missing-GEOIDs header.
+/health
+    JSON listing the states held in memory.
+
+Each takes format=arrow, the default set with SERVICE_FORMAT in the
+settings, for an Arrow IPC stream with geometry as WKB, or
+format=parquet for GeoParquet, and level=block_group, tract or county.
+A request for an unknown state or format is answered with 400, and a
+state that fails to merge with 500.
+
+Each state and summary level is merged once, then held sorted by
+GEOID_KEY, so a county is one key range and a list of GEOIDs one
+binary search. Requests are handled each in its own thread, and a state
+is merged by whichever request asks first while the others wait for it.
+"""
+import io
+import json
+import os
+import threading
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import geopandas as gpd
+import us
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from rollup import SUMMARY_LEVELS
+except: from tools.rollup import SUMMARY_LEVELS
+
+try: from census_adder import make_race_cvap_gdf
+except: from tools.census_adder import make_race_cvap_gdf
+
+
+FORMATS = {"arrow": "application/vnd.apache.arrow.stream",
+           "parquet": "application/vnd.apache.parquet"}
+
+class ResidentTables:
+    """
+    Merged data of each state and summary level, merged once on first
+    use and held in memory.
+    """
+    def __init__(self, download_allowed: bool = False):
+        self.download_allowed = download_allowed
+        self.tables = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, state_abbr: str, summary_level: str = "block_group"):
+        """
+        Returns the merged data of a state, merging it if no other
+        request has yet.
+        """
+        key = (state_abbr, summary_level)
+        with self.lock:
+            if key in self.tables:
+                return self.tables[key]
+            state_lock = self.locks.setdefault(key, threading.Lock())
+        # Others asking for the same state wait here, not for all states
+        with state_lock:
+            if key not in self.tables:
+                table = make_race_cvap_gdf(state_abbr, self.download_allowed,
+                                           summary_level)
+                with self.lock:
+                    self.tables[key] = table
+        return self.tables[key]
+
+    def loaded(self) -> list:
+        """
+        Returns the states and summary levels held in memory.
+        """
+        with self.lock:
+            return [f"{state_abbr}:{summary_level}"
+                    for state_abbr, summary_level in sorted(self.tables)]
+
+def select_counties(table, counties: list, summary_level: str):
+    """
+    Returns the rows of a key-sorted table within the given counties,
+    each a five-digit State and County FIPS code.
+    """
+    keys = table["GEOID_KEY"].to_numpy()
+    scale = 10 ** (SUMMARY_LEVELS[summary_level] - 5)
+    rows = [np.arange(*np.searchsorted(keys, [int(county) * scale,
+                                              (int(county) + 1) * scale]))
+            for county in counties]
+    return table.iloc[np.concatenate(rows) if rows else []]
+
+def select_geoids(table, geoid_keys: np.ndarray):
+    """
+    Returns the rows of a key-sorted table with the given keys, and the
+    keys not found.
+    """
+    keys = table["GEOID_KEY"].to_numpy()
+    rows = np.searchsorted(keys, geoid_keys).clip(0, max(len(keys) - 1, 0))
+    found = (keys[rows] == geoid_keys) if len(keys) else \
+            np.zeros(len(geoid_keys), dtype=bool)
+    return table.iloc[rows[found]], geoid_keys[~found]
+
+def encode(gdf, fmt: str) -> bytes:
+    """
+    Returns a GeoDataFrame as an Arrow IPC stream or GeoParquet.
+    """
+    sink = io.BytesIO()
+    if fmt == "parquet":
+        gdf.to_parquet(sink, index=False)
+        return sink.getvalue()
+    table = pa.table(gdf.to_arrow(index=False, geometry_encoding="WKB"))
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+class RaceCvapHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET requests for merged data. See Notes of this module.
+    """
+    def address_string(self):
+        # Clients of Unix sockets have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format, *args):
+        if SET.SERVICE_LOG:
+            super().log_message(format, *args)
+
+    def reply(self, status: int, body: bytes, content_type: str, \
+              headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_error(self, status: int, message: str):
+        self.reply(status, json.dumps({"error": message}).encode(),
+                   "application/json")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values
+                 in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+        fmt = query.get("format", SET.SERVICE_FORMAT)
+        summary_level = query.get("level", "block_group")
+
+        if parts == ["health"]:
+            body = {"states": self.server.tables.loaded()}
+            return self.reply(200, json.dumps(body).encode(),
+                              "application/json")
+        if fmt not in FORMATS:
+            return self.reply_error(400, f"Format must be one of " + \
+                                         f"{list(FORMATS)}, not {fmt}.")
+        if summary_level not in SUMMARY_LEVELS:
+            return self.reply_error(400, f"Level must be one of " + \
+                                         f"{list(SUMMARY_LEVELS)}, not " + \
+                                         f"{summary_level}.")
+
+        headers = {}
+        try:
+            if len(parts) == 2 and parts[0] == "states":
+                state = us.states.lookup(parts[1])
+                if state is None:
+                    return self.reply_error(400, f"{parts[1]} is not a " + \
+                                                 "state or territory.")
+                result = self.server.tables.get(state.abbr, summary_level)
+                if query.get("counties"):
+                    counties = [county for county
+                                in query["counties"].split(",") if county]
+                    if not all(county.isdigit() and len(county) == 3
+                               for county in counties):
+                        return self.reply_error(400, "Counties must be " + \
+                                                     "three digits.")
+                    counties = [state.fips + county for county in counties]
+                    result = select_counties(result, counties, summary_level)
+            elif parts == ["geoids"]:
+                geoids = [geoid for geoid in query.get("ids", "").split(",")
+                          if geoid]
+                if not all(geoid.isdigit() for geoid in geoids):
+                    return self.reply_error(400, "GEOIDs must be digits.")
+                # Each state's GEOIDs are looked up in its own table
+                selected = []
+                missing = 0
+                for state_fips in sorted({geoid[:2] for geoid in geoids}):
+                    state = us.states.lookup(state_fips)
+                    state_keys = np.array(sorted(int(geoid) for geoid in
+                                                 geoids if geoid[:2] ==
+                                                 state_fips),
+                                          dtype=np.int64)
+                    if state is None:
+                        missing += len(state_keys)
+                        continue
+                    found, not_found = select_geoids(
+                        self.server.tables.get(state.abbr, summary_level),
+                        state_keys)
+                    selected.append(found)
+                    missing += len(not_found)
+                if not selected:
+                    return self.reply_error(400, "No GEOIDs of any state.")
+                result = gpd.GeoDataFrame(
+                    pd.concat(selected, ignore_index=True),
+                    crs=selected[0].crs)
+                headers["X-Missing-GEOIDs"] = str(missing)
+            else:
+                return self.reply_error(404, f"No such path {url.path}.")
+            body = encode(result, fmt)
+        except Exception as error:
+            return self.reply_error(500, f"{type(error).__name__}: {error}")
+        self.reply(200, body, FORMATS[fmt], headers)
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """
+    HTTP server on a Unix socket, each request in its own thread.
+    """
+    daemon_threads = True
+
+def make_server(states: list = None, host: str = "", port: int = None, \
+                unix_socket: str = "", download_allowed: bool = False):
+    """
+    Returns a service, with the given states already merged, ready to
+    serve_forever.
+
+    Parameters
+    ----------
+    states: list of str
+        Two-letter state abbreviations to merge up front. Others are
+        merged on first request.
+    host: str
+        Address to listen on. Defaults to SERVICE_HOST in settings.
+    port: int
+        Port to listen on. Defaults to SERVICE_PORT in settings.
+    unix_socket: str
+        Filename of a Unix socket to listen on instead of a port.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+
+    Returns
+    -------
+    socketserver.BaseServer
+        The service, with its ResidentTables as tables.
+
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, RaceCvapHandler)
+    else:
+        server = ThreadingHTTPServer(
+            (host if host else SET.SERVICE_HOST,
+             SET.SERVICE_PORT if port is None else port),
+            RaceCvapHandler)
+        server.daemon_threads = True
+    server.tables = ResidentTables(download_allowed)
+    for state_abbr in states or []:
+        print(f"Loading {state_abbr}...")
+        server.tables.get(state_abbr)
+    return server
+
+def serve(states: list = None, host: str = "", port: int = None, \
+          unix_socket: str = "", download_allowed: bool = False):
+    """
+    Runs the service until interrupted. See make_server.
+    """
+    server = make_server(states, host, port, unix_socket, download_allowed)
+    address = unix_socket if unix_socket else \
+              "http://{}:{}".format(*server.server_address[:2])
+    print(f"Serving merged CVAP and ACS Race data on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+def fetch_race_cvap(path: str, host: str = "", port: int = None):
+    """
+    Returns merged data from a running service as a GeoDataFrame.
+
+    Parameters
+    ----------
+    path: str
+        Path and query of the request, e.g. "/states/HI?counties=009".
+    host: str
+        Address of the service. Defaults to SERVICE_HOST in settings.
+    port: int
+        Port of the service. Defaults to SERVICE_PORT in settings.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        Merged block groups, or tracts or counties.
+
+    """
+    url = "http://{}:{}{}".format(host if host else SET.SERVICE_HOST,
+                                  SET.SERVICE_PORT if port is None else port,
+                                  path)
+    with urllib.request.urlopen(url) as response:
+        body = response.read()
+        content_type = response.headers["Content-Type"]
+    if content_type == FORMATS["parquet"]:
+        return gpd.read_parquet(io.BytesIO(body))
+    return gpd.GeoDataFrame.from_arrow(pa.ipc.open_stream(body).read_all())
@@ -47,6 +47,56 @@ LOCAL_DATA_FOLDER = "./data/"
 DEFAULT_OUPUT_FOLDER = LOCAL_DATA_FOLDER + "cvap_acs_output/"
 DEFAULT_OUTPUT = "cvap_acs"
 
+# One GeoParquet dataset for the whole nation, partitioned by state,
+# e.g. data/cvap_acs_output/national_cvap_acs/STATEFP=15/part-0.parquet
+NATIONAL_OUTPUT = "national_cvap_acs"
+NATIONAL_MANIFEST = "_manifest.json"
+# Nodes building the national dataset in shards coordinate through files
+# in this folder of it. See shards.py.
+SHARDS_FOLDER = "_shards"
+
+# Merged output is checked against invariants such as race categories
+# adding up to TOTPOP. Strict validation fails the build on any failed
+# check. See validate.py.
+VALIDATION_STRICT = False
+VALIDATION_EXAMPLES = 20
+VALIDATION_SUFFIX = "_validation.json"
+
+# Journal of batch runs over many states, to resume from. See batch.py.
+BATCH_JOURNAL = DEFAULT_OUPUT_FOLDER + "_batch_journal.json"
+
+# Workers of each pool of the stage scheduler. See scheduler.py.
+SCHEDULER_POOLS = {"network": 8, "cpu": 4, "disk": 2}
+
+# Local service holding merged states in memory. See service.py.
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_FORMAT = "arrow"
+SERVICE_LOG = False
+
+# Batch runs given a memory budget start each state once its estimated
+# peak memory fits. Peaks, in megabytes, are estimated from block groups
+# and megabytes of shapefile and csv rows, with MEMORY_MODEL until the
+# journal holds MEMORY_MIN_SAMPLES measured states. A budget of None is
+# 80% of physical memory. See memory.py.
+MEMORY_BUDGET_MB = None
+MEMORY_MODEL = {"intercept": 400.0, "block_groups": 0.05,
+                "shp_mb": 6.0, "csv_mb": 8.0}
+MEMORY_MIN_SAMPLES = 5
+MEMORY_SAFETY = 1.25
+
+# National csv's are read in chunks under this memory ceiling, in
+# megabytes, when low memory mode is on. See ingest.py.
+LOW_MEMORY = False
+MEMORY_CEILING_MB = 256
+
+# Single states are read from national csv's through a sidecar index of
+# byte ranges, e.g. BlockGr.csv.idx.json. See csv_index.py. Off in low
+# memory mode, which takes precedence, as building the index scans the
+# whole csv without regard to the memory ceiling.
+CSV_INDEX = False
+CSV_INDEX_SUFFIX = ".idx.json"
+
 ##### Census CVAP Data, 2015-2019 Estimates, Released Feb. 2021 #####
 
 # Settings for 2019 Census CVAP Data
@@ -99,6 +149,62 @@ TIGER_BG_URL = TIGER_URL + "TIGER2019/BG/"
 TIGER_PREFIX = "tl_2019_"
 BG_POSTFIX = "_bg"
 
+# TIGER attributes kept by the tabular build, which reads no geometry.
+# See make_race_cvap_df in census_adder.py.
+TABULAR_TIGER_COLUMNS = ["ALAND", "AWATER"]
+
+# Simplified tiers of TIGER geometry for web maps, tolerance in degrees,
+# cached next to each shapefile. See simplify.py.
+# e.g. data/Tiger19_bgs/tl_2019_15_bg/tl_2019_15_bg_simplified_0.001.parquet
+SIMPLIFY_TOLERANCES = [1e-4, 1e-3]
+SIMPLIFIED_SUFFIX = "_simplified_"
+
+# Mapbox Vector Tile pyramids cut from merged output. See tiles.py.
+# e.g. data/cvap_acs_output/HI_cvap_acs/HI_cvap_acs.mbtiles
+TILE_MINZOOM = 4
+TILE_MAXZOOM = 12
+TILE_LAYER = "block_groups"
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_BATCH_SIZE = 256
+
+# TopoJSON output with shared arcs, on a grid of this many steps across
+# each state. See topology.py.
+TOPOJSON_QUANTIZATION = 100000
+TOPOJSON_OBJECT = "block_groups"
+
+# Dual graphs for GerryChain, with adjacency cached by geometry hash.
+# See graph.py. e.g. data/Graphs19_bgs/rook_3f5a...e1.npz
+GRAPH_FOLDER = LOCAL_DATA_FOLDER + "Graphs19_bgs/"
+GRAPH_ADJACENCY = "rook"
+
+# Geocoded points looked up in block groups, with a packed spatial index
+# cached next to each shapefile. See point_lookup.py.
+# e.g. data/Tiger19_bgs/tl_2019_15_bg/tl_2019_15_bg_points.npz
+POINT_X_COLUMN = "longitude"
+POINT_Y_COLUMN = "latitude"
+POINT_CHUNK_ROWS = 250000
+
+# Block weights to carry block group counts down to 2010 blocks, as in
+# TIGER 2010 tabblock2010_15_pophu. See disaggregate.py.
+BLOCK_GEOID_COLUMN = "BLOCKID10"
+BLOCK_WEIGHT_COLUMN = "POP10"
+
+# Census relationship files of 2010 to 2020 blocks, and the conversion
+# matrices built from them, one per state. See crosswalk.py.
+# e.g. https://www2.census.gov/geo/docs/maps-data/data/rel2020/t10t20/
+#   TAB2010_TAB2020_ST15.zip
+CROSSWALK_URL = CENSUS_URL + "geo/docs/maps-data/data/rel2020/t10t20/"
+CROSSWALK_PREFIX = "TAB2010_TAB2020_ST"
+CROSSWALK_FOLDER = LOCAL_DATA_FOLDER + "Crosswalk10_20/"
+
+# Counties renamed between the 2010 Census and 2019 TIGER, old to new
+COUNTY_RECODES = {
+    "02270": "02158", # Wade Hampton to Kusilvak Census Area, AK
+    "46113": "46102", # Shannon to Oglala Lakota County, SD
+    "51515": "51019", # Bedford city into Bedford County, VA
+}
+
 
 ##### Census ACS Data on Race and Origin, 2019 5-Y Estimates #####
 
@@ -133,7 +239,7 @@ from nhgis import get_nhgis_race_bgs as get_race_origin_bgs
 
 """
 
-# Currently NHGIS or CensusAPI
+# Currently NHGIS, CensusAPI or SummaryFile
 ACS_PLUGIN = "CensusAPI"
 
 # Settings for using NHGIS Data for ACS. Must be downloaded manually
@@ -173,6 +279,26 @@ LOCAL_CENSUS_FOLDER = LOCAL_DATA_FOLDER + "ACS5Y2019Race/"
 LOCAL_CENSUS_SUFFIX = "_race_origin_bg"
 CENSUS_BATCH_SIZE = 50
 
+# Settings for using the bulk, table-based ACS 5Y Summary File, with
+# one pipe-delimited .dat file per table for the whole nation. Must be
+# downloaded manually from
+# https://www2.census.gov/programs-surveys/acs/summary_file/
+# The year must match the TIGER files above, or reading raises. For more
+# information, see acs_summary_file.py docs.
+#
+# mggg-tools/
+# ├── data/
+# │   ├── ACS5YSummaryFile/
+# |   |   ├── acsdt5y2019-b03002.dat
+# |   |   ├── cache/
+# |   |   |   ├── b03002/
+# |   |   |   |   ├── STATEFP=01.parquet
+# │   |   |   |   └── ...
+
+SUMMARY_FILE_PREFIX = "acsdt5y2019-"
+LOCAL_SUMMARY_FILE_FOLDER = LOCAL_DATA_FOLDER + "ACS5YSummaryFile/"
+SUMMARY_FILE_CACHE = LOCAL_SUMMARY_FILE_FOLDER + "cache/"
+
 ##### MGGG naming convention from @mggg/mggg-states-qa #####
 
 # More categories in original file "naming_convention.json" found in
@@ -248,5 +374,8 @@ NAME_CONVENTION = {
     "OTHERCVAP":
         "Voting age population, citizen, other race, non-Hispanic",
     "2MORECVAP":
-        "Voting age population, citizen, two or more races, non-Hispanic"
+        "Voting age population, citizen, two or more races, non-Hispanic",
+
+    "CPOP":
+        "Total population, citizen"
 }
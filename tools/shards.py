@@ -0,0 +1,355 @@
+"""
+Rebuilding every state at once is more than one machine can do in good
+time. This module splits the national GeoParquet build into shards, one
+for each node, that share nothing but a folder. Each node runs its own
+shard and a final gather step checks that every shard is done before
+committing the national manifest.
+
+Examples
+--------
+This module has three functions, each run in its own place.
+
+    First, plan_shards deterministically assigns states, or counties,
+    to shards, weighed by their number of block groups. Every node
+    arrives at the same plan on its own.
+
+    plan = plan_shards(shard_count=8)
+
+    Second, each node runs its shard, here the third of eight, writing
+    its partitions to the shared dataset folder.
+
+    run_shard(2, 8)
+
+    Third, once every node is done, any one of them gathers the shards,
+    checks that every unit of work is written and commits the manifest.
+
+    manifest_file = gather_shards()
+
+    On a single machine, e.g. for tests, the shards may simply be run
+    one after another.
+
+Notes
+-----
+Units of work are whole states, or with unit="county", single counties,
+so that large states like California spread over many nodes. Each is
+weighed by its number of block groups, read from the record count in
+the header of the TIGER .dbf, or from the COUNTYFP column of it.
+
+Shards are filled by longest processing time first. Units are taken
+heaviest first, ties broken by name, and each goes to the lightest
+shard so far, ties broken by shard number. The same units and shard
+count always give the same plan.
+
+Nodes coordinate only through files in the dataset's _shards folder,
+each written whole and then moved into place.
+
+plan.json
+    The plan, written by whichever node plans first and read by the
+    rest.
+shard-0002-of-0008.json
+    Written by a shard once it is done, listing its partitions and any
+    units that failed.
+"""
+import os
+import json
+import struct
+
+import us
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from tiger import check_download_tiger_file, get_tiger_attributes
+except: from tools.tiger import check_download_tiger_file, \
+                                get_tiger_attributes
+
+try: from census_adder import write_state_partition, \
+                              write_county_partitions, \
+                              commit_national_manifest
+except: from tools.census_adder import write_state_partition, \
+                                       write_county_partitions, \
+                                       commit_national_manifest
+
+
+UNITS = ("state", "county")
+
+def dbf_record_count(shp_filename: str) -> int:
+    """
+    Returns the number of records of a shapefile, read from the header
+    of its .dbf without reading any record.
+    """
+    with open(os.path.splitext(shp_filename)[0] + ".dbf", "rb") as dbf:
+        return struct.unpack("<I", dbf.read(8)[4:8])[0]
+
+def weigh_units(state_abbrs: list, unit: str = "state", \
+                download_allowed: bool = False) -> list:
+    """
+    Returns every unit of work with its number of block groups.
+
+    Parameters
+    ----------
+    state_abbrs: list of str
+        Two-letter state abbreviations to include.
+    unit: str
+        "state" or "county".
+    download_allowed : bool
+        Flag as to whether to download missing TIGER files or raise
+        error.
+
+    Returns
+    -------
+    list of dict
+        Name, e.g. "HI" or "HI:007", state, county and weight of each
+        unit.
+
+    """
+    if unit not in UNITS:
+        raise ValueError(f"Unit must be one of {UNITS}, not {unit}.")
+    units = []
+    for state_abbr in state_abbrs:
+        if unit == "state":
+            tiger_file = check_download_tiger_file(state_abbr,
+                                                   download_allowed)
+            units.append({"name": state_abbr, "state": state_abbr,
+                          "county": None,
+                          "weight": dbf_record_count(tiger_file)})
+            continue
+        county_counts = get_tiger_attributes(
+            state_abbr, ["COUNTYFP"], download_allowed)["COUNTYFP"] \
+            .value_counts().sort_index()
+        units += [{"name": f"{state_abbr}:{county}", "state": state_abbr,
+                   "county": county, "weight": int(count)}
+                  for county, count in county_counts.items()]
+    return units
+
+def assign_shards(units: list, shard_count: int) -> list:
+    """
+    Assigns units to shards, heaviest first, each to the lightest shard.
+
+    Returns
+    -------
+    list of list of dict
+        Units of each shard.
+
+    """
+    shards = [[] for _ in range(shard_count)]
+    loads = [0] * shard_count
+    for unit in sorted(units, key=lambda unit: (-unit["weight"],
+                                                unit["name"])):
+        lightest = min(range(shard_count), key=lambda i: (loads[i], i))
+        shards[lightest].append(unit)
+        loads[lightest] += unit["weight"]
+    return shards
+
+def shards_folder(dataset_root: str) -> str:
+    """
+    Returns the folder of shard files of a dataset.
+    """
+    return os.path.join(dataset_root, SET.SHARDS_FOLDER)
+
+def write_json(content: dict, filename: str):
+    """
+    Writes JSON whole, then moves it into place.
+    """
+    with open(filename + f".tmp{os.getpid()}", "w") as tmp_file:
+        json.dump(content, tmp_file, indent=2)
+    os.replace(filename + f".tmp{os.getpid()}", filename)
+
+def plan_shards(shard_count: int, state_abbrs: list = None, \
+                unit: str = "state", output: str = "", \
+                download_allowed: bool = False) -> dict:
+    """
+    Returns the plan of which units of work each shard does, reading it
+    if another node planned first, or else planning and writing it.
+
+    Parameters
+    ----------
+    shard_count: int
+        Number of shards.
+    state_abbrs: list of str
+        Two-letter state abbreviations to include. Defaults to all
+        states plus DC and Puerto Rico.
+    unit: str
+        "state" or "county".
+    output: str
+        Folder for the dataset, shared by every node. Default, set in
+        settings.
+    download_allowed : bool
+        Flag as to whether to download missing TIGER files or raise
+        error.
+
+    Returns
+    -------
+    dict
+        Plan, with the shard count, unit, and units of every shard.
+
+    Raises
+    ------
+    ValueError
+        If a plan already written was made for other shards or states.
+
+    """
+    if not state_abbrs:
+        state_abbrs = [state.abbr for state in
+                       us.states.STATES + [us.states.DC, us.states.PR]]
+    dataset_root = output if output else \
+                   SET.DEFAULT_OUPUT_FOLDER + SET.NATIONAL_OUTPUT + "/"
+    folder = shards_folder(dataset_root)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    plan_file = os.path.join(folder, "plan.json")
+    if os.path.isfile(plan_file):
+        with open(plan_file) as plan_json:
+            plan = json.load(plan_json)
+        if (plan["shard_count"], plan["unit"], plan["states"]) != \
+           (shard_count, unit, sorted(state_abbrs)):
+            raise ValueError(f"{plan_file} was planned for other shards " + \
+                             "or states. Remove it to plan anew.")
+        return plan
+
+    units = weigh_units(sorted(state_abbrs), unit, download_allowed)
+    plan = {
+        "shard_count": shard_count,
+        "unit": unit,
+        "states": sorted(state_abbrs),
+        "shards": assign_shards(units, shard_count),
+    }
+    write_json(plan, plan_file)
+    return plan
+
+def run_shard(shard_index: int, shard_count: int, \
+              state_abbrs: list = None, unit: str = "state", \
+              output: str = "", download_allowed: bool = False) -> str:
+    """
+    Writes the partitions of every unit of work of one shard to the
+    shared dataset, then records the shard as done.
+
+    A unit that fails is recorded and the shard moves on to the next.
+
+    Parameters
+    ----------
+    shard_index: int
+        Number of this shard, from 0 to shard_count - 1.
+    shard_count: int
+        Number of shards.
+    state_abbrs: list of str
+        Two-letter state abbreviations to include. Defaults to all
+        states plus DC and Puerto Rico.
+    unit: str
+        "state" or "county".
+    output: str
+        Folder for the dataset, shared by every node. Default, set in
+        settings.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+
+    Returns
+    -------
+    str
+        Filename of the shard's record.
+
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard {shard_index} is not among " + \
+                         f"{shard_count} shards.")
+    dataset_root = output if output else \
+                   SET.DEFAULT_OUPUT_FOLDER + SET.NATIONAL_OUTPUT + "/"
+    plan = plan_shards(shard_count, state_abbrs, unit, dataset_root,
+                       download_allowed)
+    units = plan["shards"][shard_index]
+
+    # Counties of one state are written together, reading the state once
+    by_state = {}
+    for work in units:
+        by_state.setdefault(work["state"], []).append(work)
+
+    partitions = []
+    failed = {}
+    for state_abbr, works in by_state.items():
+        try:
+            if plan["unit"] == "state":
+                partitions.append(write_state_partition(
+                    state_abbr, dataset_root,
+                    download_allowed=download_allowed))
+            else:
+                partitions += write_county_partitions(
+                    state_abbr, [work["county"] for work in works],
+                    dataset_root, download_allowed)
+        except Exception as err:
+            print(f"Unable to write partition for {state_abbr}")
+            for work in works:
+                failed[work["name"]] = repr(err)
+
+    shard_file = os.path.join(
+        shards_folder(dataset_root),
+        f"shard-{shard_index:04d}-of-{shard_count:04d}.json")
+    write_json({"shard": shard_index,
+                "units": [work["name"] for work in units],
+                "partitions": partitions,
+                "failed": failed}, shard_file)
+    return shard_file
+
+def gather_shards(output: str = "") -> str:
+    """
+    Checks that every shard of the plan is done and every unit of work
+    written, then commits the national manifest.
+
+    Parameters
+    ----------
+    output: str
+        Folder for the dataset, shared by every node. Default, set in
+        settings.
+
+    Returns
+    -------
+    str
+        Filepath of the committed manifest.
+
+    Raises
+    ------
+    RuntimeError
+        If any shard is not done, or any unit failed or is missing its
+        files. No manifest is committed.
+
+    """
+    dataset_root = output if output else \
+                   SET.DEFAULT_OUPUT_FOLDER + SET.NATIONAL_OUTPUT + "/"
+    folder = shards_folder(dataset_root)
+    with open(os.path.join(folder, "plan.json")) as plan_json:
+        plan = json.load(plan_json)
+    shard_count = plan["shard_count"]
+
+    partitions = []
+    failed = {}
+    missing_shards = []
+    for shard_index in range(shard_count):
+        shard_file = os.path.join(
+            folder, f"shard-{shard_index:04d}-of-{shard_count:04d}.json")
+        if not os.path.isfile(shard_file):
+            missing_shards.append(shard_index)
+            continue
+        with open(shard_file) as shard_json:
+            shard = json.load(shard_json)
+        partitions += shard["partitions"]
+        failed.update(shard["failed"])
+
+    # Every planned unit must be written, with all of its files there
+    written = {entry["state"] if plan["unit"] == "state"
+               else f"{entry['state']}:{entry['county']}"
+               for entry in partitions
+               if all(os.path.isfile(os.path.join(dataset_root, file))
+                      for file in entry["files"])}
+    missing_units = sorted(work["name"] for works in plan["shards"]
+                           for work in works if work["name"] not in written)
+
+    if missing_shards or missing_units:
+        raise RuntimeError(f"Shards not done: {missing_shards}. " + \
+                           f"Units failed or missing: {missing_units}. " + \
+                           f"Failures: {failed}")
+
+    partitioning = ["STATEFP"] if plan["unit"] == "state" \
+                   else ["STATEFP", "COUNTYFP"]
+    return commit_national_manifest(dataset_root, partitions,
+                                    partitioning, failed)
@@ -0,0 +1,162 @@
+"""
+Full resolution TIGER geometry is far more than web maps like Districtr
+need. This module simplifies the block groups of a state into tiers of
+coarser geometry, computed once and cached alongside the TIGER
+shapefile itself.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, get_simplified_tiger_bgs returns the block groups of a state
+    simplified to a given tolerance, in degrees, reading the tier from
+    cache if it was made before.
+
+    hi_bgs = get_simplified_tiger_bgs("HI", 1e-3)
+
+    Second, get_simplified_tiers does the same for several tolerances
+    at once, by default those listed in the settings.
+
+    hi_tiers = get_simplified_tiers("HI")
+    hi_tiers[1e-4].plot()
+
+Notes
+-----
+Neighboring block groups share their boundaries. Simplifying each
+polygon on its own would simplify each shared boundary twice, in two
+different ways, and open gaps and overlaps between neighbors.
+
+Instead, the whole state is simplified as one coverage with shapely's
+coverage_simplify. Every shared edge, or arc, is simplified once and
+used by both neighbors, so the tiers stay free of gaps.
+
+TIGER block groups come in NAD83, EPSG:4269, so tolerances are given in
+degrees. 1e-4 degrees is roughly ten meters.
+
+Each tier is cached as GeoParquet next to its TIGER shapefile, e.g.
+
+    data/Tiger19_bgs/tl_2019_15_bg/tl_2019_15_bg_simplified_0.001.parquet
+
+Requires shapely 2.1 or later for coverage_simplify.
+"""
+import os
+import threading
+
+import geopandas as gpd
+import shapely
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from tiger import check_download_tiger_file, get_tiger_bgs
+except: from tools.tiger import check_download_tiger_file, get_tiger_bgs
+
+try: from schema import conform_to_schema
+except: from tools.schema import conform_to_schema
+
+
+def simplified_tiger_filename(state_abbr: str, tolerance: float,
+                              download_allowed: bool = False) -> str:
+    """
+    Returns the cache filename of a simplified tier, found next to the
+    state's TIGER shapefile.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    tolerance: float
+        Simplification tolerance in degrees.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+
+    Returns
+    -------
+    str
+        Filename, e.g. ".../tl_2019_15_bg_simplified_0.001.parquet"
+
+    """
+    tiger_file = check_download_tiger_file(state_abbr, download_allowed)
+    return (os.path.splitext(tiger_file)[0] +
+            f"{SET.SIMPLIFIED_SUFFIX}{tolerance:g}.parquet")
+
+def get_simplified_tiers(state_abbr: str, tolerances: list = None,
+                         download_allowed: bool = False) -> dict:
+    """
+    Returns the block groups of a state simplified to each of several
+    tolerances.
+
+    Tiers not found in cache are all computed from a single read of the
+    full resolution TIGER geometry and then cached.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    tolerances: list of float
+        Simplification tolerances in degrees. Defaults to
+        SIMPLIFY_TOLERANCES in settings.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    dict of float to geopandas.GeoDataFrame
+        For each tolerance, GeoDataFrame of GEOID, GEOID_KEY and
+        simplified geometry, sorted by GEOID_KEY.
+
+    """
+    if tolerances is None:
+        tolerances = SET.SIMPLIFY_TOLERANCES
+
+    tiers = {}
+    tiger_bgs = None
+    for tolerance in tolerances:
+        filename = simplified_tiger_filename(state_abbr, tolerance,
+                                             download_allowed)
+        if os.path.isfile(filename):
+            tiers[tolerance] = conform_to_schema(gpd.read_parquet(filename))
+            continue
+
+        # Read full resolution geometry once for every missing tier
+        if tiger_bgs is None:
+            tiger_bgs = get_tiger_bgs(state_abbr, download_allowed)
+        simplified = shapely.coverage_simplify(
+            tiger_bgs.geometry.to_numpy(), tolerance)
+        tier = tiger_bgs.set_geometry(
+            gpd.GeoSeries(simplified, crs=tiger_bgs.crs))
+
+        # Write whole then move into place, as other runs may be reading
+        tmp_file = f"{filename}.tmp{os.getpid()}-{threading.get_ident()}"
+        tier.to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, filename)
+        tiers[tolerance] = tier
+    return tiers
+
+def get_simplified_tiger_bgs(state_abbr: str, tolerance: float,
+                             download_allowed: bool = False):
+    """
+    Returns the block groups of a state simplified to one tolerance,
+    from cache if possible.
+
+    Parameters
+    ----------
+    state_abbr: str
+        Two-letter state abbreviation of target state.
+    tolerance: float
+        Simplification tolerance in degrees, e.g. 1e-3.
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        GeoDataFrame of GEOID, GEOID_KEY and simplified geometry,
+        sorted by GEOID_KEY.
+
+    """
+    return get_simplified_tiers(state_abbr, [tolerance],
+                                download_allowed)[tolerance]
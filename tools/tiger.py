@@ -34,6 +34,18 @@ This module has two functions that can be used separately.
     except:
         print("No Hawaii shapefile could be made")
 
+    Large states can be read one county at a time, and attributes can
+    be read without any geometry at all.
+
+    ca_geoids = get_tiger_attributes("CA")
+    alameda_bgs = get_tiger_bgs("CA", county_fips="001")
+
+    Any selection of GEOID prefixes, counties or a bbox is read alone,
+    filtered by OGR as the shapefile is read. See selection.py.
+
+    honolulu_bgs = get_tiger_bgs("HI", selector={"bbox": (-158.0, 21.25,
+                                                          -157.75, 21.4)})
+
 Notes
 -----
 Refactored by @gomotopia, May 2021, in debt to the original MGGG-Tooling 
@@ -99,6 +111,17 @@ import geopandas as gpd
 try: import settings as SET
 except: import tools.settings as SET
 
+try: from schema import conform_to_schema
+except: from tools.schema import conform_to_schema
+
+try: from geoid import attach_geoid_keys
+except: from tools.geoid import attach_geoid_keys
+
+try: from selection import tiger_read_options, select_intersecting, \
+                            is_spatial
+except: from tools.selection import tiger_read_options, \
+                                   select_intersecting, is_spatial
+
 import wget
 from zipfile import ZipFile
 
@@ -218,13 +241,58 @@ def check_download_tiger_file(state_abbrev: str,
     return f"{local_tiger_state_folder}{state_tiger_name}.shp" \
                 if state_shp_exists else ""
 
+def get_tiger_attributes(state_abbr: str, columns: list = None, \
+                         download_allowed: bool = False, \
+                         selector: dict = None):
+    """
+    Returns the attributes of a state's block groups as a pandas
+    DataFrame, reading only the columns asked for and no geometry.
+
+    Parameters
+    ----------
+    state_abbr : str
+        Relevant state for collecting TIGER block group shapefiles.
+
+    columns : list of str
+        TIGER columns to read besides GEOID, e.g. ["ALAND", "AWATER"].
+        Default of GEOID alone.
+
+    download_allowed : bool
+        Flag as to whether to download missing data or raise error.
+        Set to avoid downloading by default.
+
+    selector : dict
+        GEOID prefixes, counties, bbox or mask of the block groups to
+        read. Default of whole state. See selection.py.
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame with GEOID, GEOID_KEY and the asked for columns,
+        sorted by GEOID_KEY.
+
+    """
+    columns = ["GEOID"] + [col for col in (columns or []) if col != "GEOID"]
+    valid_tiger_file = check_download_tiger_file(state_abbr, download_allowed)
+    read_options = tiger_read_options(selector,
+                                      us.states.lookup(state_abbr).fips)
+    # Geometry is read only to find what intersects the bbox or mask
+    tiger_attributes = gpd.read_file(valid_tiger_file, columns=columns,
+                                     ignore_geometry=not is_spatial(selector),
+                                     **read_options)
+    tiger_attributes = select_intersecting(tiger_attributes, selector)
+    return conform_to_schema(attach_geoid_keys(tiger_attributes[columns]))
+
 def get_tiger_bgs(state_abbr: str, \
-                    download_allowed: bool = False) -> gpd.geodataframe:
+                    download_allowed: bool = False, \
+                    county_fips: str = "", \
+                    selector: dict = None) -> gpd.geodataframe:
     """
     Returns the block groups of a given state or states as a geopandas
     Geo DataFrame.
 
-    Option to check if data is downloaded.
+    Option to check if data is downloaded. Option to read only the block
+    groups of one county, leaving the rest of the state on disk.
 
     Parameters
     ----------
@@ -235,11 +303,19 @@ def get_tiger_bgs(state_abbr: str, \
         Flag as to whether to download missing data or raise error.
         Set to avoid downloading by default.
 
+    county_fips : str
+        Three-digit County FIPS code, e.g. "007". Default of whole state.
+
+    selector : dict
+        GEOID prefixes, counties, bbox or mask of the block groups to
+        read, filtered by OGR as it reads. Default of whole state. See
+        selection.py.
+
     Returns
     -------
     geopandas.geoDataFrame or null
-        Returns geoDataFrame with only GEOID and geometry or null if 
-        none found.
+        Returns geoDataFrame with only GEOID, GEOID_KEY and geometry,
+        sorted by GEOID_KEY, or null if none found.
 
     Raises
     ------
@@ -261,7 +337,14 @@ def get_tiger_bgs(state_abbr: str, \
         raise
     else:
         try:
-            tiger_data = gpd.read_file(valid_tiger_file)
+            read_options = tiger_read_options(selector, state.fips)
+            if county_fips:
+                county_where = f"COUNTYFP = '{county_fips}'"
+                read_options["where"] = \
+                    f"({county_where}) AND ({read_options['where']})" \
+                    if "where" in read_options else county_where
+            tiger_data = select_intersecting(
+                gpd.read_file(valid_tiger_file, **read_options), selector)
         except Exception as read_error:
             print(f"Shapefile could not be read properly for {state.name}.")
             raise
@@ -273,4 +356,6 @@ def get_tiger_bgs(state_abbr: str, \
                 print("Columns could not be selected properly in " + \
                         f"{state.name} shapefile")
                 raise
+            # Parse GEOID keys once and sort by them for joining
+            tiger_data = conform_to_schema(attach_geoid_keys(tiger_data))
     return tiger_data
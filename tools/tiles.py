@@ -0,0 +1,289 @@
+"""
+We serve block group CVAP and Race/Origin layers as map tiles. This
+module cuts a merged GeoDataFrame straight into a pyramid of Mapbox
+Vector Tiles, either as one MBTiles file or as a folder of z/x/y.pbf
+files, with no external tiling tool.
+
+Examples
+--------
+This module has one function meant to be used on its own.
+
+    make_tile_pyramid cuts tiles for every zoom level from minzoom to
+    maxzoom across a pool of worker processes, keeping every column of
+    demographic data as feature properties.
+
+    hi_gdf = census_adder.make_race_cvap_gdf("HI")
+    make_tile_pyramid(hi_gdf, "hi_cvap_acs.mbtiles", minzoom=4, maxzoom=12)
+
+    An output not ending in .mbtiles is taken as a folder of tiles.
+
+    make_tile_pyramid(hi_gdf, "hi_tiles/", minzoom=4, maxzoom=12)
+
+    census_adder.make_race_cvap_tiles does both steps for a state.
+
+Notes
+-----
+Tiles follow the usual web map, or XYZ, scheme in Web Mercator,
+EPSG:3857. At zoom z the world is 2^z tiles wide, counted from the top
+left. MBTiles counts rows from the bottom instead, and stores each tile
+gzipped, as its specification asks.
+
+For each zoom, the whole coverage of block groups is simplified once to
+about a pixel, so that shared boundaries stay shared, just as in
+simplify.py. Features are then assigned to every tile their bounds
+touch, without looking at one tile at a time, and tiles are cut and
+encoded in batches by the worker processes.
+
+Requires mapbox_vector_tile for encoding and shapely 2.1 or later.
+"""
+import os
+import gzip
+import json
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+import mapbox_vector_tile
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from schema import to_output_dtypes
+except: from tools.schema import to_output_dtypes
+
+
+# Web Mercator spans this many meters from the origin to each edge
+HALF_WORLD = 20037508.342789244
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """
+    Returns the bounds of tile z/x/y in Web Mercator meters.
+
+    Returns
+    -------
+    tuple of float
+        minx, miny, maxx, maxy
+    """
+    size = 2 * HALF_WORLD / 2 ** z
+    minx = -HALF_WORLD + x * size
+    maxy = HALF_WORLD - y * size
+    return minx, maxy - size, minx + size, maxy
+
+def assign_tiles(geoms: np.ndarray, z: int) -> pd.DataFrame:
+    """
+    Assigns features to every tile at zoom z that their bounds touch.
+
+    Parameters
+    ----------
+    geoms: numpy.ndarray
+        Shapely geometries in Web Mercator.
+    z: int
+        Zoom level.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row for each tile and feature, with columns x, y and
+        feature, sorted by tile.
+
+    """
+    size = 2 * HALF_WORLD / 2 ** z
+    last = 2 ** z - 1
+    bounds = shapely.bounds(geoms)
+    x0 = np.clip((bounds[:, 0] + HALF_WORLD) // size, 0, last).astype(np.int64)
+    x1 = np.clip((bounds[:, 2] + HALF_WORLD) // size, 0, last).astype(np.int64)
+    y0 = np.clip((HALF_WORLD - bounds[:, 3]) // size, 0, last).astype(np.int64)
+    y1 = np.clip((HALF_WORLD - bounds[:, 1]) // size, 0, last).astype(np.int64)
+
+    # Expand each feature's block of tiles into rows
+    widths = x1 - x0 + 1
+    counts = widths * (y1 - y0 + 1)
+    feature = np.repeat(np.arange(len(geoms)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                 counts)
+    assigned = pd.DataFrame({
+        "x": x0[feature] + offset % widths[feature],
+        "y": y0[feature] + offset // widths[feature],
+        "feature": feature,
+    })
+    return assigned.sort_values(["x", "y"], kind="stable")
+
+def render_tiles(z: int, tiles: list, geoms: dict, properties: dict,
+                 layer_name: str, extent: int, buffer: int) -> list:
+    """
+    Clips and encodes a batch of tiles at zoom z. Run by each worker.
+
+    Parameters
+    ----------
+    z: int
+        Zoom level.
+    tiles: list of tuple
+        x, y and list of feature ids of each tile.
+    geoms: dict
+        WKB of each feature in Web Mercator, by feature id.
+    properties: dict
+        Properties of each feature, by feature id.
+    layer_name: str
+        Name of the vector tile layer.
+    extent: int
+        Size of a tile in its own integer coordinates, usually 4096.
+    buffer: int
+        Margin around each tile, in tile coordinates, that features
+        are kept in to avoid seams when rendered.
+
+    Returns
+    -------
+    list of tuple
+        z, x, y and encoded tile of each non-empty tile.
+
+    """
+    encoded = []
+    for x, y, feature_ids in tiles:
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        margin = (maxx - minx) * buffer / extent
+        features = []
+        for feature_id in feature_ids:
+            clipped = shapely.clip_by_rect(
+                shapely.from_wkb(geoms[feature_id]),
+                minx - margin, miny - margin, maxx + margin, maxy + margin)
+            if not clipped.is_empty:
+                features.append({"geometry": clipped,
+                                 "properties": properties[feature_id]})
+        if not features:
+            continue
+        tile = mapbox_vector_tile.encode(
+            [{"name": layer_name, "features": features}],
+            default_options={"quantize_bounds": (minx, miny, maxx, maxy),
+                             "extents": extent})
+        encoded.append((z, x, y, tile))
+    return encoded
+
+def feature_properties(gdf) -> list:
+    """
+    Returns the demographic data of each feature as a dict, leaving out
+    missing values, which vector tiles cannot hold. Counts stay integers
+    even in columns that had to become floats to hold missing values.
+    """
+    data = to_output_dtypes(gdf.drop(columns=gdf.geometry.name))
+    records = data.to_dict("records")
+    return [{col: int(value) if isinstance(value, float) else value
+             for col, value in record.items() if not pd.isna(value)}
+            for record in records]
+
+def open_mbtiles(output: str, metadata: dict) -> sqlite3.Connection:
+    """
+    Creates a new MBTiles file and writes its metadata.
+    """
+    if os.path.isfile(output):
+        os.remove(output)
+    mbtiles = sqlite3.connect(output)
+    mbtiles.execute("CREATE TABLE metadata (name text, value text)")
+    mbtiles.execute("CREATE TABLE tiles (zoom_level integer, " +
+                    "tile_column integer, tile_row integer, tile_data blob)")
+    mbtiles.execute("CREATE UNIQUE INDEX tile_index ON tiles " +
+                    "(zoom_level, tile_column, tile_row)")
+    mbtiles.executemany("INSERT INTO metadata VALUES (?, ?)",
+                        [(name, str(value)) for name, value in metadata.items()])
+    return mbtiles
+
+def make_tile_pyramid(gdf, output: str, minzoom: int = None,
+                      maxzoom: int = None, jobs: int = None,
+                      layer_name: str = None) -> str:
+    """
+    Cuts a GeoDataFrame into a pyramid of Mapbox Vector Tiles, written
+    as an MBTiles file or a folder of z/x/y.pbf files.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        Block Groups with data, e.g. from make_race_cvap_gdf.
+    output: str
+        Filename ending in .mbtiles, or folder for .pbf tiles.
+    minzoom: int
+        Lowest zoom level to cut. Defaults to TILE_MINZOOM in settings.
+    maxzoom: int
+        Highest zoom level to cut. Defaults to TILE_MAXZOOM in settings.
+    jobs: int
+        Number of worker processes. Defaults to the number of CPUs.
+    layer_name: str
+        Name of the vector tile layer. Defaults to TILE_LAYER in
+        settings.
+
+    Returns
+    -------
+    str
+        The output filename or folder.
+
+    """
+    minzoom = SET.TILE_MINZOOM if minzoom is None else minzoom
+    maxzoom = SET.TILE_MAXZOOM if maxzoom is None else maxzoom
+    layer_name = layer_name if layer_name else SET.TILE_LAYER
+    as_mbtiles = output.endswith(".mbtiles")
+
+    properties = feature_properties(gdf)
+    mercator_geoms = gdf.geometry.to_crs(epsg=3857).to_numpy()
+
+    west, south, east, north = gdf.geometry.to_crs(epsg=4326).total_bounds
+    fields = {col: "String" if col == "GEOID" else "Number"
+              for col in gdf.columns
+              if col not in (gdf.geometry.name, "GEOID_KEY")}
+    metadata = {
+        "name": layer_name,
+        "format": "pbf",
+        "minzoom": minzoom,
+        "maxzoom": maxzoom,
+        "bounds": f"{west},{south},{east},{north}",
+        "center": f"{(west + east) / 2},{(south + north) / 2},{minzoom}",
+        "json": json.dumps({"vector_layers": [{
+            "id": layer_name, "fields": fields,
+            "minzoom": minzoom, "maxzoom": maxzoom}]}),
+    }
+    if as_mbtiles:
+        mbtiles = open_mbtiles(output, metadata)
+    elif not os.path.isdir(output):
+        os.makedirs(output)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for z in range(minzoom, maxzoom + 1):
+            # About one pixel of a tile at this zoom, in meters
+            pixel = 2 * HALF_WORLD / 2 ** z / SET.TILE_EXTENT
+            zoom_geoms = shapely.coverage_simplify(mercator_geoms, pixel)
+            assigned = assign_tiles(zoom_geoms, z)
+            tiles = [(x, y, group["feature"].tolist()) for (x, y), group
+                     in assigned.groupby(["x", "y"], sort=False)]
+
+            # Send each batch only the features it needs
+            futures = []
+            for start in range(0, len(tiles), SET.TILE_BATCH_SIZE):
+                batch = tiles[start:start + SET.TILE_BATCH_SIZE]
+                feature_ids = {i for _, _, ids in batch for i in ids}
+                futures.append(pool.submit(
+                    render_tiles, z, batch,
+                    {i: shapely.to_wkb(zoom_geoms[i]) for i in feature_ids},
+                    {i: properties[i] for i in feature_ids},
+                    layer_name, SET.TILE_EXTENT, SET.TILE_BUFFER))
+
+            for future in futures:
+                for z_, x, y, tile in future.result():
+                    if as_mbtiles:
+                        mbtiles.execute(
+                            "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                            (z_, x, 2 ** z_ - 1 - y, gzip.compress(tile)))
+                    else:
+                        tile_folder = os.path.join(output, str(z_), str(x))
+                        os.makedirs(tile_folder, exist_ok=True)
+                        with open(os.path.join(tile_folder, f"{y}.pbf"),
+                                  "wb") as tile_file:
+                            tile_file.write(tile)
+            if as_mbtiles:
+                mbtiles.commit()
+
+    if as_mbtiles:
+        mbtiles.close()
+    else:
+        with open(os.path.join(output, "metadata.json"), "w") as meta_file:
+            json.dump(metadata, meta_file, indent=2)
+    return output
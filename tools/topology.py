@@ -0,0 +1,288 @@
+"""
+Neighboring block groups share their boundaries, and shapefiles store
+every shared boundary twice, once for each neighbor. TopoJSON instead
+stores each shared stretch of boundary, or arc, once and has both
+neighbors point to it. This module turns a GeoDataFrame into TopoJSON.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, make_topology returns the TopoJSON of a GeoDataFrame as a
+    dict, with its other columns kept as properties.
+
+    hi_topology = make_topology(hi_gdf, "block_groups")
+
+    Second, write_topojson writes the same straight to file.
+
+    write_topojson(hi_gdf, "hi_cvap_acs.topojson")
+
+    census_adder.make_race_cvap_topojson does this for a whole state.
+
+Notes
+-----
+Following the TopoJSON specification, https://github.com/topojson/
+topojson-specification, three things make the output compact.
+
+Quantization
+    Coordinates are snapped to a grid of quantization by quantization
+    integer steps across the bounding box, given in the "transform".
+Shared arcs
+    Rings are cut wherever a point's neighbors change, i.e. at the
+    junctions where three block groups meet. Each stretch between
+    junctions is stored once. Neighbors that trace it backwards point
+    to it as ~i, i.e. -i - 1.
+Delta encoding
+    After the first point of an arc, each point is stored as the small
+    step from the point before it.
+
+Junctions are found for every point of a state at once with numpy. A
+point is a junction if it is found with more than one pair of
+neighboring points, no matter in which order the pair is traced.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+try: from schema import to_output_dtypes
+except: from tools.schema import to_output_dtypes
+
+
+def snap_ring(ring, transform: dict) -> np.ndarray:
+    """
+    Snaps a ring to the quantization grid, dropping points snapped onto
+    the point before them and the closing point.
+    """
+    coords = shapely.get_coordinates(ring)
+    (scale_x, scale_y), (minx, miny) = transform["scale"], \
+                                       transform["translate"]
+    grid = np.column_stack([
+        np.round((coords[:, 0] - minx) / scale_x),
+        np.round((coords[:, 1] - miny) / scale_y),
+    ]).astype(np.int64)
+    keep = np.ones(len(grid), dtype=bool)
+    keep[1:] = (np.diff(grid, axis=0) != 0).any(axis=1)
+    return grid[keep][:-1]
+
+def quantize_rings(gdf, quantization: int) -> tuple:
+    """
+    Snaps the rings of every polygon to the quantization grid.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        GeoDataFrame of Polygons and MultiPolygons.
+    quantization: int
+        Number of grid steps across the bounding box in each direction.
+
+    Returns
+    -------
+    tuple
+        transform dict, bbox list, a list of rings as int64 arrays of
+        grid points without their closing point, and for each feature a
+        list of polygons, each a list of ring indices.
+
+    """
+    minx, miny, maxx, maxy = gdf.total_bounds
+    scale_x = (maxx - minx) / (quantization - 1) or 1
+    scale_y = (maxy - miny) / (quantization - 1) or 1
+    transform = {"scale": [float(scale_x), float(scale_y)],
+                 "translate": [float(minx), float(miny)]}
+
+    rings = []
+    features = []
+    for geom in gdf.geometry.to_numpy():
+        polygons = []
+        for polygon in getattr(geom, "geoms", [geom]):
+            if polygon is None or polygon.is_empty:
+                continue
+            grids = [snap_ring(ring, transform)
+                     for ring in [polygon.exterior, *polygon.interiors]]
+            # A polygon whose exterior collapsed is dropped whole.
+            if len(grids[0]) < 3:
+                continue
+            ring_ids = []
+            for grid in grids:
+                if len(grid) >= 3:
+                    ring_ids.append(len(rings))
+                    rings.append(grid)
+            polygons.append(ring_ids)
+        features.append(polygons)
+    return transform, [minx, miny, maxx, maxy], rings, features
+
+def find_junctions(rings: list) -> np.ndarray:
+    """
+    Marks every ring point that is a junction, where a point is found
+    with more than one pair of neighbors.
+
+    Parameters
+    ----------
+    rings: list of numpy.ndarray
+        Rings of grid points, without closing points.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean of each point of every ring, concatenated in order.
+
+    """
+    points = np.concatenate(rings)
+    lengths = np.array([len(ring) for ring in rings])
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    sizes = np.repeat(lengths, lengths)
+    position = np.arange(len(points)) - starts
+
+    # One int64 per grid point, x in the high 32 bits
+    keys = (points[:, 0] << 32) | points[:, 1]
+    before = keys[starts + (position - 1) % sizes]
+    after = keys[starts + (position + 1) % sizes]
+    pairs = pd.DataFrame({
+        "key": keys,
+        "low": np.minimum(before, after),
+        "high": np.maximum(before, after),
+    }).drop_duplicates()
+    pair_counts = pairs["key"].value_counts()
+    return np.isin(keys, pair_counts.index[pair_counts > 1].to_numpy())
+
+def cut_arcs(rings: list, junctions: np.ndarray) -> tuple:
+    """
+    Cuts rings into arcs at junctions, keeping each arc only once.
+
+    Returns
+    -------
+    tuple
+        List of unique arcs as int64 arrays of grid points, and for each
+        ring its list of arc indices, ~i where traced backwards.
+
+    """
+    arcs = []
+    arc_index = {}
+    ring_arcs = []
+    start = 0
+    for ring in rings:
+        ring_junctions = np.flatnonzero(junctions[start:start + len(ring)])
+        start += len(ring)
+        if len(ring_junctions):
+            # Start the ring on a junction and cut at every other one.
+            ring = np.roll(ring, -ring_junctions[0], axis=0)
+            cuts = list(ring_junctions - ring_junctions[0]) + [len(ring)]
+            ring = np.vstack([ring, ring[:1]])
+            pieces = [ring[cuts[i]:cuts[i + 1] + 1]
+                      for i in range(len(cuts) - 1)]
+        else:
+            # A ring with no junctions is an arc of its own. Start it at
+            # its lowest point so a neighbor tracing it finds the same.
+            first = np.lexsort((ring[:, 1], ring[:, 0]))[0]
+            ring = np.roll(ring, -first, axis=0)
+            pieces = [np.vstack([ring, ring[:1]])]
+
+        indices = []
+        for piece in pieces:
+            forward = piece.tobytes()
+            if forward in arc_index:
+                indices.append(arc_index[forward])
+                continue
+            backward = piece[::-1].tobytes()
+            if backward in arc_index:
+                indices.append(~arc_index[backward])
+                continue
+            arc_index[forward] = len(arcs)
+            indices.append(len(arcs))
+            arcs.append(piece)
+        ring_arcs.append(indices)
+    return arcs, ring_arcs
+
+def make_topology(gdf, object_name: str = None,
+                  quantization: int = None) -> dict:
+    """
+    Returns the TopoJSON of a GeoDataFrame of polygons as a dict, with
+    shared arcs, quantized coordinates and delta-encoded arcs.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        GeoDataFrame of Polygons and MultiPolygons, e.g. Block Groups.
+    object_name: str
+        Name of the object holding the features. Defaults to
+        TOPOJSON_OBJECT in settings.
+    quantization: int
+        Number of grid steps across the bounding box. Defaults to
+        TOPOJSON_QUANTIZATION in settings.
+
+    Returns
+    -------
+    dict
+        TopoJSON Topology.
+
+    """
+    object_name = object_name if object_name else SET.TOPOJSON_OBJECT
+    quantization = int(quantization if quantization
+                       else SET.TOPOJSON_QUANTIZATION)
+
+    transform, bbox, rings, features = quantize_rings(gdf, quantization)
+    junctions = find_junctions(rings) if rings else np.array([], dtype=bool)
+    arcs, ring_arcs = cut_arcs(rings, junctions)
+
+    data = to_output_dtypes(gdf.drop(columns=gdf.geometry.name))
+    records = data.astype(object).where(data.notna(), None).to_dict("records")
+
+    geometries = []
+    for polygons, properties in zip(features, records):
+        geometry = {"type": None, "properties": properties}
+        if len(polygons) == 1:
+            geometry["type"] = "Polygon"
+            geometry["arcs"] = [ring_arcs[ring] for ring in polygons[0]]
+        elif polygons:
+            geometry["type"] = "MultiPolygon"
+            geometry["arcs"] = [[ring_arcs[ring] for ring in polygon]
+                                for polygon in polygons]
+        if "GEOID" in properties:
+            geometry["id"] = properties["GEOID"]
+        geometries.append(geometry)
+
+    # First point whole, then steps from the point before
+    encoded_arcs = [np.vstack([arc[:1], np.diff(arc, axis=0)]).tolist()
+                    for arc in arcs]
+    return {
+        "type": "Topology",
+        "bbox": [float(value) for value in bbox],
+        "transform": transform,
+        "objects": {object_name: {"type": "GeometryCollection",
+                                  "geometries": geometries}},
+        "arcs": encoded_arcs,
+    }
+
+def write_topojson(gdf, output: str, object_name: str = None,
+                   quantization: int = None) -> str:
+    """
+    Writes the TopoJSON of a GeoDataFrame of polygons to file.
+
+    Parameters
+    ----------
+    gdf: geopandas.GeoDataFrame
+        GeoDataFrame of Polygons and MultiPolygons, e.g. Block Groups.
+    output: str
+        Filename for the TopoJSON.
+    object_name: str
+        Name of the object holding the features. Defaults to
+        TOPOJSON_OBJECT in settings.
+    quantization: int
+        Number of grid steps across the bounding box. Defaults to
+        TOPOJSON_QUANTIZATION in settings.
+
+    Returns
+    -------
+    str
+        Filename of the TopoJSON.
+
+    """
+    topology = make_topology(gdf, object_name, quantization)
+    with open(output, "w") as topojson_file:
+        json.dump(topology, topojson_file, separators=(",", ":"))
+    return output
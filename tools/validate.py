@@ -0,0 +1,202 @@
+"""
+A merge can run without error and still make no sense, e.g. when most
+TIGER block groups find no CVAP data or race categories do not add up.
+This module checks merged block groups against such invariants, each a
+vectorized expression over whole columns, and reports on every state.
+
+Examples
+--------
+This module has two functions that can be used separately.
+
+    First, validate_race_cvap returns a report on merged block groups,
+    listing how many rows fail each check and some of their GEOIDs.
+
+    hi_report = validate_race_cvap(hi_race_cvap_gdf, "HI")
+    hi_report["passed"]
+
+    In strict mode, any failed check raises a ValueError instead, which
+    fails the build.
+
+    validate_race_cvap(hi_race_cvap_gdf, "HI", strict=True)
+
+    Second, write_report saves the report as JSON, as make_race_cvap_shp
+    does next to each shapefile.
+
+    write_report(hi_report, "HI_cvap_acs_validation.json")
+
+Notes
+-----
+The following checks are run on any columns that are present.
+
+tiger_without_cvap, tiger_without_race
+    Block groups left without CVAP or race data by the left join.
+unmatched_cvap, unmatched_race
+    CVAP or race GEOIDs not found among TIGER block groups, from the
+    "join_report" of the merge.
+duplicate_geoids
+    GEOIDs found more than once.
+race_sum_is_totpop
+    Non-Hispanic race categories and HISP add up to TOTPOP.
+cvap_at_most_cpop
+    Citizens of voting age are no more than citizens.
+cvap_groups_at_most_cvap
+    No CVAP group is larger than CVAP.
+
+Whether strict mode is on by default is set in the settings with
+VALIDATION_STRICT. Each report lists at most VALIDATION_EXAMPLES GEOIDs
+for each check.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+# To make work in project or editor namespace
+try: import settings as SET
+except: import tools.settings as SET
+
+
+# Parts of TOTPOP in ACS table B03002
+RACE_PARTS = ["NH_WHITE", "NH_BLACK", "NH_AMIN", "NH_ASIAN", "NH_NHPI",
+              "NH_OTHER", "NH_2MORE", "HISP"]
+
+CVAP_GROUPS = ["HCVAP", "WCVAP", "BCVAP", "AMINCVAP", "ASIANCVAP",
+               "NHPICVAP", "OTHERCVAP", "2MORECVAP"]
+
+def _counts(frame: pd.DataFrame, col: str) -> np.ndarray:
+    """
+    Returns a count column as float64, with missing values as NaN.
+    """
+    return frame[col].astype("float64").to_numpy()
+
+def find_failures(frame: pd.DataFrame) -> dict:
+    """
+    Runs every check whose columns are present in the frame.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        Merged block groups following the MGGG schema.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        For each check, a boolean of the rows failing it.
+
+    """
+    columns = set(frame.columns)
+    failures = {}
+
+    if "CVAP" in columns:
+        failures["tiger_without_cvap"] = frame["CVAP"].isna().to_numpy()
+    if "TOTPOP" in columns:
+        failures["tiger_without_race"] = frame["TOTPOP"].isna().to_numpy()
+    failures["duplicate_geoids"] = frame["GEOID"].duplicated().to_numpy()
+
+    # Rows missing data are counted above, not failed again here
+    if columns.issuperset(RACE_PARTS + ["TOTPOP"]):
+        race_sum = np.sum([_counts(frame, col) for col in RACE_PARTS], axis=0)
+        totpop = _counts(frame, "TOTPOP")
+        failures["race_sum_is_totpop"] = (race_sum != totpop) & \
+                                         ~np.isnan(race_sum + totpop)
+    if columns.issuperset(["CVAP", "CPOP"]):
+        failures["cvap_at_most_cpop"] = _counts(frame, "CVAP") > \
+                                        _counts(frame, "CPOP")
+    groups = [col for col in CVAP_GROUPS if col in columns]
+    if groups and "CVAP" in columns:
+        largest = np.max([_counts(frame, col) for col in groups], axis=0)
+        failures["cvap_groups_at_most_cvap"] = largest > \
+                                               _counts(frame, "CVAP")
+    return failures
+
+def validate_race_cvap(frame: pd.DataFrame, state_abbr: str = "",
+                       strict: bool = None) -> dict:
+    """
+    Checks merged block groups against invariants of the data and
+    returns a report.
+
+    Parameters
+    ----------
+    frame: pandas.DataFrame
+        Merged block groups following the MGGG schema, e.g. from
+        make_race_cvap_gdf.
+    state_abbr: str
+        Two-letter state abbreviation, used in the report.
+    strict: bool
+        Flag as to whether to raise an error if any check fails.
+        Defaults to VALIDATION_STRICT in settings.
+
+    Returns
+    -------
+    dict
+        Report with the state, number of rows, whether all checks
+        passed and, for each check, the number of failures and some of
+        their GEOIDs.
+
+    Raises
+    ------
+    ValueError
+        In strict mode, if any check fails.
+
+    """
+    strict = SET.VALIDATION_STRICT if strict is None else strict
+    geoids = frame["GEOID"].astype(str).to_numpy()
+
+    checks = {}
+    for check, failed in find_failures(frame).items():
+        checks[check] = {
+            "failed": int(failed.sum()),
+            "geoids": geoids[failed][:SET.VALIDATION_EXAMPLES].tolist(),
+        }
+    join_report = frame.attrs.get("join_report", {})
+    for name in ("cvap", "race"):
+        if name in join_report:
+            unmatched = join_report[name]
+            checks[f"unmatched_{name}"] = {
+                "failed": unmatched["count"],
+                "geoids": unmatched["geoids"][:SET.VALIDATION_EXAMPLES],
+            }
+
+    report = {
+        "state": state_abbr,
+        "rows": len(frame),
+        "passed": not any(check["failed"] for check in checks.values()),
+        "checks": checks,
+    }
+    if strict and not report["passed"]:
+        failed = {check: result["failed"] for check, result in checks.items()
+                  if result["failed"]}
+        raise ValueError(f"Validation of {state_abbr} failed: {failed}")
+    return report
+
+def combine_reports(reports: list) -> dict:
+    """
+    Combines the reports of parts of a state, e.g. its counties, into
+    one. Checks of the join, reported for the whole state by each part,
+    are counted once.
+    """
+    combined = {
+        "state": reports[0]["state"] if reports else "",
+        "rows": sum(report["rows"] for report in reports),
+        "passed": all(report["passed"] for report in reports),
+        "checks": {},
+    }
+    for report in reports:
+        for check, result in report["checks"].items():
+            if check.startswith("unmatched_"):
+                combined["checks"][check] = result
+                continue
+            total = combined["checks"].setdefault(check,
+                                                  {"failed": 0, "geoids": []})
+            total["failed"] += result["failed"]
+            total["geoids"] = (total["geoids"] +
+                               result["geoids"])[:SET.VALIDATION_EXAMPLES]
+    return combined
+
+def write_report(report: dict, output: str) -> str:
+    """
+    Writes a validation report as JSON, returning its filename.
+    """
+    with open(output, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    return output